@@ -0,0 +1,273 @@
+import sys
+import os
+import json
+import time
+import logging
+import resource
+import argparse
+import subprocess
+import tempfile
+import multiprocessing as mp
+from queue import Empty
+from pathlib import Path
+import numpy as np
+
+# Set up file paths
+file_path = str(Path(__file__).absolute().parent)
+project_path = str(Path(__file__).absolute().parent.parent.parent)
+sys.path.append(project_path)
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+def stage_filter_line_noise(data_dir, n_channels):
+    from src.utils import filter_line_noise
+    data = np.load(f"{data_dir}/Probe1_lfps_spont.npy")[:n_channels]
+    # Same call as in src.loaders.process_data
+    return lambda: np.array([filter_line_noise(ts, 1000., 550) for ts in data]), data.size
+
+def stage_define_upstate_regions(data_dir, n_channels):
+    from src.utils import define_upstate_regions
+    data = np.load(f"{data_dir}/Probe1_lfps_spont.npy")[:n_channels]
+    times = np.load(f"{data_dir}/times.npy")
+    return lambda: define_upstate_regions(data, times, 0.3), data.size
+
+def stage_filter_line_noise_chunked(data_dir, n_channels):
+    from src.chunked import filter_line_noise_chunked
+    data = np.load(f"{data_dir}/Probe1_lfps_spont.npy", mmap_mode='r')[:n_channels]
+    # Memory-mapped input, blocks of at most 256 MB, result written to a memory-mapped file
+    out = os.path.join(tempfile.mkdtemp(), 'filtered.npy')
+    return lambda: filter_line_noise_chunked(data, 1000., 550, out=out, memory_budget=2 ** 28), data.size
+
+def stage_define_upstate_regions_chunked(data_dir, n_channels):
+    from src.chunked import define_upstate_regions_chunked
+    data = np.load(f"{data_dir}/Probe1_lfps_spont.npy", mmap_mode='r')[:n_channels]
+    times = np.load(f"{data_dir}/times.npy")
+    return lambda: define_upstate_regions_chunked(data, times, 0.3, memory_budget=2 ** 28), data.size
+
+def stage_make_splits(data_dir, n_channels):
+    from src.utils import make_splits
+    data = np.load(f"{data_dir}/Probe1_lfps_spont.npy")[:n_channels]
+    times = np.load(f"{data_dir}/times.npy")
+    upstates = np.load(f"{data_dir}/upstates_true.npy")
+    return lambda: make_splits(data, times, upstates), data.size
+
+def stage_lagged_correlation(data_dir, n_channels):
+    from src.utils import make_splits, lagged_correlation
+    probe = np.load(f"{data_dir}/Probe2_lfps_spont.npy")[0]
+    ecog = np.load(f"{data_dir}/Probe1_lfps_spont.npy", mmap_mode='r')[:n_channels].mean(axis=0)
+    times = np.load(f"{data_dir}/times.npy")
+    upstates = np.load(f"{data_dir}/upstates_true.npy")
+
+    # Same loop as in upstate_downstate_pcc.py for one probe channel
+    def run():
+        for probe_wind, ecog_wind in zip(make_splits(probe, times, upstates)[0], make_splits(ecog, times, upstates)[0]):
+            if len(probe_wind) >= 2:
+                lagged_correlation(probe_wind, ecog_wind)
+    return run, probe.size
+
+def stage_detect_spikes(data_dir, n_channels):
+    # read_spikes needs .ncs files, the native detector runs on the same raw 20 kHz data
+    from src.spike_detection import detect_spikes
+    data = np.load(f"{data_dir}/Probe2_spikes_raw.npy")
+    return lambda: detect_spikes(data), data.size
+
+def stage_fooof(data_dir, n_channels):
+    from neurodsp.spectral import compute_spectrum_welch
+    from fooof import FOOOF
+    from src.utils import make_splits
+    data = np.load(f"{data_dir}/Probe2_lfps_spont.npy")[:4]
+    times = np.load(f"{data_dir}/times.npy")
+    upstates = np.load(f"{data_dir}/upstates_true.npy")
+    intervals = [interval for values in make_splits(data, times, upstates).values() for interval in values
+                 if len(interval) >= 500]
+
+    # Same loop as in spectral_analysis_by_intervals.py
+    def run():
+        for interval in intervals:
+            freqs, powers = compute_spectrum_welch(interval, fs=1000, nperseg=500, f_range=(0, 100), noverlap=0)
+            fm = FOOOF(verbose=False)
+            fm.fit(freqs, powers, freq_range=(1, 100))
+    return run, sum(len(interval) for interval in intervals)
+
+STAGES = {
+    'filter_line_noise': stage_filter_line_noise,
+    'define_upstate_regions': stage_define_upstate_regions,
+    'filter_line_noise_chunked': stage_filter_line_noise_chunked,
+    'define_upstate_regions_chunked': stage_define_upstate_regions_chunked,
+    'make_splits': stage_make_splits,
+    'lagged_correlation': stage_lagged_correlation,
+    'detect_spikes': stage_detect_spikes,
+    'fooof': stage_fooof,
+}
+
+def _run_stage(stage, data_dir, n_channels, repeat, queue):
+    """
+    Run one stage in a fresh process and report wall time, processed samples and peak RSS.
+
+    Every stage function imports its dependencies and loads its inputs, and returns the timed callable together with
+    the number of processed samples, so imports and disk reads are not part of the measured wall time. The best of
+    repeat runs is reported.
+    """
+    func, n_samples = STAGES[stage](data_dir, n_channels)
+    wall_time = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        wall_time = min(wall_time, time.perf_counter() - start)
+    # ru_maxrss is in kilobytes on Linux
+    queue.put((wall_time, n_samples, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+def measure(stage, data_dir, n_channels, repeat=3, timeout=None, poll=1.):
+    """
+    Measure a stage in a fresh process (see _run_stage). If the process dies without a result (exception, killed when
+    out of memory) or runs longer than timeout seconds, the failure is returned in 'error' instead of measurements.
+    """
+    ctx = mp.get_context('spawn')
+    queue = ctx.Queue()
+    process = ctx.Process(target=_run_stage, args=(stage, data_dir, n_channels, repeat, queue))
+    process.start()
+    deadline = None if timeout is None else time.monotonic() + timeout
+    error = None
+    while True:
+        try:
+            wall_time, n_samples, peak_rss = queue.get(timeout=poll)
+            break
+        except Empty:
+            if not process.is_alive():
+                # The result may have been sent right before the process exited
+                try:
+                    wall_time, n_samples, peak_rss = queue.get(timeout=poll)
+                    break
+                except Empty:
+                    error = f"process exited with code {process.exitcode} without a result"
+                    break
+            if deadline is not None and time.monotonic() > deadline:
+                process.terminate()
+                error = f"timed out after {timeout:g} s"
+                break
+    process.join()
+    if error is not None:
+        return {'wall_time': None, 'throughput': None, 'peak_rss_mb': None, 'error': error}
+    return {'wall_time': wall_time, 'throughput': n_samples / wall_time, 'peak_rss_mb': peak_rss}
+
+# Modules whose import time is measured (each in a fresh interpreter)
+IMPORT_MODULES = ['src', 'src.utils', 'src.loaders', 'src.plotting', 'src.spike_detection', 'src.travelling_waves',
+                  'src.synthetic']
+
+def measure_import(module, repeat=3):
+    """
+    Best wall time and peak RSS of importing a module (and of its first attribute access for the package itself).
+    """
+    code = (f"import time, resource; start = time.perf_counter(); import {module}; "
+            f"{'from src import *; ' if module == 'src' else ''}"
+            f"print(time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)")
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c', code], cwd=project_path, text=True)
+        runs.append(tuple(float(x) for x in output.split()[-2:]))
+    wall_time, peak_rss = min(runs)
+    return {'wall_time': wall_time, 'throughput': None, 'peak_rss_mb': peak_rss}
+
+def current_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=project_path, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def run(args):
+    from src.synthetic import generate_recording
+
+    stages = args.stages or list(STAGES)
+    results = []
+    if not args.skip_imports:
+        for module in IMPORT_MODULES:
+            result = measure_import(module, args.repeat)
+            result.update({'stage': f'import {module}', 'duration': 0, 'n_channels': 0})
+            logging.info(f"import {module}: {result['wall_time']:.3f} s, {result['peak_rss_mb']:.0f} MB")
+            results.append(result)
+
+    for duration in args.durations:
+        for n_channels in args.channels:
+            with tempfile.TemporaryDirectory() as data_dir:
+                logging.info(f"Generating {duration} s recording with {n_channels} channels ...")
+                generate_recording(data_dir, duration=duration, n_ecog=n_channels, spikes='detect_spikes' in stages,
+                                   dtype=np.float32, seed=0)
+                for stage in stages:
+                    result = measure(stage, data_dir, n_channels, args.repeat, args.timeout)
+                    result.update({'stage': stage, 'duration': duration, 'n_channels': n_channels})
+                    results.append(result)
+                    if 'error' in result:
+                        logging.error(f"{stage} ({duration} s, {n_channels} ch) failed: {result['error']}")
+                        continue
+                    logging.info(f"{stage} ({duration} s, {n_channels} ch): {result['wall_time']:.3f} s, "
+                                 f"{result['throughput']:.3g} samples/s, {result['peak_rss_mb']:.0f} MB")
+
+    # Save results of the current commit
+    commit = current_commit()
+    output_dir = f"{project_path}/res/benchmarks"
+    os.makedirs(output_dir, exist_ok=True)
+    output = args.output or f"{output_dir}/{commit}.json"
+    with open(output, 'w') as f:
+        json.dump({'commit': commit, 'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'results': results}, f, indent=2)
+    logging.info(f"Results saved to {output}")
+
+def compare(args):
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    key = lambda r: (r['stage'], r['duration'], r['n_channels'])
+    base_results = {key(r): r for r in base['results']}
+
+    regressions = 0
+    print(f"{'stage':<24}{'duration':>10}{'channels':>10}{'time ratio':>12}{'rss ratio':>12}")
+    for r in new['results']:
+        if key(r) not in base_results:
+            continue
+        b = base_results[key(r)]
+        if r.get('error') or b.get('error'):
+            # A stage that fails now is a regression, one that failed before cannot be compared
+            failed = bool(r.get('error'))
+            regressions += failed
+            print(f"{r['stage']:<24}{r['duration']:>10}{r['n_channels']:>10}{'FAILED':>12}{'':>12}"
+                  f"{'  REGRESSION' if failed else ''}")
+            continue
+        time_ratio = r['wall_time'] / b['wall_time']
+        rss_ratio = r['peak_rss_mb'] / b['peak_rss_mb']
+        flag = time_ratio > 1 + args.threshold or rss_ratio > 1 + args.threshold
+        regressions += flag
+        print(f"{r['stage']:<24}{r['duration']:>10}{r['n_channels']:>10}{time_ratio:>12.2f}{rss_ratio:>12.2f}"
+              f"{'  REGRESSION' if flag else ''}")
+
+    print(f"{regressions} regression(s) beyond {args.threshold:.0%} ({base['commit']} -> {new['commit']})")
+    return 1 if regressions else 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the analysis hot paths on synthetic recordings.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='Run the benchmarks and save the results of the current commit.')
+    run_parser.add_argument('--durations', type=float, nargs='+', default=[60, 300], help='Recording durations in seconds.')
+    run_parser.add_argument('--channels', type=int, nargs='+', default=[16, 64], help='Numbers of ECoG channels.')
+    run_parser.add_argument('--stages', type=str, nargs='+', choices=list(STAGES), help='Stages to run (all by default).')
+    run_parser.add_argument('--repeat', type=int, default=3, help='Number of runs per stage (best time is kept).')
+    run_parser.add_argument('--skip_imports', action='store_true', help='Do not measure the import times of src.')
+    run_parser.add_argument('--timeout', type=float, default=None,
+                            help='Seconds after which a stage is stopped and reported as failed (no limit by default).')
+    run_parser.add_argument('--output', type=str, help='Output json file (res/benchmarks/<commit>.json by default).')
+
+    compare_parser = subparsers.add_parser('compare', help='Compare two result files and flag regressions.')
+    compare_parser.add_argument('base', type=str, help='Baseline results (json).')
+    compare_parser.add_argument('new', type=str, help='New results (json).')
+    compare_parser.add_argument('--threshold', type=float, default=0.1, help='Relative slowdown flagged as regression.')
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args)
+    else:
+        sys.exit(compare(args))
+
+if __name__ == "__main__":
+    main()
@@ -32,6 +32,9 @@ def plot_correlation(exp):
     os.chdir(project_path)
     sys.path.append(project_path)
 
+    # Import custom modules
+    from src.plotting import shade_intervals
+
     input_dir = f"{project_path}/data/processed/{exp}"
     output_dir = f"{project_path}/res/signal-to-signal-correlation/{exp}"
 
@@ -123,8 +126,7 @@ def plot_correlation(exp):
         for i, probe_d in enumerate(probe):
             ax.plot(times, probe_d - 0.001*i, label=f'Channel {i}', color='tab:blue')
 
-        for i in range(len(event_times)):
-            ax.axvspan(event_times[i][0], event_times[i][1], alpha=0.2, color='tab:green')
+        shade_intervals(ax, event_times, t_range=(100, 125), alpha=0.2, color='tab:green')
 
         ax.set_title(f'Probe {j+1} channels with upstate times overlayed')
         ax.set_xlabel('Time (s)')
@@ -164,8 +166,7 @@ def plot_correlation(exp):
         for i, channel_data in enumerate(data[j]):
             ax.plot(times, channel_data - 0.001*i, label=f'Channel {i}')
 
-        for i in range(len(event_times)):
-            ax.axvspan(event_times[i][0], event_times[i][1], alpha=0.2, color='tab:green')
+        shade_intervals(ax, event_times, t_range=(100, 125), alpha=0.2, color='tab:green')
 
     # Save figure
     plt.savefig(f'{output_dir}/supplementary_figure_all_probes_signal.png')
@@ -15,6 +15,7 @@ def compute_correlation(exp):
     sys.path.append(project_path)
 
     from src.utils import split_intervals, lagged_correlation
+    from src.shared import load_experiment
 
     input_dir = f"{project_path}/data/processed/{exp}"
     output_dir = f"{project_path}/res/signal-to-signal-correlation/{exp}"
@@ -23,19 +24,9 @@ def compute_correlation(exp):
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    files = os.listdir(input_dir)
-    for file in files:
-        if file.endswith('.npy'):
-            if file == 'Probe1_lfps_spont.npy':
-                ecog_data = np.load(input_dir + '/' + file, allow_pickle=True)
-            if file == 'Probe2_lfps_spont.npy':
-                probe1_data = np.load(input_dir + '/' + file, allow_pickle=True)
-            if file == 'Probe3_lfps_spont.npy':
-                probe2_data = np.load(input_dir + '/' + file, allow_pickle=True)
-            if file == 'times.npy':
-                times = np.load(input_dir + '/' + file, allow_pickle=True)
-            if file == 'event_times.npy':
-                event_times = np.load(input_dir + '/' + file, allow_pickle=True)
+    # Load the recordings (attached from shared memory if share_experiment.py serves the experiment)
+    ecog_data, probe1_data, probe2_data, times, event_times = load_experiment(
+        exp, input_dir, ['Probe1_lfps_spont', 'Probe2_lfps_spont', 'Probe3_lfps_spont', 'times', 'event_times'])
 
     # Compute average of ecog data along the 0th axis
     ecog_data_avg = np.mean(ecog_data, axis=0)
@@ -0,0 +1,53 @@
+import sys
+import os
+import logging
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import argparse
+
+# Set up file paths
+file_path = str(Path().absolute())
+project_path = str(Path().absolute().parent.parent)
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logging.info(f"Current file directory: {file_path}")
+logging.info(f"Current project directory: {project_path}")
+
+os.chdir(project_path)
+sys.path.append(project_path)
+
+# Import custom modules
+from src.travelling_waves import build_wave_catalogue
+
+def main(args):
+    exp = args.exp
+    input_dir = f"{project_path}/data/processed/{exp}"
+    output_dir = f"{project_path}/res/travelling-waves-detection/{exp}"
+
+    # Create output directory if it doesn't exist
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Read upstate event times
+    upstates = np.load(f"{input_dir}/event_times.npy", allow_pickle=True)
+    logging.info(f"Number of upstates: {len(upstates)}")
+
+    # Catalogue travelling waves within each upstate
+    events = build_wave_catalogue(f"{input_dir}/Probe1_lfps_spont.npy", f"{input_dir}/times.npy", upstates,
+                                  f_range=tuple(args.f_range), pgd_threshold=args.pgd_threshold, n_jobs=args.n_jobs)
+    logging.info(f"Number of travelling waves: {len(events)}")
+
+    # Save the catalogue as numpy structured array and csv table
+    np.save(f"{input_dir}/wave_events.npy", events)
+    pd.DataFrame(events).to_csv(f"{output_dir}/wave_events_{exp}.csv", index=False)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Catalogue travelling waves within upstates.")
+    parser.add_argument("exp", type=str, help="The name of the experiment (e.g., 'w12_07.spont').")
+    parser.add_argument("--f_range", type=float, nargs=2, default=[7, 13], help="Frequency band of the waves in Hz.")
+    parser.add_argument("--pgd_threshold", type=float, default=0.5, help="Minimal phase gradient directionality of a wave.")
+    parser.add_argument("--n_jobs", type=int, default=4, help="Number of worker processes.")
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,99 @@
+import sys
+import os
+import logging
+from pathlib import Path
+from glob import glob
+import argparse
+import numpy as np
+
+def archive(exp, raw, codec, gain, lossy, chunk_size, n_jobs, verify):
+    # Set up file paths
+    file_path = str(Path().absolute())
+    project_path = str(Path().absolute().parent.parent)
+
+    # Set up logging
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    logging.info(f"Current file directory: {file_path}")
+    logging.info(f"Current project directory: {project_path}")
+
+    os.chdir(project_path)
+    sys.path.append(project_path)
+
+    # Import custom modules
+    from src.archive import write_archive, Archive
+
+    # Quantization step: estimated from the data, fixed or none
+    gain = None if gain == 'none' else gain if gain == 'auto' else float(gain)
+
+    if raw:
+        # Raw recordings, read with neo and stored with their sampling rate, start time and units
+        from src.loaders import load_ncs_data, load_ibw_data
+        input_dir = f"{project_path}/data/raw/{exp}"
+        files = sorted(glob(f"{input_dir}/*.ncs") + glob(f"{input_dir}/*.ibw"))
+
+        def load_sources():
+            # One file at a time, so that only one raw recording is held in memory
+            for file in files:
+                signal, times = (load_ncs_data if file.endswith('.ncs') else load_ibw_data)(file)
+                yield (file, np.asarray(signal.magnitude).T, float(signal.sampling_rate.rescale('Hz').magnitude),
+                       float(times[0].magnitude), str(signal.units.dimensionality))
+    else:
+        # Processed arrays, sampled at 1 kHz from the start of the recording
+        input_dir = f"{project_path}/data/processed/{exp}"
+        files = sorted(glob(f"{input_dir}/*.npy"))
+
+        def load_sources():
+            for file in files:
+                try:
+                    data = np.load(file, mmap_mode='r')
+                except ValueError:
+                    logging.warning(f"{file} holds Python objects, skipped")
+                    continue
+                yield (file, data, 1000., 0., None)
+
+    total, archived, n_archived = 0, 0, 0
+    for file, data, fs, t0, units in load_sources():
+        output_path = f"{os.path.splitext(file)[0]}.twa"
+        try:
+            write_archive(output_path, data, fs, t0=t0, gain=gain, chunk_size=chunk_size, codec=codec,
+                          lossless=not lossy, units=units, n_jobs=n_jobs)
+        except ValueError as error:
+            # Structured arrays (e.g. wave events) stay .npy only
+            logging.warning(f"{os.path.basename(file)} skipped: {error}")
+            continue
+        total += data.nbytes
+        archived += os.path.getsize(output_path)
+        n_archived += 1
+
+        if verify:
+            # Read back and compare with the source
+            with Archive(output_path, n_jobs) as a:
+                restored = np.asarray(a)
+            if lossy:
+                logging.info(f"{os.path.basename(output_path)}: max error {np.nanmax(np.abs(restored - data)):.3g}")
+            elif not np.array_equal(restored, data, equal_nan=np.issubdtype(restored.dtype, np.inexact)):
+                raise RuntimeError(f"{output_path} does not restore {file}")
+
+    if n_archived:
+        logging.info(f"{n_archived} file(s): {total / 2 ** 20:.1f} MB -> {archived / 2 ** 20:.1f} MB (ratio {total / max(archived, 1):.2f})")
+
+def main():
+    # Set up argument parser
+    parser = argparse.ArgumentParser(description='Store the recordings of an experiment as compressed archives.')
+    parser.add_argument('exp', type=str, help='Experiment code')
+    parser.add_argument('--raw', action='store_true', help='Archive the raw .ncs/.ibw files instead of the processed arrays')
+    parser.add_argument('--codec', type=str, default=None, choices=['zstd', 'zlib', 'lzma', 'none'],
+                        help='Compression codec (zstd if installed, zlib otherwise)')
+    parser.add_argument('--gain', type=str, default='auto', help="Quantization step: 'auto', 'none' or a value")
+    parser.add_argument('--lossy', action='store_true', help='Round float samples to multiples of the gain')
+    parser.add_argument('--chunk_size', type=int, default=2 ** 16, help='Samples per chunk')
+    parser.add_argument('--n_jobs', type=int, default=4, help='Number of chunks compressed in parallel')
+    parser.add_argument('--verify', action='store_true', help='Read the archives back and compare with the sources')
+
+    # Parse command-line arguments
+    args = parser.parse_args()
+
+    archive(args.exp, args.raw, args.codec, args.gain, args.lossy, args.chunk_size, args.n_jobs, args.verify)
+
+if __name__ == "__main__":
+    main()
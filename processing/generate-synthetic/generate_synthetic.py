@@ -0,0 +1,44 @@
+import sys
+import os
+import logging
+from pathlib import Path
+import argparse
+
+def generate_synthetic(exp_name, duration, spikes, seed):
+    # Set up file paths
+    file_path = str(Path().absolute())
+    project_path = str(Path().absolute().parent.parent)
+
+    # Set up logging
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    logging.info(f"Current file directory: {file_path}")
+    logging.info(f"Current project directory: {project_path}")
+
+    os.chdir(project_path)
+    sys.path.append(project_path)
+
+    # Import custom modules
+    from src.synthetic import generate_recording
+
+    # Synthetic data are written like preprocessed experiments
+    output_dir = f"{project_path}/data/processed/{exp_name}"
+    logging.info(f"Output directory: {output_dir}")
+
+    upstates = generate_recording(output_dir, duration=duration, spikes=spikes, seed=seed)
+    logging.info(f"Synthetic recording of {duration} s with {len(upstates)} upstates saved.")
+
+def main():
+    # Set up argument parser
+    parser = argparse.ArgumentParser(description='Generate a synthetic ECoG/probe recording.')
+    parser.add_argument('exp_name', type=str, help='Experiment name of the synthetic recording')
+    parser.add_argument('--duration', type=float, default=600., help='Duration in seconds')
+    parser.add_argument('--no_spikes', action='store_true', help='Do not generate the 20 kHz probe data with spikes')
+    parser.add_argument('--seed', type=int, default=None, help='Seed of the random generator')
+
+    # Parse command-line arguments
+    args = parser.parse_args()
+
+    generate_synthetic(args.exp_name, args.duration, not args.no_spikes, args.seed)
+
+if __name__ == "__main__":
+    main()
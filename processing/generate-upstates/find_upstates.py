@@ -27,6 +27,8 @@ def find_upstates(exp_name):
 
     # Import custom modules
     from src.utils import define_upstate_regions
+    from src.plotting import plot_decimated, fill_between_decimated, shade_intervals
+    from src.profiling import stage
 
     # Read parameters from yml file
     parameters_path = f"{file_path}/find_upstates.yml"
@@ -63,17 +65,20 @@ def find_upstates(exp_name):
     # Load only ECoG data
     ecog_path = f"{input_dir}/Probe1_lfps_spont.npy"
     ecog_times_path = f"{input_dir}/times.npy"
-    ts_ecog = np.load(ecog_path)
-    times_ecog = np.load(ecog_times_path)
+    with stage('load'):
+        ts_ecog = np.load(ecog_path)
+        times_ecog = np.load(ecog_times_path)
 
     # Filter (low-pass) all channels of ECoG data to smoothe out high-frequency signal for upstate detection
-    sig_filt = np.array([filter_signal(sig, 1000 * pq.Hz, 'lowpass', freq_range) for sig in ts_ecog])
+    with stage('lowpass', items=ts_ecog.size):
+        sig_filt = np.array([filter_signal(sig, 1000 * pq.Hz, 'lowpass', freq_range) for sig in ts_ecog])
 
-    # Remove nan values from the filtered signal
-    sig_filt = np.nan_to_num(sig_filt)
+        # Remove nan values from the filtered signal
+        sig_filt = np.nan_to_num(sig_filt)
 
     # Define upstate regions
-    event_times, threshold_value = define_upstate_regions(sig_filt, times_ecog, threshold_scalar)
+    with stage('upstates'):
+        event_times, threshold_value = define_upstate_regions(sig_filt, times_ecog, threshold_scalar)
 
     # Save event times to output directory as numpy array file
     np.save(f"{output_dir}/event_times.npy", event_times)
@@ -87,52 +92,53 @@ def find_upstates(exp_name):
             downstate_durations.append(event_times[i+1][0] - event_times[i][1])
 
 
-    # Set GridSpec for the figure
-    fig = plt.figure(figsize=(20, 15))
-    gs = GridSpec(2, 3, figure=fig)
-    ax1 = fig.add_subplot(gs[0, 0:2]) # Filtered signal snippet 
-    ax2 = fig.add_subplot(gs[0, 2]) # Interval durations histogram
-    ax3 = fig.add_subplot(gs[-1, :]) # Upstates with filtered signal snippet
-
-    # Plot filtered time series snippet
-    ax1.plot(times_ecog, ts_ecog[0], label='Raw signal', alpha=0.4, color='tab:cyan')
-    ax1.plot(times_ecog, sig_filt[0], label='Filtered signal', color='tab:red')
-    ax1.set_xlabel('Time (s)')
-    ax1.set_ylabel('Voltage')
-    ax1.set_title('Filtered ECoG time series snippet, channel 0')
-    ax1.legend()
-    ax1.set_xlim(0, 10)
-
-    # Plot upstate/downstate duration histogram
-    ax2.hist(upstate_durations, bins=100, label='Upstate duration', alpha=0.5)
-    ax2.hist(downstate_durations, bins=100, label='Downstate duration', alpha=0.2)
-    ax2.set_xlabel('Duration (s)')
-    ax2.set_ylabel('Count')
-    ax2.set_title('Upstate/downstate duration histogram')
-    ax2.legend()
-
-    # Plot upstates with filtered time series snippet
-    ax3.plot(times_ecog, sig_filt[0], label='Filtered signal')
-    # Add standard deviation lines
-    ax3.fill_between(times_ecog, sig_filt[0] - np.std(sig_filt[0]), sig_filt[0] + np.std(sig_filt[0]), alpha=0.4, label='Standard deviation')
-    # Plot upstate regions
-    for i in range(len(event_times)):
-        ax3.axvspan(event_times[i][0], event_times[i][1], color='green', alpha=0.2)
-    # Add threshold line
-    ax3.axhline(y=threshold_value, linestyle='--', label='Threshold', alpha=0.8, color='black')
-    ax3.legend()
-    ax3.set_xlabel('Time (s)')
-    ax3.set_ylabel('Voltage')
-    ax3.set_title('Upstates with filtered time series snippet')
-    ax3.set_xlim(110, 120)
-
-    # Add letters to subplots
-    ax1.text(-0.1, 1.1, 'A', transform=ax1.transAxes, size=20)
-    ax2.text(-0.1, 1.1, 'B', transform=ax2.transAxes, size=20)
-    ax3.text(-0.1, 1.1, 'C', transform=ax3.transAxes, size=20)
-
-    # Save figure
-    plt.savefig(f"{fig_output_dir}/upstate_detection.png", dpi=300)
+    with stage('plot'):
+        # Set GridSpec for the figure
+        fig = plt.figure(figsize=(20, 15))
+        gs = GridSpec(2, 3, figure=fig)
+        ax1 = fig.add_subplot(gs[0, 0:2]) # Filtered signal snippet 
+        ax2 = fig.add_subplot(gs[0, 2]) # Interval durations histogram
+        ax3 = fig.add_subplot(gs[-1, :]) # Upstates with filtered signal snippet
+
+        # Plot filtered time series snippet
+        plot_decimated(ax1, times_ecog, ts_ecog[0], t_range=(0, 10), label='Raw signal', alpha=0.4, color='tab:cyan')
+        plot_decimated(ax1, times_ecog, sig_filt[0], t_range=(0, 10), label='Filtered signal', color='tab:red')
+        ax1.set_xlabel('Time (s)')
+        ax1.set_ylabel('Voltage')
+        ax1.set_title('Filtered ECoG time series snippet, channel 0')
+        ax1.legend()
+        ax1.set_xlim(0, 10)
+
+        # Plot upstate/downstate duration histogram
+        ax2.hist(upstate_durations, bins=100, label='Upstate duration', alpha=0.5)
+        ax2.hist(downstate_durations, bins=100, label='Downstate duration', alpha=0.2)
+        ax2.set_xlabel('Duration (s)')
+        ax2.set_ylabel('Count')
+        ax2.set_title('Upstate/downstate duration histogram')
+        ax2.legend()
+
+        # Plot upstates with filtered time series snippet
+        plot_decimated(ax3, times_ecog, sig_filt[0], t_range=(110, 120), label='Filtered signal')
+        # Add standard deviation lines
+        sig_filt_std = np.std(sig_filt[0])
+        fill_between_decimated(ax3, times_ecog, sig_filt[0] - sig_filt_std, sig_filt[0] + sig_filt_std, t_range=(110, 120), alpha=0.4, label='Standard deviation')
+        # Plot upstate regions
+        shade_intervals(ax3, event_times, t_range=(110, 120), color='green', alpha=0.2)
+        # Add threshold line
+        ax3.axhline(y=threshold_value, linestyle='--', label='Threshold', alpha=0.8, color='black')
+        ax3.legend()
+        ax3.set_xlabel('Time (s)')
+        ax3.set_ylabel('Voltage')
+        ax3.set_title('Upstates with filtered time series snippet')
+        ax3.set_xlim(110, 120)
+
+        # Add letters to subplots
+        ax1.text(-0.1, 1.1, 'A', transform=ax1.transAxes, size=20)
+        ax2.text(-0.1, 1.1, 'B', transform=ax2.transAxes, size=20)
+        ax3.text(-0.1, 1.1, 'C', transform=ax3.transAxes, size=20)
+
+        # Save figure
+        plt.savefig(f"{fig_output_dir}/upstate_detection.png", dpi=300)
 
 def main():
     # Set up argument parser
@@ -0,0 +1,44 @@
+import sys
+import os
+import logging
+from pathlib import Path
+from glob import glob
+import argparse
+
+def build_pyramids(exp, min_factor):
+    # Set up file paths
+    file_path = str(Path().absolute())
+    project_path = str(Path().absolute().parent.parent)
+
+    # Set up logging
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    logging.info(f"Current file directory: {file_path}")
+    logging.info(f"Current project directory: {project_path}")
+
+    os.chdir(project_path)
+    sys.path.append(project_path)
+
+    # Import custom modules
+    from src.pyramid import build_pyramid
+
+    # Processed recordings of the experiment (channels x time)
+    input_dir = f"{project_path}/data/processed/{exp}"
+    files = [f for f in glob(f"{input_dir}/*.npy") if os.path.basename(f) not in ('times.npy', 'event_times.npy', 'event_times_inverted.npy', 'wave_events.npy')]
+
+    for file in files:
+        logging.info(f"Building pyramid for {file}")
+        build_pyramid(file, min_factor=min_factor)
+
+def main():
+    # Set up argument parser
+    parser = argparse.ArgumentParser(description='Build min/max pyramids of processed recordings for fast browsing.')
+    parser.add_argument('exp', type=str, help='Experiment name')
+    parser.add_argument('--min_factor', type=int, default=16, help='Decimation factor of the finest level')
+
+    # Parse command-line arguments
+    args = parser.parse_args()
+
+    build_pyramids(args.exp, args.min_factor)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+import sys
+import os
+import logging
+from pathlib import Path
+import argparse
+
+def run(experiments, stages, n_jobs, force, dry_run):
+    # Set up file paths
+    file_path = str(Path().absolute())
+    project_path = str(Path().absolute().parent.parent)
+
+    # Set up logging
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    logging.info(f"Current file directory: {file_path}")
+    logging.info(f"Current project directory: {project_path}")
+
+    os.chdir(project_path)
+    sys.path.append(project_path)
+
+    # Import custom modules
+    from src.pipeline import run_pipeline
+
+    # Stage declarations
+    config_path = f"{project_path}/cfg/pipeline.yml"
+
+    status = run_pipeline(config_path, project_path, experiments=experiments, stages=stages, n_jobs=n_jobs,
+                          force=force, dry_run=dry_run)
+
+    # Summary of the run
+    for state in sorted(set(status.values())):
+        logging.info(f"{state}: {sum(s == state for s in status.values())} task(s)")
+    return all(s in ('up to date', 'done', 'stale') for s in status.values())
+
+def main():
+    # Set up argument parser
+    parser = argparse.ArgumentParser(description='Bring the outputs of all experiments up to date.')
+    parser.add_argument('--exp', type=str, nargs='+', default=None, help='Experiments to process (all by default)')
+    parser.add_argument('--stages', type=str, nargs='+', default=None, help='Stages to run (all by default)')
+    parser.add_argument('--n_jobs', type=int, default=4, help='Number of tasks run in parallel')
+    parser.add_argument('--force', action='store_true', help='Run the tasks even if they are up to date')
+    parser.add_argument('--dry_run', action='store_true', help='Only report which tasks would run')
+
+    # Parse command-line arguments
+    args = parser.parse_args()
+
+    ok = run(args.exp, args.stages, args.n_jobs, args.force, args.dry_run)
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
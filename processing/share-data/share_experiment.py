@@ -0,0 +1,44 @@
+import sys
+import os
+import logging
+from pathlib import Path
+import argparse
+
+def serve(experiments, names, max_clients, timeout):
+    # Set up file paths
+    file_path = str(Path().absolute())
+    project_path = str(Path().absolute().parent.parent)
+
+    # Set up logging
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    logging.info(f"Current file directory: {file_path}")
+    logging.info(f"Current project directory: {project_path}")
+
+    os.chdir(project_path)
+    sys.path.append(project_path)
+
+    # Import custom modules
+    from src.shared import serve_experiments
+
+    # Folder with the processed experiments
+    input_dir = f"{project_path}/data/processed"
+
+    # Blocks until Ctrl+C or SIGTERM
+    serve_experiments(experiments, input_dir, names=names, max_clients=max_clients, timeout=timeout)
+
+def main():
+    # Set up argument parser
+    parser = argparse.ArgumentParser(description='Keep processed experiments in shared memory for other processes.')
+    parser.add_argument('exp', type=str, nargs='+', help='Experiment codes')
+    parser.add_argument('--names', type=str, nargs='+', default=None,
+                        help='Files to share without .npy (all numeric .npy files by default)')
+    parser.add_argument('--max_clients', type=int, default=64, help='Maximal number of attached processes')
+    parser.add_argument('--timeout', type=float, default=60., help='Seconds to wait for attached processes at exit')
+
+    # Parse command-line arguments
+    args = parser.parse_args()
+
+    serve(args.exp, args.names, args.max_clients, args.timeout)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import sys
+import os
+import logging
+from pathlib import Path
+import argparse
+import yaml
+
+def run(name, socket_path, synthetic, Q, lowpass, threshold_scalar, warmup, window, band_window, queue_size, overflow,
+        duration, log_events):
+    # Set up file paths
+    file_path = str(Path().absolute())
+    project_path = str(Path().absolute().parent.parent)
+
+    # Set up logging
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    logging.info(f"Current file directory: {file_path}")
+    logging.info(f"Current project directory: {project_path}")
+
+    os.chdir(project_path)
+    sys.path.append(project_path)
+
+    # Import custom modules
+    from src.streaming import (AcquisitionServer, SyntheticSource, SocketSource, StreamingPipeline, NotchStage,
+                               LowpassStage, UpstateStage, BandPowerStage, ResultSink, LogSink, DEFAULT_SOCKET)
+
+    # Upstate parameters not given on the command line are those of the offline detection (find_upstates.py)
+    with open(f"{project_path}/processing/generate-upstates/find_upstates.yml") as f:
+        parameters = yaml.load(f.read(), Loader=yaml.FullLoader)['params']
+    lowpass = parameters[0]['f_range'][1] if lowpass is None else lowpass
+    threshold_scalar = parameters[1]['threshold_scalar'] if threshold_scalar is None else threshold_scalar
+    logging.info(f"Low-pass cutoff for upstate detection: {lowpass} Hz")
+    logging.info(f"Threshold scalar for upstate detection: {threshold_scalar}")
+
+    socket_path = socket_path or DEFAULT_SOCKET
+
+    # Stand-in acquisition in this process, otherwise replay_server.py (or a real acquisition bridge) must be running
+    server = None
+    if synthetic:
+        server = AcquisitionServer(SyntheticSource(duration=duration, seed=0), socket_path).start()
+
+    source = SocketSource(socket_path)
+    logging.info(f"Connected to {socket_path}: {source.n_channels} channels at {source.fs:g} Hz, "
+                 f"{source.chunk_size} samples per chunk")
+
+    results = ResultSink()
+    # Band power on the notch filtered data, upstates on the low-pass filtered data
+    stages = [NotchStage(Q), BandPowerStage(window=band_window), LowpassStage(lowpass),
+              UpstateStage(threshold_scalar, warmup, window, t0=source.t0)]
+    sinks = [results] + ([LogSink()] if log_events else [])
+    pipeline = StreamingPipeline(source, stages, sinks, queue_size=queue_size, overflow=overflow)
+
+    # Blocks until the stream ends, duration seconds or Ctrl+C
+    stats = pipeline.run(duration)
+    if server is not None:
+        server.stop()
+
+    logging.info(f"Streaming statistics:\n{stats.report(source.fs)}")
+    logging.info(f"{len(results.upstates)} upstates detected")
+
+    # Save the detected upstates, band power and latencies
+    output_dir = f"{project_path}/res/streaming"
+    results.save(f"{output_dir}/{name}.npz", source.fs, source.t0, stats)
+    logging.info(f"Results saved to {output_dir}/{name}.npz")
+
+def main():
+    # Set up argument parser
+    parser = argparse.ArgumentParser(description='Remove line noise, detect upstates and compute band power on a live stream.')
+    parser.add_argument('name', type=str, help='Name of the session, used for the output file')
+    parser.add_argument('--socket', type=str, default=None,
+                        help='Path of the Unix socket (default: $THESIS_STREAM_SOCKET or thesis_stream.sock in the temp folder)')
+    parser.add_argument('--synthetic', action='store_true', help='Stream synthetic data from this process')
+    parser.add_argument('--Q', type=float, default=550., help='Quality factor of the notch filters (as in process_data)')
+    parser.add_argument('--lowpass', type=float, default=None,
+                        help='Low-pass cutoff before upstate detection in Hz (default: from find_upstates.yml)')
+    parser.add_argument('--threshold_scalar', type=float, default=None,
+                        help='Upstate threshold in standard deviations (default: from find_upstates.yml)')
+    parser.add_argument('--warmup', type=float, default=10., help='Seconds used to estimate the thresholds')
+    parser.add_argument('--window', type=float, default=None,
+                        help='Time constant of the threshold statistics in seconds (default: all samples)')
+    parser.add_argument('--band_window', type=float, default=1., help='Window of the band power in seconds')
+    parser.add_argument('--queue_size', type=int, default=8, help='Chunks buffered between stages')
+    parser.add_argument('--overflow', type=str, default='block', choices=['block', 'drop'],
+                        help='Wait (block) or drop the oldest chunk when the pipeline falls behind')
+    parser.add_argument('--duration', type=float, default=None, help='Seconds to run (default: until the stream ends)')
+    parser.add_argument('--log_events', action='store_true', help='Log every detected upstate')
+
+    # Parse command-line arguments
+    args = parser.parse_args()
+
+    run(args.name, args.socket, args.synthetic, args.Q, args.lowpass, args.threshold_scalar, args.warmup, args.window,
+        args.band_window, args.queue_size, args.overflow, args.duration, args.log_events)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import sys
+import os
+import logging
+from pathlib import Path
+from glob import glob
+import argparse
+import numpy as np
+
+def replay(exp, name, raw, chunk_size, speed, loop, max_pending, socket_path, duration, seed):
+    # Set up file paths
+    file_path = str(Path().absolute())
+    project_path = str(Path().absolute().parent.parent)
+
+    # Set up logging
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    logging.info(f"Current file directory: {file_path}")
+    logging.info(f"Current project directory: {project_path}")
+
+    os.chdir(project_path)
+    sys.path.append(project_path)
+
+    # Import custom modules
+    from src.streaming import ReplaySource, SyntheticSource, serve_source, DEFAULT_SOCKET
+
+    if exp == 'synthetic':
+        # Generated on the fly, endless unless a duration is given
+        source = SyntheticSource(chunk_size=chunk_size, duration=duration, seed=seed)
+    elif raw:
+        # Raw recordings (one channel per file) at their own sampling rate
+        from src.loaders import load_ncs_data, load_ibw_data
+        input_dir = f"{project_path}/data/raw/{exp}"
+        files = sorted(glob(f"{input_dir}/*.ncs")) or sorted(glob(f"{input_dir}/*.ibw"))
+        if not files:
+            raise FileNotFoundError(f"No .ncs or .ibw files in {input_dir}")
+        signals = [(load_ncs_data if f.endswith('.ncs') else load_ibw_data)(f) for f in files]
+        data = np.array([np.squeeze(signal.magnitude) for signal, _ in signals])
+        fs = float(signals[0][0].sampling_rate.rescale('Hz').magnitude)
+        source = ReplaySource(data, fs, chunk_size, t0=float(signals[0][1][0].magnitude), loop=loop)
+    else:
+        # Processed recordings at 1 kHz (from the .npy files or their archives)
+        from src.archive import load_array
+        input_dir = f"{project_path}/data/processed/{exp}"
+        times = load_array(f"{input_dir}/times")
+        source = ReplaySource(load_array(f"{input_dir}/{name}"), 1000., chunk_size, t0=float(times[0]), loop=loop)
+
+    # Blocks until the source is replayed, Ctrl+C or SIGTERM
+    serve_source(source, socket_path or DEFAULT_SOCKET, speed=speed, max_pending=max_pending)
+
+def main():
+    # Set up argument parser
+    parser = argparse.ArgumentParser(description='Stream a recording over a local socket as if it was acquired.')
+    parser.add_argument('exp', type=str, help="Experiment code, or 'synthetic' for generated data")
+    parser.add_argument('--name', type=str, default='Probe1_lfps_spont', help='Processed recording to replay')
+    parser.add_argument('--raw', action='store_true', help='Replay the raw .ncs/.ibw files instead')
+    parser.add_argument('--chunk_size', type=int, default=50, help='Samples per chunk')
+    parser.add_argument('--speed', type=float, default=1., help='Replay speed relative to real time')
+    parser.add_argument('--loop', action='store_true', help='Replay the recording endlessly')
+    parser.add_argument('--max_pending', type=int, default=64, help='Chunks buffered per client before dropping')
+    parser.add_argument('--socket', type=str, default=None,
+                        help='Path of the Unix socket (default: $THESIS_STREAM_SOCKET or thesis_stream.sock in the temp folder)')
+    parser.add_argument('--duration', type=float, default=None, help='Seconds of synthetic data (default: endless)')
+    parser.add_argument('--seed', type=int, default=None, help='Seed of the synthetic data')
+
+    # Parse command-line arguments
+    args = parser.parse_args()
+
+    replay(args.exp, args.name, args.raw, args.chunk_size, args.speed, args.loop, args.max_pending, args.socket,
+           args.duration, args.seed)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+import sys
+import os
+import logging
+from pathlib import Path
+import argparse
+
+def run(socket_path, budget, fs, preload):
+    # Set up file paths
+    file_path = str(Path().absolute())
+    project_path = str(Path().absolute().parent.parent)
+
+    # Set up logging
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    logging.info(f"Current file directory: {file_path}")
+    logging.info(f"Current project directory: {project_path}")
+
+    os.chdir(project_path)
+    sys.path.append(project_path)
+
+    # Import custom modules
+    from src.warm_cache import serve, DEFAULT_SOCKET
+
+    # Folder with the processed experiments
+    data_dir = f"{project_path}/data/processed"
+
+    # Recordings loaded at start, given as <experiment>/<file name without .npy>
+    preload = [tuple(p.split('/', 1)) for p in preload]
+
+    # Blocks until Ctrl+C or SIGTERM
+    serve(data_dir, socket_path or DEFAULT_SOCKET, budget=int(budget * 2 ** 30), fs=fs, preload=preload)
+
+def main():
+    # Set up argument parser
+    parser = argparse.ArgumentParser(description='Keep recordings and analysis results warm for the notebooks.')
+    parser.add_argument('--socket', type=str, default=None,
+                        help='Path of the Unix socket (default: $THESIS_CACHE_SOCKET or thesis_warm_cache.sock in the temp folder)')
+    parser.add_argument('--budget', type=float, default=8, help='Memory budget in GB')
+    parser.add_argument('--fs', type=float, default=1000, help='Sampling rate of the recordings')
+    parser.add_argument('--preload', type=str, nargs='+', default=[],
+                        help='Recordings loaded at start, e.g. w12_07.spont/Probe1_lfps_spont')
+
+    # Parse command-line arguments
+    args = parser.parse_args()
+
+    run(args.socket, args.budget, args.fs, args.preload)
+
+if __name__ == "__main__":
+    main()
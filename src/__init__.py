@@ -1,4 +1,56 @@
-from .utils import *
-from .loaders import *
-from .plotting import *
-from .spike_detection import *
\ No newline at end of file
+"""
+Project-wide code.
+
+Submodules and their public names are imported lazily on first access (module __getattr__), so that e.g.
+`from src.utils import split_intervals` or `from src import split_intervals` does not import neo, elephant, neurodsp,
+matplotlib or seaborn. The heavy dependencies are imported in the functions that use them.
+"""
+import importlib
+
+# Public names of every submodule, in the order of the former star imports (later modules win on duplicates)
+_EXPORTS = {
+    'profiling': ['Stage', 'stage', 'profiled', 'enable', 'disable', 'enabled', 'reset', 'summary', 'report', 'save_trace'],
+    'utils': ['filter_line_noise', 'rereference', 'normalize', 'define_upstate_regions', 'lagged_correlation',
+              'make_splits', 'split_intervals', 'parse_spectrum'],
+    'loaders': ['load_ncs_data', 'load_ibw_data', 'load_archive_data', 'process_data', 'load_dataset'],
+    'plotting': ['load_plot_style', 'apply_plot_style', 'Memmap', 'render_figures', 'decimate_minmax',
+                 'decimate_envelope', 'plot_decimated', 'fill_between_decimated', 'shade_intervals', 'plot_pyramid',
+                 'plot_time_series_snippet', 'plot_filtered_time_series_snippet', 'plot_upstate_durations',
+                 'plot_downstate_durations', 'plot_filtered_ts_with_upstates', 'export_wave_movie'],
+    'spike_detection': ['read_spikes', 'design_spike_filter', 'detect_spikes', 'read_spike_indices',
+                        'read_spikes_from_channels', 'remove_synchrofacts', 'filter_synchronized_spikes',
+                        'times_to_indices', 'extract_waveforms', 'compute_waveform', 'SpikeTrains'],
+    'travelling_waves': ['CHANNEL_MAP', 'grid_index', 'interpolation_matrix', 'interpolate_channels', 'laplacian_matrix',
+                         'GridView', 'compute_phase', 'phase_gradient', 'wave_metrics', 'detect_travelling_waves',
+                         'WAVE_EVENT_DTYPE', 'segment_waves', 'build_wave_catalogue'],
+    'pyramid': ['build_pyramid', 'Pyramid'],
+    'synthetic': ['generate_states', 'state_envelope', 'generate_recording'],
+    'pipeline': ['load_pipeline', 'expand_tasks', 'task_dependencies', 'topological_order', 'HashCache',
+                 'task_signature', 'run_pipeline'],
+    'chunked': ['ChunkedArray', 'filter_line_noise_chunked', 'define_upstate_regions_chunked', 'correlation_chunked',
+                'welch_chunked'],
+    'archive': ['estimate_gain', 'write_archive', 'Archive', 'load_array'],
+    'ipc': ['attach_block', 'map_block', 'send_message', 'receive_message'],
+    'shared': ['SharedExperiment', 'share_experiment', 'attach_experiment', 'load_experiment', 'serve_experiments'],
+    'warm_cache': ['WarmCache', 'CacheServer', 'CacheClient', 'serve'],
+    'streaming': ['Chunk', 'ReplaySource', 'SyntheticSource', 'AcquisitionServer', 'serve_source', 'SocketSource',
+                  'NotchStage', 'LowpassStage', 'UpstateStage', 'BandPowerStage', 'ResultSink', 'LogSink', 'StreamStats',
+                  'StreamingPipeline'],
+}
+
+_ATTRIBUTES = {name: module for module, names in _EXPORTS.items() for name in names}
+
+__all__ = list(_ATTRIBUTES)
+
+def __getattr__(name):
+    if name in _EXPORTS:
+        return importlib.import_module(f'.{name}', __name__)
+    if name in _ATTRIBUTES:
+        value = getattr(importlib.import_module(f'.{_ATTRIBUTES[name]}', __name__), name)
+        # Cache the attribute, __getattr__ is only called for missing names
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS) | set(__all__))
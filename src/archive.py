@@ -0,0 +1,413 @@
+import os
+import json
+import struct
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# File layout: MAGIC, header length (uint64), json header, compressed chunks, chunk index, index offset (uint64), MAGIC
+MAGIC = b'TWARC\x00\x01\x00'
+EXTENSION = '.twa'
+
+# Encodings of a chunk, chosen per chunk by the writer
+_DELTA = 0          # integer samples, differences along time (wrapping arithmetic)
+_QUANT16 = 1        # float samples that are integer multiples of the gain, as int16 differences
+_QUANT32 = 2        # same, as int32 differences
+_XOR = 3            # any float samples, bit patterns XORed with the previous sample
+
+_INDEX_DTYPE = np.dtype([('offset', '<u8'), ('size', '<u8'), ('encoding', 'u1')])
+
+def _codec(codec, level=None):
+    """
+    Compression and decompression functions of a codec: 'zstd' (needs zstandard), 'zlib', 'lzma' or 'none'.
+    """
+    if codec == 'zstd':
+        import zstandard
+        level = 3 if level is None else level
+        return (lambda data: zstandard.ZstdCompressor(level=level).compress(data),
+                lambda data: zstandard.ZstdDecompressor().decompress(data))
+    if codec == 'zlib':
+        import zlib
+        level = 6 if level is None else level
+        return lambda data: zlib.compress(data, level), zlib.decompress
+    if codec == 'lzma':
+        import lzma
+        level = 6 if level is None else level
+        return lambda data: lzma.compress(data, preset=level), lzma.decompress
+    if codec == 'none':
+        return bytes, bytes
+    raise ValueError(f"Unknown codec {codec}, expected 'zstd', 'zlib', 'lzma' or 'none'")
+
+def _default_codec():
+    # zstd is faster at the same ratio, zlib is always available
+    try:
+        import zstandard
+        return 'zstd'
+    except ImportError:
+        return 'zlib'
+
+def _shuffle(values):
+    """
+    Bytes of the values grouped by significance (all first bytes, all second bytes, ...), the high bytes of small
+    differences are mostly zero and compress well.
+    """
+    return np.ascontiguousarray(values).view(np.uint8).reshape(-1, values.dtype.itemsize).T.tobytes()
+
+def _unshuffle(data, dtype, shape):
+    dtype = np.dtype(dtype)
+    return np.frombuffer(data, dtype=np.uint8).reshape(dtype.itemsize, -1).T.copy().view(dtype).reshape(shape)
+
+def _delta(values):
+    out = values.copy()
+    out[1:] = values[1:] - values[:-1]
+    return out
+
+def _undelta(values):
+    return np.cumsum(values, axis=0, dtype=values.dtype)
+
+def _unsigned(dtype):
+    return np.dtype(f'<u{np.dtype(dtype).itemsize}')
+
+def _encode_chunk(chunk, gain, offset, lossless):
+    """
+    Encode a chunk (samples x channels, time-major so that decoding accumulates whole rows of channels at once),
+    returns the encoding and the shuffled bytes.
+    """
+    if chunk.dtype.kind in 'iu':
+        return _DELTA, _shuffle(_delta(chunk))
+    if gain is not None:
+        levels = np.round((chunk.astype(np.float64) - offset) / gain)
+        low, high = levels.min(), levels.max()
+        for encoding, dtype in ((_QUANT16, np.int16), (_QUANT32, np.int32)):
+            info = np.iinfo(dtype)
+            # Also false for chunks with NaN or inf samples, stored as floats even when lossy storage was asked for
+            if not info.min <= low <= high <= info.max:
+                continue
+            quantized = levels.astype(dtype)
+            # Samples must come back bit-identical unless lossy storage was asked for
+            if not lossless or np.array_equal(_dequantize(quantized, gain, offset, chunk.dtype), chunk):
+                return encoding, _shuffle(_delta(quantized))
+            break
+    bits = chunk.view(_unsigned(chunk.dtype))
+    xor = bits.copy()
+    xor[1:] ^= bits[:-1]
+    return _XOR, _shuffle(xor)
+
+def _dequantize(levels, gain, offset, dtype):
+    return (levels * gain + offset).astype(dtype)
+
+def estimate_gain(data, n_samples=100000):
+    """
+    Quantization step of data recorded with an ADC and scaled to physical units (e.g. int16 samples times the gain
+    from the .ncs header): the smallest difference between distinct values of the first samples.
+
+    The step is chosen so that the values are restored bit-identically in their own data type (e.g. float32), returns
+    None if the data do not look quantized.
+    """
+    sample = np.asarray(data[:, :n_samples] if np.ndim(data) > 1 else data[:n_samples])
+    # NaN and inf samples (e.g. masked channels) are not on the grid of levels
+    values = np.unique(sample.astype(np.float64))
+    values = values[np.isfinite(values)]
+    steps = np.diff(values)
+    steps = steps[steps > 0]
+    if len(steps) == 0:
+        return None
+    # Step between neighbouring levels, refined by least-squares fits of the values to their levels (on values of
+    # growing magnitude, so that the levels stay exact while the estimate improves)
+    gain = np.median(steps[steps < 1.5 * steps.min()])
+    limit = 100
+    while True:
+        selected = values[np.abs(values) <= limit * gain]
+        levels = np.round(selected / gain)
+        if np.any(levels):
+            gain = np.sum(selected * levels) / np.sum(levels ** 2)
+        if limit * gain >= np.abs(values).max():
+            break
+        limit *= 10
+    # Steps finer than the resolution of the data type cannot be told apart from unquantized data
+    if sample.dtype.kind == 'f' and gain < 2 * np.finfo(sample.dtype).eps * np.abs(values).max():
+        return None
+    # The fit is off by a few ulps, while samples only come back bit-identical with a step that rounds every level
+    # to its value in the data type of the samples: the middle of the intersection of the steps that do so
+    levels = np.round(values / gain)
+    nonzero = levels != 0
+    magnitudes, counts = np.abs(values[nonzero]).astype(sample.dtype), np.abs(levels[nonzero])
+    low, high = np.nextafter(magnitudes, 0).astype(np.float64), np.nextafter(magnitudes, np.inf).astype(np.float64)
+    below = (magnitudes.astype(np.float64) + low) / 2 / counts
+    above = (magnitudes.astype(np.float64) + high) / 2 / counts
+    candidates = [gain, (below.max() + above.min()) / 2] if len(counts) else [gain]
+    exact = [np.mean((np.round(values / g) * g).astype(sample.dtype) == values.astype(sample.dtype)) for g in candidates]
+    # Most values have to be multiples of the step
+    return float(candidates[int(np.argmax(exact))]) if max(exact) > 0.99 else None
+
+def write_archive(path, data, fs, t0=0., gain=None, offset=0., chunk_size=2 ** 16, codec=None, level=None,
+                  lossless=True, units=None, n_jobs=1):
+    """
+    Write channels x time data to a compressed archive.
+
+    The samples are split into chunks of chunk_size samples (all channels), so any time range can be read by
+    decompressing only the chunks covering it. Every chunk is delta encoded along time, its bytes are shuffled and
+    compressed:
+
+    - integer samples are stored as differences,
+    - float samples that are integer multiples of gain (plus offset), e.g. ADC values scaled to volts, are stored as
+      int16 (or int32) differences,
+    - other float samples are stored as the XOR of consecutive bit patterns.
+
+    With lossless=True (default), a chunk is quantized only if it is restored bit-identically, otherwise it is XOR
+    encoded. With lossless=False, float chunks are rounded to multiples of gain (error at most gain / 2).
+
+    Parameters
+    ----------
+    path : str
+        Archive file (.twa).
+    data : np.array or str
+        Channels x time array (or np.memmap, or path to a .npy file), a 1D array is stored as one channel.
+    fs : float
+        Sampling rate.
+    t0 : float
+        Time of the first sample.
+    gain : float or str
+        Quantization step of float data, estimated from the data if 'auto', no quantization if None.
+    offset : float
+        Value of quantization level 0.
+    chunk_size : int
+        Samples per chunk.
+    codec : str
+        'zstd' (if zstandard is installed), 'zlib', 'lzma' or 'none', zstd or zlib if None.
+    level : int
+        Compression level of the codec.
+    lossless : bool
+        Store float chunks that are not exactly quantized losslessly (see above).
+    units : str
+        Units of the samples, kept in the header.
+    n_jobs : int
+        Number of chunks compressed in parallel.
+
+    Returns
+    -------
+    ratio : float
+        Size of the data divided by the size of the archive.
+
+    Raises
+    ------
+    ValueError
+        If data are not numeric (e.g. structured or object arrays) or have more than 2 dimensions.
+    """
+    if isinstance(data, str):
+        data = np.load(data, mmap_mode='r')
+    if data.dtype.kind not in 'iuf' or np.ndim(data) > 2:
+        raise ValueError(f"Only 1D or 2D integer or float arrays can be archived, got {data.dtype} {data.shape}")
+    squeeze = np.ndim(data) == 1
+    data = data[np.newaxis, :] if squeeze else data
+    n_channels, n_samples = data.shape
+    codec = _default_codec() if codec is None else codec
+    compress, _ = _codec(codec, level)
+    if isinstance(gain, str):
+        gain = estimate_gain(data) if data.dtype.kind == 'f' else None
+        logging.info(f"Estimated gain: {gain}")
+
+    header = {'shape': [n_channels, n_samples], 'squeeze': squeeze, 'dtype': data.dtype.str, 'fs': float(fs),
+              't0': float(t0), 'gain': gain, 'offset': float(offset), 'chunk_size': int(chunk_size), 'codec': codec,
+              'units': units}
+
+    def encode(start):
+        chunk = np.ascontiguousarray(data[:, start:start + chunk_size].T)
+        encoding, raw = _encode_chunk(chunk, gain, offset, lossless)
+        return encoding, compress(raw)
+
+    starts = range(0, n_samples, chunk_size)
+    index = np.zeros(len(starts), dtype=_INDEX_DTYPE)
+    with open(path, 'wb') as f:
+        header_bytes = json.dumps(header).encode()
+        f.write(MAGIC + struct.pack('<Q', len(header_bytes)) + header_bytes)
+        with ThreadPoolExecutor(max_workers=max(n_jobs, 1)) as executor:
+            # Chunks are compressed in parallel and written in order
+            for i, (encoding, compressed) in enumerate(executor.map(encode, starts)):
+                index[i] = (f.tell(), len(compressed), encoding)
+                f.write(compressed)
+        index_offset = f.tell()
+        f.write(index.tobytes())
+        f.write(struct.pack('<Q', index_offset) + MAGIC)
+        size = f.tell()
+
+    ratio = data.nbytes / size
+    counts = np.bincount(index['encoding'], minlength=4)
+    logging.info(f"Archived {n_channels} x {n_samples} samples to {path}: ratio {ratio:.2f} ({codec}, "
+                 f"{counts[_QUANT16] + counts[_QUANT32]} quantized, {counts[_XOR]} lossless float, {counts[_DELTA]} integer chunks)")
+    return ratio
+
+class Archive:
+    """
+    Channels x time data of an archive written by write_archive, read by time range.
+
+    Only the chunks covering the requested samples are read and decompressed (in parallel with n_jobs threads).
+    Indexing works like a numpy array with the channels first, e.g. archive[:, 1000:2000] or archive[3].
+
+    Parameters
+    ----------
+    path : str
+        Archive file.
+    n_jobs : int
+        Number of chunks decompressed in parallel.
+
+    Attributes
+    ----------
+    shape : tuple
+        Channels x samples (samples only for archived 1D arrays).
+    dtype : np.dtype
+        Dtype of the samples.
+    fs : float
+        Sampling rate.
+    t0 : float
+        Time of the first sample.
+    """
+
+    def __init__(self, path, n_jobs=4):
+        self.path = path
+        self.n_jobs = n_jobs
+        self._fd = os.open(path, os.O_RDONLY)
+        try:
+            magic = os.pread(self._fd, 16, 0)
+            if magic[:8] != MAGIC:
+                raise ValueError(f"{path} is not an archive")
+            header_length = struct.unpack('<Q', magic[8:])[0]
+            self.header = json.loads(os.pread(self._fd, header_length, 16))
+            size = os.fstat(self._fd).st_size
+            footer = os.pread(self._fd, 16, size - 16)
+            if footer[8:] != MAGIC:
+                raise ValueError(f"{path} is incomplete")
+            index_offset = struct.unpack('<Q', footer[:8])[0]
+            self.index = np.frombuffer(os.pread(self._fd, size - 16 - index_offset, index_offset), dtype=_INDEX_DTYPE)
+        except Exception:
+            os.close(self._fd)
+            raise
+        self.n_channels, self.n_samples = self.header['shape']
+        self.dtype = np.dtype(self.header['dtype'])
+        self.fs = self.header['fs']
+        self.t0 = self.header['t0']
+        self.gain = self.header['gain']
+        self.chunk_size = self.header['chunk_size']
+        self.units = self.header.get('units')
+        self._decompress = _codec(self.header['codec'])[1]
+
+    @property
+    def shape(self):
+        return (self.n_samples,) if self.header['squeeze'] else (self.n_channels, self.n_samples)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __del__(self):
+        self.close()
+
+    def _chunk(self, i):
+        """
+        Decoded chunk i (samples x channels).
+        """
+        entry = self.index[i]
+        raw = self._decompress(os.pread(self._fd, int(entry['size']), int(entry['offset'])))
+        n = min(self.chunk_size, self.n_samples - i * self.chunk_size)
+        encoding = entry['encoding']
+        if encoding == _DELTA:
+            return _undelta(_unshuffle(raw, self.dtype, (n, self.n_channels)))
+        if encoding in (_QUANT16, _QUANT32):
+            levels = _undelta(_unshuffle(raw, np.int16 if encoding == _QUANT16 else np.int32, (n, self.n_channels)))
+            return _dequantize(levels, self.gain, self.header['offset'], self.dtype)
+        bits = np.bitwise_xor.accumulate(_unshuffle(raw, _unsigned(self.dtype), (n, self.n_channels)), axis=0)
+        return bits.view(self.dtype)
+
+    def read(self, start=None, stop=None, channels=None):
+        """
+        Samples start:stop of the channels (all if None), channels x samples.
+        """
+        start, stop, _ = slice(start, stop).indices(self.n_samples)
+        channels = np.arange(self.n_channels)[channels if channels is not None else slice(None)]
+        out = np.empty((np.size(channels), max(stop - start, 0)), dtype=self.dtype)
+        if stop <= start:
+            return out if np.ndim(channels) else out[0]
+        first, last = start // self.chunk_size, (stop - 1) // self.chunk_size
+
+        def fill(i):
+            chunk = self._chunk(i)
+            a, b = max(start, i * self.chunk_size), min(stop, (i + 1) * self.chunk_size)
+            out[:, a - start:b - start] = chunk[a - i * self.chunk_size:b - i * self.chunk_size, np.atleast_1d(channels)].T
+
+        chunks = range(first, last + 1)
+        if self.n_jobs > 1 and len(chunks) > 1:
+            with ThreadPoolExecutor(max_workers=self.n_jobs) as executor:
+                list(executor.map(fill, chunks))
+        else:
+            for i in chunks:
+                fill(i)
+        return out if np.ndim(channels) else out[0]
+
+    def sample(self, t):
+        """
+        Index of the sample at time t (seconds).
+        """
+        return int(round((t - self.t0) * self.fs))
+
+    def read_time(self, t_start, t_stop, channels=None):
+        """
+        Samples between t_start and t_stop (seconds).
+        """
+        return self.read(self.sample(t_start), self.sample(t_stop), channels)
+
+    def times(self, start=None, stop=None):
+        """
+        Times of the samples start:stop.
+        """
+        start, stop, _ = slice(start, stop).indices(self.n_samples)
+        return self.t0 + np.arange(start, stop) / self.fs
+
+    def __getitem__(self, key):
+        if self.header['squeeze']:
+            key = (0, key)
+        elif not isinstance(key, tuple):
+            key = (key, slice(None))
+        channels, samples = key
+        if isinstance(samples, slice) and samples.step in (None, 1):
+            return self.read(samples.start, samples.stop, channels)
+        if isinstance(samples, (int, np.integer)):
+            sample = samples % self.n_samples
+            return self.read(sample, sample + 1, channels)[..., 0]
+        return self.read(channels=channels)[..., samples]
+
+    def __array__(self, dtype=None, copy=None):
+        data = self.read()
+        data = data[0] if self.header['squeeze'] else data
+        return data if dtype is None else data.astype(dtype)
+
+def load_array(path, n_jobs=4):
+    """
+    Array stored as .npy or as an archive (.twa), the archive is used if the .npy file does not exist.
+
+    Parameters
+    ----------
+    path : str
+        Path with or without extension.
+    n_jobs : int
+        Number of chunks decompressed in parallel.
+    """
+    base, extension = os.path.splitext(path)
+    if extension == EXTENSION or (not os.path.exists(f"{base}.npy") and os.path.exists(f"{base}{EXTENSION}")):
+        with Archive(f"{base}{EXTENSION}", n_jobs) as archive:
+            return np.asarray(archive)
+    return np.load(f"{base}.npy", allow_pickle=True)
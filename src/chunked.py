@@ -0,0 +1,327 @@
+import os
+import math
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from .profiling import profiled
+
+# Memory used by the blocks processed at the same time, if not given
+DEFAULT_MEMORY_BUDGET = int(float(os.environ.get('THESIS_MEMORY_BUDGET', 2 ** 30)))
+
+def _size(data):
+    # Number of values of an array or of a .npy file (for profiling)
+    return np.size(np.load(data, mmap_mode='r') if isinstance(data, str) else data)
+
+class ChunkedArray:
+    """
+    Channels x time array processed in blocks of samples, so recordings larger than memory (np.memmap) can be
+    analysed. Blocks are sized to a memory budget and processed in parallel by threads (numpy and scipy release the
+    GIL in the heavy parts).
+
+    Parameters
+    ----------
+    data : np.array or str
+        Channels x time array (in memory or np.memmap), or path to a .npy file opened memory-mapped.
+    memory_budget : int
+        Bytes of working memory for all blocks in flight together.
+    n_jobs : int
+        Number of blocks processed in parallel.
+    copies : int
+        Float64 copies of a block an operation holds at once, used to size the blocks.
+    """
+
+    def __init__(self, data, memory_budget=None, n_jobs=1, copies=4):
+        if isinstance(data, str):
+            data = np.load(data, mmap_mode='r')
+        self.data = data if data.ndim > 1 else data[np.newaxis, :]
+        self.n_channels, self.n_samples = self.data.shape
+        self.memory_budget = DEFAULT_MEMORY_BUDGET if memory_budget is None else memory_budget
+        self.n_jobs = max(n_jobs, 1)
+        self.block_size = max(self.memory_budget // (self.n_jobs * copies * 8 * self.n_channels), 1)
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    def blocks(self, halo=0, align=1):
+        """
+        Blocks as (start, stop, halo_start, halo_stop): the samples a block owns and the samples read with the halo
+        needed around them. align rounds the block size to a multiple (e.g. of the Welch segment step). Blocks own at
+        least halo samples, so a small budget does not make the halos dominate.
+        """
+        size = max(self.block_size - 2 * halo, halo, align) // align * align
+        return [(start, min(start + size, self.n_samples), max(start - halo, 0), min(start + size + halo, self.n_samples))
+                for start in range(0, self.n_samples, size)]
+
+    def read(self, start, stop):
+        """
+        Samples start:stop of all channels as float64.
+        """
+        return np.asarray(self.data[:, start:stop], dtype=np.float64)
+
+    def map(self, func, blocks):
+        """
+        Apply func(start, stop, halo_start, halo_stop) to every block, in parallel. Results are returned in block order.
+        """
+        if self.n_jobs == 1 or len(blocks) == 1:
+            return [func(*block) for block in blocks]
+        with ThreadPoolExecutor(max_workers=self.n_jobs) as executor:
+            return list(executor.map(lambda block: func(*block), blocks))
+
+    def map_blocks(self, func, out=None, halo=0, dtype=np.float64):
+        """
+        Transform the array block by block, func gets a float64 block (with halo) and returns it transformed (same
+        number of samples), the halo is cut off before writing to out.
+
+        Parameters
+        ----------
+        func : callable
+            Block (channels x samples) -> transformed block.
+        out : np.array or str
+            Output array (e.g. np.memmap) or path of a .npy file to create; allocated in memory if None.
+        halo : int
+            Samples read on both sides of every block, for operations that are not local in time (filters).
+        dtype : np.dtype
+            Dtype of the output if it is created.
+
+        Returns
+        -------
+        out : np.array
+            Transformed data.
+        """
+        if out is None:
+            out = np.empty(self.shape, dtype=dtype)
+        elif isinstance(out, str):
+            out = np.lib.format.open_memmap(out, mode='w+', dtype=dtype, shape=self.shape)
+
+        def process(start, stop, halo_start, halo_stop):
+            block = func(self.read(halo_start, halo_stop))
+            out[:, start:stop] = block[:, start - halo_start:stop - halo_start]
+
+        self.map(process, self.blocks(halo))
+        if isinstance(out, np.memmap):
+            out.flush()
+        return out
+
+    def reduce_blocks(self, func, combine=sum):
+        """
+        Combine func(block) over all blocks (without halo), e.g. sums of statistics.
+        """
+        return combine(self.map(lambda start, stop, *_: func(self.read(start, stop)), self.blocks()))
+
+    def mean(self):
+        """
+        Mean of every channel (channels x 1).
+        """
+        return self.reduce_blocks(lambda block: block.sum(axis=1, keepdims=True)) / self.n_samples
+
+    def std(self, mean=None):
+        """
+        Standard deviation of every channel around its mean (channels x 1), computed in a second pass.
+        """
+        mean = self.mean() if mean is None else mean
+        return np.sqrt(self.reduce_blocks(lambda block: ((block - mean) ** 2).sum(axis=1, keepdims=True)) / self.n_samples)
+
+@profiled(items=lambda data, *args, **kwargs: _size(data))
+def filter_line_noise_chunked(data, fs, Q, out=None, memory_budget=None, n_jobs=1, halo=None):
+    """
+    filter_line_noise block by block: notch filters at 60 Hz and 120 Hz applied forward and backward.
+
+    The zero-phase filter is not local in time, so every block is filtered with a halo of samples on both sides. The
+    impulse response of the notch decays with the time constant Q / (pi * f0), the default halo covers 10 time
+    constants of the lowest notch, after which the difference to filtering the whole recording is negligible.
+
+    Parameters
+    ----------
+    data : np.array or str
+        Channels x time array (or np.memmap), or path to a .npy file.
+    fs : float
+        Sampling rate.
+    Q : float
+        Quality factor of the notch filters.
+    out : np.array or str
+        Output array or path of a .npy file to create, float64 in memory if None.
+    memory_budget : int
+        Bytes of working memory for all blocks in flight together.
+    n_jobs : int
+        Number of blocks filtered in parallel.
+    halo : int
+        Samples added on both sides of every block, see above if None.
+
+    Returns
+    -------
+    out : np.array
+        Filtered data.
+    """
+    from scipy import signal
+
+    freqs = [60.0, 120.0]
+    filters = [signal.iirnotch(freq, Q, fs) for freq in freqs]
+    if halo is None:
+        halo = int(math.ceil(10 * Q / (math.pi * min(freqs)) * fs))
+
+    def notch(block):
+        for b_notch, a_notch in filters:
+            block = signal.filtfilt(b_notch, a_notch, block, axis=1)
+        return block
+
+    chunked = ChunkedArray(data, memory_budget, n_jobs)
+    logging.info(f"Filtering {chunked.n_channels} x {chunked.n_samples} samples in blocks of {chunked.block_size} (halo {halo})")
+    return chunked.map_blocks(notch, out=out, halo=halo)
+
+@profiled(items=lambda data, *args, **kwargs: _size(data))
+def define_upstate_regions_chunked(data, times, threshold_scalar=2, memory_budget=None, n_jobs=1):
+    """
+    define_upstate_regions block by block, with the same result.
+
+    The thresholds (mean + threshold_scalar * std of every channel) are computed in two passes over the blocks. The
+    samples where no channel is above its threshold are found per block, and the gaps between them (the upstates) are
+    joined across block boundaries.
+
+    Parameters
+    ----------
+    data : np.array or str
+        Time series from multiple channels of EcoG recordings (or np.memmap, or path to a .npy file).
+    times : np.array
+        Time stamps, one array for all channels.
+    threshold_scalar : int
+        Scalar to multiply standard deviation by to define threshold.
+    memory_budget : int
+        Bytes of working memory for all blocks in flight together.
+    n_jobs : int
+        Number of blocks processed in parallel.
+
+    Returns
+    -------
+    event_times : list
+        List of tuples containing start and end times of upstate regions.
+    threshold_value : float
+        Threshold value used to define upstate regions for first channel.
+    """
+    chunked = ChunkedArray(data, memory_budget, n_jobs)
+    mean = chunked.mean()
+    threshold_values = (mean + chunked.std(mean) * threshold_scalar)[:, 0]
+    for i, th in enumerate(threshold_values):
+        logging.info(f"Channel {i} threshold: {th}")
+
+    # Samples without any channel above its threshold, per block
+    def quiet(start, stop, *_):
+        return start + np.where(~np.any(chunked.read(start, stop) > threshold_values[:, np.newaxis], axis=0))[0]
+    zeros_ids = chunked.map(quiet, chunked.blocks())
+
+    # Gaps between consecutive quiet samples, the last quiet sample of a block is carried to the next one
+    event_times, last = [], None
+    for ids in zeros_ids:
+        if last is not None:
+            ids = np.concatenate([[last], ids])
+        if len(ids) == 0:
+            continue
+        gaps = np.where(np.diff(ids) > 1)[0]
+        event_times.extend(zip(times[ids[gaps]], times[ids[gaps + 1]]))
+        last = ids[-1]
+
+    return event_times, threshold_values[0]
+
+@profiled(items=lambda data, *args, **kwargs: _size(data))
+def correlation_chunked(data, other=None, memory_budget=None, n_jobs=1):
+    """
+    Pearson correlation between the channels of a recording (channels x channels), or between the channels of two
+    recordings of the same length (channels x other channels), accumulated block by block in float64.
+
+    Parameters
+    ----------
+    data : np.array or str
+        Channels x time array (or np.memmap), or path to a .npy file.
+    other : np.array or str
+        Second recording, data is correlated with itself if None.
+    memory_budget : int
+        Bytes of working memory for all blocks in flight together.
+    n_jobs : int
+        Number of blocks processed in parallel.
+
+    Returns
+    -------
+    corr : np.array
+        Correlation coefficients.
+    """
+    x = ChunkedArray(data, memory_budget, n_jobs)
+    y = x if other is None else ChunkedArray(other, memory_budget, n_jobs)
+    if x.n_samples != y.n_samples:
+        raise ValueError(f"Recordings of different length: {x.n_samples} and {y.n_samples}")
+
+    # Means first, then the cross products around them (more accurate than raw sums of products)
+    mean_x = x.mean()
+    mean_y = mean_x if other is None else y.mean()
+
+    def products(start, stop, *_):
+        block_x = x.read(start, stop) - mean_x
+        block_y = block_x if other is None else y.read(start, stop) - mean_y
+        return block_x @ block_y.T, (block_x ** 2).sum(axis=1), (block_y ** 2).sum(axis=1)
+
+    # Blocks sized for both recordings together
+    blocks = ChunkedArray(x.data, x.memory_budget * x.n_channels // (x.n_channels + y.n_channels), n_jobs).blocks()
+    results = x.map(products, blocks)
+    cross = sum(r[0] for r in results)
+    norm_x = np.sqrt(sum(r[1] for r in results))
+    norm_y = np.sqrt(sum(r[2] for r in results))
+    return cross / np.outer(norm_x, norm_y)
+
+@profiled(items=lambda data, *args, **kwargs: _size(data))
+def welch_chunked(data, fs, nperseg=None, noverlap=None, f_range=None, memory_budget=None, n_jobs=1):
+    """
+    Welch power spectra of every channel (mean of Hann-windowed periodograms), computed block by block.
+
+    Blocks start at segment boundaries and overlap by noverlap samples, so every block holds a whole number of the
+    segments of the full recording and the result is the same as computing the spectrum at once.
+
+    Parameters
+    ----------
+    data : np.array or str
+        Channels x time array (or np.memmap), or path to a .npy file.
+    fs : float
+        Sampling rate.
+    nperseg : int
+        Segment length, 1 second of samples if None (as in neurodsp).
+    noverlap : int
+        Overlap of the segments, half a segment if None.
+    f_range : tuple
+        Frequency range (inclusive) of the returned spectra, all frequencies if None.
+    memory_budget : int
+        Bytes of working memory for all blocks in flight together.
+    n_jobs : int
+        Number of blocks processed in parallel.
+
+    Returns
+    -------
+    freqs : np.array
+        Frequencies.
+    powers : np.array
+        Power spectral densities, channels x freqs.
+    """
+    from scipy import signal
+
+    nperseg = int(fs) if nperseg is None else nperseg
+    noverlap = nperseg // 2 if noverlap is None else noverlap
+    step = nperseg - noverlap
+    chunked = ChunkedArray(data, memory_budget, n_jobs)
+    if chunked.n_samples < nperseg:
+        raise ValueError(f"Recording shorter than a segment ({chunked.n_samples} < {nperseg} samples)")
+
+    # Segments owned by a block start in [start, stop), the block is read up to the end of its last segment
+    n_segments = (chunked.n_samples - noverlap) // step
+    end = (n_segments - 1) * step + nperseg
+    blocks = [block for block in chunked.blocks(align=step) if block[0] < n_segments * step]
+
+    def periodograms(start, stop, *_):
+        count = (min(stop, n_segments * step) - start) // step
+        freqs, powers = signal.welch(chunked.read(start, min(start + (count - 1) * step + nperseg, end)), fs=fs,
+                                     nperseg=nperseg, noverlap=noverlap, axis=1)
+        return freqs, powers * count, count
+
+    results = chunked.map(periodograms, blocks)
+    freqs = results[0][0]
+    powers = sum(r[1] for r in results) / sum(r[2] for r in results)
+    if f_range is not None:
+        mask = (freqs >= f_range[0]) & (freqs <= f_range[1])
+        freqs, powers = freqs[mask], powers[:, mask]
+    return freqs, powers
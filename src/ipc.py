@@ -0,0 +1,51 @@
+import json
+import struct
+import weakref
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+
+def attach_block(name):
+    """
+    Attach to an existing shared memory block without registering it with the resource tracker of this process (which
+    would unlink it when the process exits).
+    """
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        resource_tracker.unregister(block._name, 'shared_memory')
+    except Exception:
+        pass
+    return block
+
+def map_block(block, shape, dtype, offset=0, strides=None):
+    """
+    Numpy view of a shared memory block. numpy does not keep the buffer of the block exported, so the block is only
+    closed (unmapped) when the view and every array derived from it are garbage collected.
+    """
+    array = np.ndarray(shape, dtype=dtype, buffer=block.buf, offset=offset, strides=strides)
+    weakref.finalize(array, block.close)
+    return array
+
+def send_message(sock, message):
+    """
+    Send a json message prefixed with its length.
+    """
+    data = json.dumps(message).encode()
+    sock.sendall(struct.pack('>I', len(data)) + data)
+
+def receive_message(sock):
+    """
+    Receive a message sent with send_message, None if the connection was closed.
+    """
+    header = _receive_exactly(sock, 4)
+    if header is None:
+        return None
+    return json.loads(_receive_exactly(sock, struct.unpack('>I', header)[0]))
+
+def _receive_exactly(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
@@ -1,6 +1,6 @@
-import neo
 import quantities as pq
 import os
+import re
 from glob import glob
 from natsort import natsorted
 import numpy as np
@@ -11,6 +11,8 @@ def load_ncs_data(path, sampling_rate=1000. * pq.Hz):
     '''
     Reads in data from a file and converts it to a neo.AnalogSignal object. Sampling rate might not be required since it is already in the file.
     '''
+    import neo
+
     # Read in analog signal from file
     reader = neo.io.NeuralynxIO(filename=path)
     block = reader.read_block()
@@ -33,6 +35,8 @@ def load_ibw_data(path, sampling_rate=1000. * pq.Hz):
     '''
     Reads in data from a file and converts it to a neo.AnalogSignal object.
     '''
+    import neo
+
     # Read in analog signal from file
     reader = neo.io.IgorIO(filename=path)
     block = reader.read_block()
@@ -48,6 +52,25 @@ def load_ibw_data(path, sampling_rate=1000. * pq.Hz):
 
     return analog_signal, times
 
+def load_archive_data(path, sampling_rate=None):
+    '''
+    Reads in data from an archive (see src/archive.py) and converts it to a neo.AnalogSignal object, like load_ncs_data and load_ibw_data. The sampling rate is stored in the archive and only overridden if given.
+    '''
+    import neo
+    from .archive import Archive
+
+    # Read in all samples (channels x time) and the sample times
+    with Archive(path) as archive:
+        data = np.atleast_2d(np.asarray(archive))
+        times = archive.times() * pq.s
+        units = archive.units or 'dimensionless'
+        if sampling_rate is None:
+            sampling_rate = archive.fs * pq.Hz
+
+    analog_signal = neo.AnalogSignal(data.T, units=units, sampling_rate=sampling_rate, t_start=times[0])
+
+    return analog_signal, times
+
 def process_data(files, format, fs = 1000. * pq.Hz, electrode='probe1', plot=True):
     '''
     Load the data and filter for line noise (60Hz, 120Hz).
@@ -59,7 +82,7 @@ def process_data(files, format, fs = 1000. * pq.Hz, electrode='probe1', plot=Tru
     format : str
         Format of the data
     fs : float
-        Sampling rate of the data
+        Sampling rate of the data (archives are read at the sampling rate stored in them)
     electrode : str
         Name of the electrode
     plot : bool
@@ -88,6 +111,16 @@ def process_data(files, format, fs = 1000. * pq.Hz, electrode='probe1', plot=Tru
             d, t = load_ibw_data(f, fs)
             data.append(d)
         times = t
+    elif format == 'twa':
+        # Load archived raw data (written by processing/archive-data/archive_data.py)
+        data = []
+        for f in files:
+            print('Loading: ' + f)
+            d, t = load_archive_data(f)
+            data.append(d)
+        times = t
+        # Filter at the sampling rate of the recording, not the default one
+        fs = float(data[0].sampling_rate.rescale(pq.Hz).magnitude) * pq.Hz
 
     ts = np.array([np.squeeze(d.magnitude) for d in data])
 
@@ -100,7 +133,7 @@ def process_data(files, format, fs = 1000. * pq.Hz, electrode='probe1', plot=Tru
         plot_time_series_snippet(ts, times, xlim=(times[t_start], times[t_end]), channel=np.random.randint(0, len(ts)), filename=str(electrode), fig_output_dir='res/processing')
 
     # Filter the data for line noise
-    ts_filtered = np.array([filter_line_noise(ts, fs.magnitude, 550) for ts in ts])
+    ts_filtered = np.array([filter_line_noise(ts, float(fs.rescale(pq.Hz).magnitude), 550) for ts in ts])
 
     if plot:
         # Generate random time range
@@ -183,5 +216,23 @@ def load_dataset(path, file_format, ecog = True, probe = True, probe2 = True, fs
             files_ecog = natsorted([d for d in data_path if int(d.split('/')[-1].split('.')[0].split('p')[-1]) >= 1 and int(d.split('/')[-1].split('.')[0].split('p')[-1]) <= 64])
             ts_filtered_ecog, times_ecog = process_data(files_ecog, file_format, fs, electrode='ecog')
 
+    if file_format == 'twa':
+        # Archives keep the file names of the raw data (e.g. csc65.twa or ...p65.twa), the channel is the trailing number
+        def channels(first, last):
+            numbers = {d: re.search(r'(\d+)$', d.split('/')[-1].split('.')[0].split('_')[0]) for d in data_path}
+            return natsorted([d for d, n in numbers.items() if n and first <= int(n.group(1)) <= last])
+
+        if probe:
+            # Get 1st probe data paths; 65-80
+            ts_filtered_probe1, times_probe1 = process_data(channels(65, 80), file_format, fs, electrode='probe1')
+
+        if probe2:
+            # Get 2nd probe data paths; 97-112
+            ts_filtered_probe2, times_probe2 = process_data(channels(97, 112), file_format, fs, electrode='probe2')
+
+        if ecog:
+            # Get ecog data; 1-64
+            ts_filtered_ecog, times_ecog = process_data(channels(1, 64), file_format, fs, electrode='ecog')
+
     return ts_filtered_probe1, times_probe1, ts_filtered_probe2, times_probe2, ts_filtered_ecog, times_ecog
     
\ No newline at end of file
@@ -0,0 +1,277 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import yaml
+
+def load_pipeline(config_path):
+    """
+    Read the stage declarations of the pipeline from a yml file (see cfg/pipeline.yml).
+
+    Returns
+    -------
+    experiments : list
+        Experiments listed in the file (may be empty).
+    stages : dict
+        Stage name -> declaration with script, args, per ('experiment' or 'project'), inputs, outputs, params and code.
+    """
+    with open(config_path) as f:
+        config = yaml.load(f.read(), Loader=yaml.FullLoader)
+    stages = {}
+    for name, stage in config['stages'].items():
+        stages[name] = {'script': stage['script'], 'args': [str(a) for a in stage.get('args', [])],
+                        'per': stage.get('per', 'experiment'), 'inputs': stage.get('inputs', []),
+                        'outputs': stage.get('outputs', []), 'params': stage.get('params', []),
+                        'code': stage.get('code', [])}
+    return config.get('experiments') or [], stages
+
+def expand_tasks(stages, experiments):
+    """
+    Expand the stages to tasks, one per experiment (or one per project) with {exp} replaced in the paths.
+
+    Returns
+    -------
+    tasks : dict
+        Task id (stage:experiment or stage) -> task.
+    """
+    tasks = {}
+    for name, stage in stages.items():
+        for exp in (experiments if stage['per'] == 'experiment' else [None]):
+            fill = (lambda path: path.format(exp=exp)) if exp is not None else (lambda path: path)
+            task_id = f"{name}:{exp}" if exp is not None else name
+            tasks[task_id] = {'id': task_id, 'stage': name, 'exp': exp, 'script': stage['script'],
+                              'args': ([exp] if exp is not None else []) + [fill(a) for a in stage['args']],
+                              'inputs': [fill(p) for p in stage['inputs']], 'outputs': [fill(p) for p in stage['outputs']],
+                              'params': stage['params'], 'code': stage['code']}
+    return tasks
+
+def task_dependencies(tasks):
+    """
+    Tasks producing the inputs of every task.
+
+    Returns
+    -------
+    dependencies : dict
+        Task id -> set of task ids that have to finish first.
+    """
+    producers = {os.path.normpath(path): task_id for task_id, task in tasks.items() for path in task['outputs']}
+    return {task_id: {producers[os.path.normpath(p)] for p in task['inputs'] if os.path.normpath(p) in producers} - {task_id}
+            for task_id, task in tasks.items()}
+
+def topological_order(dependencies):
+    """
+    Order the tasks so that every task comes after its dependencies.
+    """
+    order, done, visiting = [], set(), set()
+    def visit(task_id):
+        if task_id in done:
+            return
+        if task_id in visiting:
+            raise ValueError(f"Cyclic dependency at {task_id}")
+        visiting.add(task_id)
+        for dep in sorted(dependencies[task_id]):
+            visit(dep)
+        visiting.discard(task_id)
+        done.add(task_id)
+        order.append(task_id)
+    for task_id in dependencies:
+        visit(task_id)
+    return order
+
+class HashCache:
+    """
+    Content hashes of files, recomputed only when the size or modification time of a file changes.
+
+    Parameters
+    ----------
+    path : str
+        Json file the cache is stored in.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    def file_hash(self, path):
+        stat = os.stat(path)
+        entry = self.entries.get(path)
+        if entry is not None and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            return entry[2]
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(2 ** 20), b''):
+                digest.update(block)
+        self.entries[path] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        return digest.hexdigest()
+
+    def hash(self, path):
+        """
+        Hash of a file, of all files in a folder (with their relative paths) or 'missing'.
+        """
+        if os.path.isfile(path):
+            return self.file_hash(path)
+        if not os.path.isdir(path):
+            return 'missing'
+        digest = hashlib.sha256()
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                file = os.path.join(root, name)
+                digest.update(os.path.relpath(file, path).encode())
+                digest.update(self.file_hash(file).encode())
+        return digest.hexdigest()
+
+    def save(self):
+        with open(self.path, 'w') as f:
+            json.dump(self.entries, f)
+
+def task_signature(task, project_path, cache):
+    """
+    Hash of everything a task depends on: its script, code, parameter files, inputs and arguments.
+    """
+    digest = hashlib.sha256(json.dumps(task['args']).encode())
+    for path in [task['script']] + task['code'] + task['params'] + task['inputs']:
+        digest.update(path.encode())
+        digest.update(cache.hash(os.path.join(project_path, path)).encode())
+    return digest.hexdigest()
+
+def _run_task(task, project_path, log_dir):
+    """
+    Run the script of a task from its folder, the output is written to a log file.
+    """
+    script = os.path.join(project_path, task['script'])
+    log_path = os.path.join(log_dir, f"{task['id'].replace(':', '_')}.log")
+    start = time.perf_counter()
+    with open(log_path, 'w') as log:
+        returncode = subprocess.call([sys.executable, os.path.basename(script)] + task['args'],
+                                     cwd=os.path.dirname(script), stdout=log, stderr=subprocess.STDOUT)
+    return returncode, time.perf_counter() - start, log_path
+
+def run_pipeline(config_path, project_path, experiments=None, stages=None, n_jobs=1, force=False, dry_run=False):
+    """
+    Bring the outputs of the pipeline up to date.
+
+    Tasks (stages per experiment) run as soon as the tasks producing their inputs have finished, independent tasks run
+    in parallel. A task is skipped if its signature (see task_signature) equals the one of its last successful run
+    and all its outputs exist. Tasks depending on a failed task are not run. Signatures are stored in
+    res/pipeline/state.json and the logs of the scripts in res/pipeline/logs.
+
+    Parameters
+    ----------
+    config_path : str
+        Pipeline declaration (yml).
+    project_path : str
+        Project folder, paths in the declaration are relative to it.
+    experiments : list
+        Experiments to process, the ones from the declaration (or all folders in data/raw) if None.
+    stages : list
+        Stages to run, all if None. Inputs produced by other stages are then taken as they are.
+    n_jobs : int
+        Number of tasks run in parallel.
+    force : bool
+        Run the tasks even if they are up to date.
+    dry_run : bool
+        Only report which tasks would run (tasks downstream of a stale task are reported as stale).
+
+    Returns
+    -------
+    status : dict
+        Task id -> 'up to date', 'done', 'failed', 'missing inputs', 'skipped' (upstream failure) or 'stale' (dry run).
+    """
+    declared, all_stages = load_pipeline(config_path)
+    if experiments is None:
+        raw_dir = os.path.join(project_path, 'data', 'raw')
+        experiments = declared or (sorted(d for d in os.listdir(raw_dir) if os.path.isdir(os.path.join(raw_dir, d)))
+                                   if os.path.isdir(raw_dir) else [])
+    if stages is not None:
+        all_stages = {name: all_stages[name] for name in stages}
+    tasks = expand_tasks(all_stages, experiments)
+    dependencies = task_dependencies(tasks)
+    order = topological_order(dependencies)
+
+    state_dir = os.path.join(project_path, 'res', 'pipeline')
+    log_dir = os.path.join(state_dir, 'logs')
+    os.makedirs(log_dir, exist_ok=True)
+    state_path = os.path.join(state_dir, 'state.json')
+    state = {}
+    if os.path.exists(state_path):
+        with open(state_path) as f:
+            state = json.load(f)
+    cache = HashCache(os.path.join(state_dir, 'hash_cache.json'))
+
+    def outputs_exist(task):
+        return all(os.path.exists(os.path.join(project_path, p)) for p in task['outputs'])
+
+    def up_to_date(task, signature):
+        return not force and state.get(task['id'], {}).get('signature') == signature and outputs_exist(task)
+
+    status = {}
+    if dry_run:
+        for task_id in order:
+            stale_upstream = any(status[dep] == 'stale' for dep in dependencies[task_id])
+            signature = task_signature(tasks[task_id], project_path, cache)
+            status[task_id] = 'stale' if stale_upstream or not up_to_date(tasks[task_id], signature) else 'up to date'
+            logging.info(f"{task_id}: {status[task_id]}")
+        cache.save()
+        return status
+
+    def save_state():
+        with open(state_path, 'w') as f:
+            json.dump(state, f, indent=2)
+
+    running = {}
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        while len(status) < len(tasks):
+            # Start every task whose dependencies have finished
+            for task_id in order:
+                if task_id in status or task_id in running.values():
+                    continue
+                deps = dependencies[task_id]
+                if any(status.get(dep) in ('failed', 'missing inputs', 'skipped') for dep in deps):
+                    status[task_id] = 'skipped'
+                    logging.warning(f"{task_id}: skipped, an upstream task failed")
+                    continue
+                if not all(status.get(dep) in ('up to date', 'done') for dep in deps):
+                    continue
+                task = tasks[task_id]
+                missing = [p for p in task['inputs'] if not os.path.exists(os.path.join(project_path, p))]
+                if missing:
+                    status[task_id] = 'missing inputs'
+                    logging.error(f"{task_id}: missing inputs {missing}")
+                    continue
+                signature = task_signature(task, project_path, cache)
+                if up_to_date(task, signature):
+                    status[task_id] = 'up to date'
+                    logging.info(f"{task_id}: up to date")
+                    continue
+                logging.info(f"{task_id}: running {task['script']} {' '.join(task['args'])}")
+                task['signature'] = signature
+                running[executor.submit(_run_task, task, project_path, log_dir)] = task_id
+
+            if not running:
+                continue
+
+            # Wait for a task to finish and record its result
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                task_id = running.pop(future)
+                returncode, duration, log_path = future.result()
+                if returncode == 0 and outputs_exist(tasks[task_id]):
+                    status[task_id] = 'done'
+                    state[task_id] = {'signature': tasks[task_id]['signature'], 'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+                                      'duration': duration}
+                    save_state()
+                    logging.info(f"{task_id}: done in {duration:.1f} s")
+                else:
+                    status[task_id] = 'failed'
+                    logging.error(f"{task_id}: failed (exit code {returncode}), see {log_path}")
+
+    cache.save()
+    return status
@@ -1,12 +1,302 @@
-import matplotlib.pyplot as plt
 import numpy as np
-import seaborn as sns
 import logging
-import matplotlib.style as style
+import os
+import sys
 import yaml
+import shutil
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from collections import namedtuple
+from .travelling_waves import GridView, CHANNEL_MAP
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+@lru_cache(maxsize=None)
+def load_plot_style(path='plot_style.yml'):
+    """
+    Load the style configuration from a YAML file (parsed once per process and path).
+    """
+    with open(path, 'r') as file:
+        return yaml.safe_load(file)
+
+# Style configuration currently applied in this process
+_applied_style = {'path': None}
+
+def apply_plot_style(path='plot_style.yml', force=False):
+    """
+    Apply the style configuration from a YAML file, only if it is not applied already.
+    """
+    import matplotlib.pyplot as plt
+    import matplotlib.style as style
+
+    if _applied_style['path'] == path and not force:
+        return
+    style_config = load_plot_style(path)
+    style.use(style_config['style'])
+    plt.rcParams['font.size'] = style_config['font_size']
+    _applied_style['path'] = path
+
+# Argument of a figure job which is opened memory-mapped in the worker instead of being pickled
+Memmap = namedtuple('Memmap', ['path'])
+
+def _init_figure_worker(style_path):
+    """
+    Set up a figure worker process: non-interactive backend and style applied once.
+    """
+    import matplotlib
+
+    matplotlib.use('Agg')
+    if style_path is not None and os.path.exists(style_path):
+        apply_plot_style(style_path)
+
+def _open_memmaps(value):
+    """
+    Replace Memmap arguments by memory-mapped arrays.
+    """
+    if isinstance(value, Memmap):
+        return np.load(value.path, mmap_mode='r')
+    return value
+
+def _run_figure_job(job):
+    """
+    Render one figure job in a worker process, returning None or the error message.
+    """
+    func, args, kwargs = job
+    try:
+        func(*[_open_memmaps(a) for a in args], **{k: _open_memmaps(v) for k, v in kwargs.items()})
+        return None
+    except Exception as e:
+        return f'{type(e).__name__}: {e}'
+    finally:
+        # Figures built with the Figure API do not need pyplot, only close the ones created with it
+        if 'matplotlib.pyplot' in sys.modules:
+            sys.modules['matplotlib.pyplot'].close('all')
+
+def render_figures(jobs, n_jobs=4, style_path='plot_style.yml'):
+    """
+    Render figures concurrently in a process pool with the Agg backend.
+
+    Parameters
+    ----------
+    jobs : list
+        Figure specs as tuples (func, args) or (func, args, kwargs); func must be importable (module level) and save its
+        figure itself (e.g. plot_time_series_snippet). Large arrays should be passed as Memmap(path) to an .npy file,
+        they are then opened memory-mapped in the worker instead of being copied.
+    n_jobs : int
+        Number of worker processes.
+    style_path : str
+        Style configuration applied once in every worker (skipped if the file does not exist).
+
+    Returns
+    -------
+    errors : list
+        None for every successful job, the error message otherwise.
+    """
+    jobs = [(job[0], tuple(job[1]), dict(job[2]) if len(job) > 2 else {}) for job in jobs]
+    with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_figure_worker, initargs=(style_path,)) as pool:
+        errors = list(pool.map(_run_figure_job, jobs))
+
+    for (func, _, _), error in zip(jobs, errors):
+        if error is not None:
+            logging.error(f'Figure job {func.__name__} failed: {error}')
+    return errors
+
+def _window(times, t_range):
+    """
+    Index range of the samples within t_range (whole array if t_range is None).
+    """
+    if t_range is None:
+        return 0, len(times)
+    start, stop = np.searchsorted(times, t_range)
+    # Include one sample on each side so that lines reach the axis limits
+    return max(start - 1, 0), min(stop + 1, len(times))
+
+def decimate_minmax(times, values, t_range=None, n_pixels=2000):
+    """
+    Slice a time series to a time window and reduce it with min-max (M4) decimation.
+
+    The window is split into n_pixels buckets and only the first, last, minimum and maximum sample of each bucket are
+    kept, which renders identically to the full signal at a width of n_pixels.
+
+    Parameters
+    ----------
+    times : np.array
+        Time stamps (sorted).
+    values : np.array
+        Values of one channel.
+    t_range : tuple
+        Start and end time of the window, whole series if None.
+    n_pixels : int
+        Number of buckets, typically the width of the axis in pixels.
+
+    Returns
+    -------
+    times : np.array
+        Time stamps of the kept samples.
+    values : np.array
+        Kept samples.
+    """
+    start, stop = _window(times, t_range)
+    n = stop - start
+    if n <= 4 * n_pixels:
+        return np.asarray(times[start:stop]), np.asarray(values[start:stop])
+
+    # Reshape the window into buckets of equal size, padding the last one with NaN
+    size = int(np.ceil(n / n_pixels))
+    n_buckets = int(np.ceil(n / size))
+    buckets = np.full(n_buckets * size, np.nan)
+    buckets[:n] = values[start:stop]
+    buckets = buckets.reshape(n_buckets, size)
+
+    # First, last, minimum and maximum of every bucket
+    offsets = np.arange(n_buckets) * size
+    with np.errstate(invalid='ignore'):
+        valid = ~np.all(np.isnan(buckets), axis=1)
+        minimum = np.nanargmin(np.where(valid[:, np.newaxis], buckets, 0), axis=1)
+        maximum = np.nanargmax(np.where(valid[:, np.newaxis], buckets, 0), axis=1)
+    indices = np.concatenate([offsets, np.minimum(offsets + size - 1, n - 1), offsets + minimum, offsets + maximum])
+    indices = np.unique(indices) + start
+    return np.asarray(times[indices]), np.asarray(values[indices])
+
+def decimate_envelope(times, lower, upper, t_range=None, n_pixels=2000):
+    """
+    Slice a band (e.g. mean +- std) to a time window and reduce it to the per-bucket minimum of lower and maximum of upper.
+
+    Returns
+    -------
+    times : np.array
+        Start time of each bucket.
+    lower : np.array
+        Minimum of lower in each bucket.
+    upper : np.array
+        Maximum of upper in each bucket.
+    """
+    start, stop = _window(times, t_range)
+    n = stop - start
+    if n <= 2 * n_pixels:
+        return np.asarray(times[start:stop]), np.asarray(lower[start:stop]), np.asarray(upper[start:stop])
+
+    # Bucket boundaries, reduced with reduceat
+    bounds = np.linspace(0, n, n_pixels + 1).astype(np.int64)[:-1]
+    bounds = np.unique(bounds) + start
+    return (np.asarray(times[bounds]), np.minimum.reduceat(np.asarray(lower[start:stop]), bounds - start),
+            np.maximum.reduceat(np.asarray(upper[start:stop]), bounds - start))
+
+def _axis_width(ax):
+    """
+    Width of the axis in pixels.
+    """
+    return max(int(ax.get_window_extent().width), 1)
+
+def plot_decimated(ax, times, values, t_range=None, n_pixels=None, offset=0., **kwargs):
+    """
+    Plot a time series on ax after slicing it to t_range and min-max decimating it to the axis width.
+
+    Parameters
+    ----------
+    ax : matplotlib.axes.Axes
+        Axis to plot on.
+    times : np.array
+        Time stamps (sorted).
+    values : np.array
+        Values of one channel.
+    t_range : tuple
+        Start and end time of the window, also set as x limits; whole series if None.
+    n_pixels : int
+        Number of buckets, the axis width in pixels if None.
+    offset : float
+        Subtracted from the values after decimation (e.g. to stack channels), so the series is not copied.
+    kwargs :
+        Passed to ax.plot.
+    """
+    n_pixels = _axis_width(ax) if n_pixels is None else n_pixels
+    t, v = decimate_minmax(times, values, t_range, n_pixels)
+    lines = ax.plot(t, v - offset, **kwargs)
+    if t_range is not None:
+        ax.set_xlim(t_range)
+    return lines
+
+def fill_between_decimated(ax, times, lower, upper, t_range=None, n_pixels=None, **kwargs):
+    """
+    Draw a band between lower and upper on ax, sliced to t_range and decimated to the axis width.
+    """
+    n_pixels = _axis_width(ax) if n_pixels is None else n_pixels
+    t, low, high = decimate_envelope(times, lower, upper, t_range, n_pixels)
+    return ax.fill_between(t, low, high, **kwargs)
+
+def shade_intervals(ax, intervals, t_range=None, **kwargs):
+    """
+    Shade intervals (e.g. upstates) on ax as a single PolyCollection instead of one axvspan per interval.
+
+    Parameters
+    ----------
+    ax : matplotlib.axes.Axes
+        Axis to draw on.
+    intervals : np.array
+        Start and end times of the intervals, shape (n_intervals, 2).
+    t_range : tuple
+        Visible time range, intervals are selected and clipped to it; the current x limits of ax if None.
+    kwargs :
+        Passed to PolyCollection (e.g. color, alpha).
+
+    Returns
+    -------
+    collection : matplotlib.collections.PolyCollection
+        The added collection.
+    """
+    from matplotlib.collections import PolyCollection
+
+    intervals = np.asarray(intervals, dtype=np.float64).reshape(-1, 2)
+    low, high = ax.get_xlim() if t_range is None else t_range
+
+    # Select the visible intervals and clip them to the range
+    visible = (intervals[:, 1] > low) & (intervals[:, 0] < high)
+    starts = np.maximum(intervals[visible, 0], low)
+    ends = np.minimum(intervals[visible, 1], high)
+
+    # Rectangles spanning the whole height of the axis (x in data, y in axis coordinates)
+    vertices = np.empty((len(starts), 4, 2))
+    vertices[:, :, 0] = np.stack([starts, starts, ends, ends], axis=1)
+    vertices[:, :, 1] = [0, 1, 1, 0]
+    if 'color' in kwargs:
+        kwargs.setdefault('facecolor', kwargs.pop('color'))
+    kwargs.setdefault('edgecolor', 'none')
+    collection = PolyCollection(vertices, transform=ax.get_xaxis_transform(), **kwargs)
+    ax.add_collection(collection, autolim=False)
+    return collection
+
+def plot_pyramid(ax, pyramid, channel, t_range=None, n_pixels=None, **kwargs):
+    """
+    Plot one channel from a min/max pyramid (see src.pyramid) at the level matching the axis width.
+
+    Parameters
+    ----------
+    ax : matplotlib.axes.Axes
+        Axis to plot on.
+    pyramid : Pyramid
+        Pyramid of the recording.
+    channel : int
+        Channel to plot.
+    t_range : tuple
+        Start and end time of the window, also set as x limits; whole recording if None.
+    n_pixels : int
+        Width of the plot, the axis width in pixels if None.
+    kwargs :
+        Passed to ax.plot (raw data) or ax.fill_between (min/max envelope).
+    """
+    n_pixels = _axis_width(ax) if n_pixels is None else n_pixels
+    times, low, high, _, factor = pyramid.query(channel, t_range, n_pixels)
+    if factor == 1:
+        artist = plot_decimated(ax, times, low[0], n_pixels=n_pixels, **kwargs)
+    else:
+        # Min/max envelope of the buckets renders like the full signal at this width
+        kwargs.setdefault('linewidth', 0)
+        artist = ax.fill_between(times, low[0], high[0], step='post', **kwargs)
+    if t_range is not None:
+        ax.set_xlim(t_range)
+    return artist
+
 def plot_time_series_snippet(ts, time, xlim=None, channel=None, filename=None, fig_output_dir='res'):
     """
     Plot time series of ts. ts are multichannel (e.g. multiple electrodes). Plot random channel if channel is not specified. If channel is -1 then plot all channels.
@@ -24,6 +314,7 @@ def plot_time_series_snippet(ts, time, xlim=None, channel=None, filename=None, f
     file : str
         Name of the file ts is from.
     """
+    import matplotlib.pyplot as plt
 
     # Set a figure size
     plt.figure(figsize=(20, 10))
@@ -50,16 +341,11 @@ def plot_time_series_snippet(ts, time, xlim=None, channel=None, filename=None, f
         channels = [channel]
 
 
-    # Load style configuration from YAML file
-    with open('plot_style.yml', 'r') as file:
-        style_config = yaml.safe_load(file)
-
-    # Set the plot style
-    style.use(style_config['style'])
-    plt.rcParams['font.size'] = style_config['font_size']
+    # Set the plot style (configuration is loaded once per process)
+    apply_plot_style()
                         
     for i, ch in enumerate(channels):
-        plt.plot(time, ts[ch] - 10e1*i*np.mean(ts[ch]), label=f'Channel {ch}')
+        plot_decimated(plt.gca(), time, ts[ch], t_range=xlim, offset=10e1*i*np.mean(ts[ch]), label=f'Channel {ch}')
         plt.xlabel('Time (s)')
         plt.ylabel('Voltage')
         plt.title(f'Time series')
@@ -90,6 +376,8 @@ def plot_filtered_time_series_snippet(ts, ts_filtered, time, xlim=None, channel=
     file : str
         Name of the file ts is from.
     """
+    import matplotlib.pyplot as plt
+
     # Set a figure size
     plt.figure(figsize=(20, 10))
 
@@ -108,10 +396,6 @@ def plot_filtered_time_series_snippet(ts, ts_filtered, time, xlim=None, channel=
         logging.error('time must be 1D.')
         return
     
-    # Load style configuration from YAML file
-    with open('plot_style.yml', 'r') as file:
-        style_config = yaml.safe_load(file)
-
     if channel is None:
         # If channel is not specified, plot a random channel
         channel = np.random.randint(ts.shape[0])
@@ -123,13 +407,13 @@ def plot_filtered_time_series_snippet(ts, ts_filtered, time, xlim=None, channel=
         # Plot the specified channel
         channels = [channel]
 
-    # Set the plot style
-    style.use(style_config['style'])
-    plt.rcParams['font.size'] = style_config['font_size']
+    # Set the plot style (configuration is loaded once per process)
+    apply_plot_style()
 
     for i, ch in enumerate(channels):
-        plt.plot(time, ts[ch] - 10e1*i*np.mean(ts[ch]), label=f'Channel {ch}', alpha=0.5)
-        plt.plot(time, ts_filtered[ch] - 10e1*i*np.mean(ts_filtered[ch]), label=f'Channel {ch} filtered', alpha=0.5)
+        plot_decimated(plt.gca(), time, ts[ch], t_range=xlim, offset=10e1*i*np.mean(ts[ch]), label=f'Channel {ch}', alpha=0.5)
+        plot_decimated(plt.gca(), time, ts_filtered[ch], t_range=xlim, offset=10e1*i*np.mean(ts_filtered[ch]),
+                       label=f'Channel {ch} filtered', alpha=0.5)
         plt.xlabel('Time (s)')
         plt.ylabel('Voltage')
         plt.title(f'Time series')
@@ -142,6 +426,9 @@ def plot_filtered_time_series_snippet(ts, ts_filtered, time, xlim=None, channel=
     plt.savefig(f'{fig_output_dir}/filtered_time_series_snippet_{filename}.png')
 
 def plot_upstate_durations(upstate_durations, fig_output_dir):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
     fig = plt.figure(figsize=(10, 10))
     sns.histplot(x=upstate_durations)
     plt.xlabel('Upstate duration (s)')
@@ -150,6 +437,9 @@ def plot_upstate_durations(upstate_durations, fig_output_dir):
     fig.savefig(fig_output_dir + '/upstate_durations_histogram.png')
 
 def plot_downstate_durations(downstate_durations, fig_output_dir):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
     fig = plt.figure(figsize=(10, 10))
     sns.histplot(x=downstate_durations)
     plt.xlabel('Downstate duration (s)')
@@ -158,13 +448,19 @@ def plot_downstate_durations(downstate_durations, fig_output_dir):
     fig.savefig(fig_output_dir + '/downstate_durations_histogram.png')
 
 def plot_filtered_ts_with_upstates(time_ecog, sig_filt, threshold_value, event_time, fig_output_dir, xlim=None):
-    sig_filt_mean = np.mean(sig_filt, axis=0)
+    import matplotlib.pyplot as plt
+
+    # Compute mean and std only within the plotted window
+    start, stop = _window(time_ecog[0], xlim)
+    times = time_ecog[0][start:stop]
+    sig_filt_mean = np.mean(sig_filt[:, start:stop], axis=0)
+    sig_filt_std = np.std(sig_filt[:, start:stop], axis=0)
 
     fig =  plt.figure(figsize=(60, 10))
-    plt.plot(time_ecog[0], sig_filt_mean, label='filtered', color='red')
-    plt.fill_between(time_ecog[0], sig_filt_mean - np.std(sig_filt, axis=0), sig_filt_mean + np.std(sig_filt, axis=0), color='red', alpha=0.2)
-    for i in range(len(event_time)):
-        plt.axvspan(event_time[i][0], event_time[i][1], alpha=0.2, color='green')
+    ax = plt.gca()
+    plot_decimated(ax, times, sig_filt_mean, label='filtered', color='red')
+    fill_between_decimated(ax, times, sig_filt_mean - sig_filt_std, sig_filt_mean + sig_filt_std, color='red', alpha=0.2)
+    shade_intervals(ax, event_time, t_range=xlim, alpha=0.2, color='green')
     plt.axhline(y=threshold_value, color='black', linestyle='--')
     plt.legend()
     plt.xlim(xlim)
@@ -172,3 +468,146 @@ def plot_filtered_ts_with_upstates(time_ecog, sig_filt, threshold_value, event_t
     plt.ylabel('Voltage (uV)')
     plt.title('Time series of filtered ECoG ts')
     fig.savefig(fig_output_dir + f'/filtered_ts_example_with_upstates_{str(xlim[0])}-{str((xlim[1]))}.png')
+
+
+def _render_frames(frames, frame_times, params):
+    """
+    Render grid frames (rows x columns x frames) into raw RGB buffers, reusing a single image artist.
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    # Figure rendered directly with the Agg canvas, independent of the pyplot backend
+    fig = Figure(figsize=params['figsize'], dpi=params['dpi'])
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.add_subplot(1, 1, 1)
+    ax.axis('off')
+    image = ax.imshow(frames[:, :, 0], cmap=params['cmap'], vmin=params['vmin'], vmax=params['vmax'], aspect='auto', animated=True)
+    cbar = fig.colorbar(image, ax=ax)
+    cbar.set_label(params['label'], rotation=270, labelpad=20)
+    title = ax.set_title('', animated=True)
+
+    # Draw the static parts (colorbar, labels) once and keep them as background
+    canvas.draw()
+    background = canvas.copy_from_bbox(fig.bbox)
+
+    buffers = []
+    for i in range(frames.shape[2]):
+        # Only the image and the title are redrawn for every frame
+        canvas.restore_region(background)
+        image.set_data(frames[:, :, i])
+        title.set_text(f't = {frame_times[i]:.4f} s')
+        ax.draw_artist(image)
+        ax.draw_artist(title)
+        buffers.append(np.asarray(canvas.buffer_rgba())[:, :, :3].tobytes())
+    return buffers, canvas.get_width_height()
+
+def export_wave_movie(data, filename, times=None, fs=1000., t_range=None, stride=1, fps=30, channel_map=CHANNEL_MAP,
+                      cmap='rainbow', vmin=None, vmax=None, label='Normalized Voltage', figsize=(10, 8), dpi=50,
+                      n_jobs=4, block_size=100):
+    """
+    Export a movie of the data on the electrode grid.
+
+    Frames are rendered in parallel worker processes into raw RGB buffers and piped in order to ffmpeg
+    (any format ffmpeg can write, e.g. .mp4 or .gif). Without ffmpeg, .gif and .png (APNG) files are written with Pillow.
+
+    Parameters
+    ----------
+    data : np.array or GridView
+        Time series, channels x time (in memory or np.memmap), or a GridView of them.
+    filename : str
+        Output file.
+    times : np.array
+        Time stamps of the samples, computed from fs if None.
+    fs : float
+        Sampling rate of the data in Hz.
+    t_range : tuple
+        Start and end time of the exported window in seconds, whole recording if None.
+    stride : int
+        Export every stride-th sample.
+    fps : int
+        Frames per second of the movie.
+    channel_map : np.array
+        Grid of 1-based channel numbers, used if data is not a GridView.
+    cmap : str
+        Colormap.
+    vmin, vmax : float
+        Color limits, taken from the exported window if None.
+    label : str
+        Label of the colorbar.
+    figsize : tuple
+        Figure size in inches.
+    dpi : int
+        Resolution of the frames.
+    n_jobs : int
+        Number of worker processes.
+    block_size : int
+        Number of frames rendered by a worker at once.
+    """
+    from PIL import Image
+
+    grid = data if isinstance(data, GridView) else GridView(data, channel_map)
+    if times is None:
+        times = np.arange(len(grid)) / fs
+
+    # Frames within the time window
+    start, stop = (0, len(grid)) if t_range is None else np.searchsorted(times, t_range)
+    frame_ids = np.arange(start, stop, stride)
+    if len(frame_ids) == 0:
+        logging.error('No frames in the requested time window.')
+        return
+
+    # Common color limits for all workers
+    if vmin is None or vmax is None:
+        window = grid[start:stop:stride]
+        vmin = float(window.min()) if vmin is None else vmin
+        vmax = float(window.max()) if vmax is None else vmax
+
+    params = {'figsize': figsize, 'dpi': dpi, 'cmap': cmap, 'vmin': vmin, 'vmax': vmax, 'label': label}
+    blocks = [frame_ids[i:i + block_size] for i in range(0, len(frame_ids), block_size)]
+
+    def rendered_frames(pool):
+        # Keep at most 2 * n_jobs blocks in flight to bound memory
+        for i in range(0, len(blocks), 2 * n_jobs):
+            futures = [pool.submit(_render_frames, grid[b].filled(np.nan), times[b], params) for b in blocks[i:i + 2 * n_jobs]]
+            for future in futures:
+                yield future.result()
+
+    ffmpeg = shutil.which('ffmpeg')
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        if ffmpeg is not None:
+            process = None
+            try:
+                for buffers, (width, height) in rendered_frames(pool):
+                    if process is None:
+                        # Start the encoder once the frame size is known
+                        process = subprocess.Popen([ffmpeg, '-y', '-loglevel', 'error', '-f', 'rawvideo', '-pix_fmt',
+                                                    'rgb24', '-s', f'{width}x{height}', '-r', str(fps), '-i', '-', filename],
+                                                   stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+                    for buffer in buffers:
+                        process.stdin.write(buffer)
+            except BrokenPipeError:
+                # ffmpeg exited early, its error is reported below
+                pass
+            if process is None:
+                logging.error('No frames were rendered.')
+                return
+            _, stderr = process.communicate()
+            if process.returncode != 0:
+                raise RuntimeError(f"ffmpeg failed with exit code {process.returncode}: {stderr.decode(errors='replace').strip()}")
+        elif filename.endswith(('.gif', '.png')):
+            images = (Image.frombytes('RGB', size, buffer) for buffers, size in rendered_frames(pool) for buffer in buffers)
+            first = next(images)
+            if filename.endswith('.gif'):
+                # Quantize all frames with the palette of the first one (it contains the whole colorbar)
+                first = first.quantize()
+                images = (image.quantize(palette=first, dither=Image.Dither.NONE) for image in images)
+            else:
+                # The APNG writer needs all frames at once
+                images = list(images)
+            first.save(filename, save_all=True, append_images=images, duration=1000 / fps, loop=0)
+        else:
+            logging.error('ffmpeg not found, only .gif and .png movies can be written.')
+            return
+
+    logging.info(f'Movie with {len(frame_ids)} frames saved to {filename}')
@@ -0,0 +1,330 @@
+import os
+import sys
+import json
+import time
+import atexit
+import logging
+import threading
+import functools
+import resource
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Profiling is switched on with the THESIS_PROFILE environment variable ('1' or 'rss' to measure the peak resident
+# memory, 'tracemalloc' to measure the peak of traced Python/numpy allocations). With THESIS_PROFILE_TRACE=<path> a
+# Chrome trace (chrome://tracing, https://ui.perfetto.dev) is written at exit in addition to the logged table.
+_enabled = False
+_memory = 'rss'
+_records = []
+# Stages currently open in any thread
+_open = set()
+_lock = threading.Lock()
+_local = threading.local()
+
+class _NullStage:
+    """
+    Stage returned when profiling is off, entering, leaving and counting are no-ops.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def add(self, n):
+        pass
+
+_NULL_STAGE = _NullStage()
+
+class Stage:
+    """
+    Measurements of one run of a profiled stage.
+
+    Attributes
+    ----------
+    name : str
+        Name of the stage.
+    path : str
+        Names of the enclosing stages and of the stage joined by '/'.
+    depth : int
+        Nesting level (0 for top level stages).
+    start, wall, cpu : float
+        Start (perf_counter), wall time and CPU time of the process in seconds.
+    peak : float
+        Peak memory during the stage in bytes.
+    items : int
+        Number of processed items (counted with add).
+    concurrent : bool
+        True if stages of other threads were open at the same time. Memory and CPU time are measured for the whole
+        process, so they include the work of these stages; the peak may also include memory from before the stage.
+    """
+
+    def __init__(self, name, parent):
+        self.name = name
+        self.path = name if parent is None else f"{parent.path}/{name}"
+        self.depth = 0 if parent is None else parent.depth + 1
+        self.parent = parent
+        self.start = self.wall = self.cpu = 0.
+        self.peak = 0
+        self.items = 0
+        self.tid = threading.get_ident()
+        self.concurrent = False
+
+    def add(self, n):
+        """
+        Count n processed items.
+        """
+        self.items += n
+
+def _proc_hwm():
+    """
+    Peak resident memory since the last reset (VmHWM) in bytes, None if /proc is not available.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+
+def _peak_memory():
+    """
+    Peak memory since the last _reset_peak in bytes.
+    """
+    if _memory == 'tracemalloc':
+        return tracemalloc.get_traced_memory()[1]
+    hwm = _proc_hwm()
+    if hwm is not None:
+        return hwm
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere, it cannot be reset
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+def _reset_peak():
+    if _memory == 'tracemalloc':
+        tracemalloc.reset_peak()
+        return
+    # Writing 5 to clear_refs resets VmHWM to the current resident memory (Linux >= 4.0)
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+def enable(memory='rss'):
+    """
+    Switch profiling on.
+
+    Parameters
+    ----------
+    memory : str
+        'rss' to measure the peak resident memory of the process, 'tracemalloc' to measure the peak of traced
+        allocations (more precise per stage, but slows down allocation heavy code).
+    """
+    global _enabled, _memory
+    _memory = memory
+    if memory == 'tracemalloc' and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _enabled = True
+
+def disable():
+    """
+    Switch profiling off.
+    """
+    global _enabled
+    _enabled = False
+
+def enabled():
+    return _enabled
+
+def reset():
+    """
+    Forget all recorded stages.
+    """
+    with _lock:
+        _records.clear()
+
+def stage(name, items=None):
+    """
+    Profile a block of code as a stage.
+
+    Stages opened inside another stage (in the same thread) are recorded as its children. Stages open in several
+    threads at the same time are not isolated from each other and are marked as concurrent (see Stage). When profiling
+    is off a shared no-op stage is returned, so the block runs unchanged.
+
+    Parameters
+    ----------
+    name : str
+        Name of the stage.
+    items : int
+        Number of items processed in the stage, more can be counted with the add method of the yielded stage.
+
+    Returns
+    -------
+    stage : context manager
+        Entering it yields the Stage record.
+
+    Examples
+    --------
+    >>> with stage('filter', items=data.size):
+    ...     sig_filt = filter_signal(...)
+    """
+    if not _enabled:
+        return _NULL_STAGE
+    return _stage(name, items)
+
+@contextmanager
+def _stage(name, items):
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    parent = stack[-1] if stack else None
+    record = Stage(name, parent)
+    record.items = items or 0
+
+    # Peaks of nested stages are folded into the parent before the peak counter is reset for the child
+    if parent is not None:
+        parent.peak = max(parent.peak, _peak_memory())
+    with _lock:
+        others = [r for r in _open if r.tid != record.tid]
+        for r in others:
+            r.concurrent = True
+        record.concurrent = bool(others)
+        # The peak counter is process-wide, resetting it would lose the peaks of the stages open in other threads
+        if not others:
+            _reset_peak()
+        _open.add(record)
+    record.peak = _peak_memory()
+
+    stack.append(record)
+    record.start = time.perf_counter()
+    cpu = time.process_time()
+    try:
+        yield record
+    finally:
+        record.wall = time.perf_counter() - record.start
+        record.cpu = time.process_time() - cpu
+        stack.pop()
+        record.peak = max(record.peak, _peak_memory())
+        if parent is not None:
+            parent.peak = max(parent.peak, record.peak)
+        with _lock:
+            _open.discard(record)
+            _records.append(record)
+
+def profiled(name=None, items=None):
+    """
+    Decorator profiling every call of a function as a stage.
+
+    Parameters
+    ----------
+    name : str
+        Name of the stage, qualified name of the function by default.
+    items : callable
+        Function of the call arguments returning the number of processed items (e.g. lambda data, *args, **kwargs:
+        data.size).
+
+    Examples
+    --------
+    >>> @profiled(items=lambda data, *args, **kwargs: data.size)
+    ... def define_upstate_regions(data, times, threshold_scalar=2):
+    ...     ...
+    """
+    def decorator(func):
+        stage_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            # A single flag check when profiling is off
+            if not _enabled:
+                return func(*args, **kwargs)
+            with stage(stage_name, items(*args, **kwargs) if items is not None else None):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def summary():
+    """
+    Aggregate the recorded stages by their path.
+
+    Returns
+    -------
+    rows : list
+        Dictionaries with path, name, depth, calls, wall, cpu, peak (max over calls), items (sums over calls) and
+        concurrent (any call), in the order the stages were first entered.
+    """
+    with _lock:
+        records = sorted(_records, key=lambda r: r.start)
+    rows = {}
+    for r in records:
+        row = rows.setdefault(r.path, {'path': r.path, 'name': r.name, 'depth': r.depth, 'calls': 0, 'wall': 0.,
+                                       'cpu': 0., 'peak': 0, 'items': 0, 'concurrent': False})
+        row['calls'] += 1
+        row['wall'] += r.wall
+        row['cpu'] += r.cpu
+        row['peak'] = max(row['peak'], r.peak)
+        row['items'] += r.items
+        row['concurrent'] |= r.concurrent
+
+    # Children are listed right after their parent
+    children = defaultdict(list)
+    for path, row in rows.items():
+        children[path.rpartition('/')[0] if row['depth'] else None].append(row)
+    ordered = []
+    def visit(parent):
+        for row in children[parent]:
+            ordered.append(row)
+            visit(row['path'])
+    visit(None)
+    return ordered
+
+def report():
+    """
+    Table of the recorded stages (indented by nesting level), concurrent stages are marked with *.
+    """
+    memory = 'peak RSS' if _memory == 'rss' else 'peak alloc'
+    lines = [f"{'stage':<48}{'calls':>7}{'wall (s)':>11}{'cpu (s)':>11}{memory + ' (MB)':>16}{'items':>12}{'items/s':>12}"]
+    rows = summary()
+    for row in rows:
+        rate = row['items'] / row['wall'] if row['items'] and row['wall'] > 0 else float('nan')
+        items = f"{row['items']:>12}" if row['items'] else f"{'':>12}"
+        rate = f"{rate:>12.3g}" if row['items'] else f"{'':>12}"
+        name = '  ' * row['depth'] + row['name'] + (' *' if row['concurrent'] else '')
+        lines.append(f"{name:<48}{row['calls']:>7}{row['wall']:>11.3f}{row['cpu']:>11.3f}"
+                     f"{row['peak'] / 2 ** 20:>16.1f}{items}{rate}")
+    if any(row['concurrent'] for row in rows):
+        lines.append('* ran while stages of other threads were open, cpu and memory include them')
+    return '\n'.join(lines)
+
+def save_trace(path):
+    """
+    Save the recorded stages as a Chrome trace (JSON array of complete events) to path.
+    """
+    with _lock:
+        records = sorted(_records, key=lambda r: r.start)
+    pid = os.getpid()
+    events = [{'name': r.name, 'cat': 'stage', 'ph': 'X', 'ts': r.start * 1e6, 'dur': r.wall * 1e6, 'pid': pid,
+               'tid': r.tid, 'args': {'path': r.path, 'cpu_s': r.cpu, 'peak_mb': r.peak / 2 ** 20, 'items': r.items,
+                        'concurrent': r.concurrent}}
+              for r in records]
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+def _report_at_exit():
+    if not _records:
+        return
+    logging.info(f"Profile:\n{report()}")
+    trace = os.environ.get('THESIS_PROFILE_TRACE')
+    if trace:
+        save_trace(trace)
+        logging.info(f"Profile trace saved to {trace}")
+
+if os.environ.get('THESIS_PROFILE', '0').lower() not in ('', '0', 'false', 'no', 'off'):
+    enable('tracemalloc' if os.environ['THESIS_PROFILE'].lower() == 'tracemalloc' else 'rss')
+    atexit.register(_report_at_exit)
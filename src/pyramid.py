@@ -0,0 +1,149 @@
+import os
+import logging
+import numpy as np
+
+def _pyramid_dir(data_path):
+    """
+    Directory of the pyramid stored next to the data file (e.g. Probe1_lfps_spont.pyramid).
+    """
+    return os.path.splitext(data_path)[0] + '.pyramid'
+
+def _reduce_chunk(low, high, mean, factor):
+    """
+    Reduce chunks of min, max and mean summaries (channels x samples) by factor, padding the last bucket with edge values.
+    """
+    n = low.shape[1]
+    n_buckets = -(-n // factor)
+    pad = n_buckets * factor - n
+    if pad:
+        low, high, mean = (np.pad(x, ((0, 0), (0, pad)), mode='edge') for x in (low, high, mean))
+    shape = (low.shape[0], n_buckets, factor)
+    return low.reshape(shape).min(axis=2), high.reshape(shape).max(axis=2), mean.reshape(shape).mean(axis=2)
+
+def build_pyramid(data_path, min_factor=16, min_length=1000, chunk_size=2 ** 20):
+    """
+    Build a min/max/mean pyramid of a channels x time .npy file at power-of-two decimation levels.
+
+    Level k summarises buckets of min_factor * 2 ** k samples. The levels are stored as float32 .npy files in a
+    directory next to the data (<name>.pyramid/level_<factor>_{min,max,mean}.npy), the data are read memory-mapped in
+    chunks so files larger than memory can be processed.
+
+    Parameters
+    ----------
+    data_path : str
+        Path to the .npy file, channels x time.
+    min_factor : int
+        Decimation factor of the finest level (power of two).
+    min_length : int
+        Levels are added until fewer than min_length buckets remain.
+    chunk_size : int
+        Number of samples read at once (rounded to a multiple of min_factor).
+
+    Returns
+    -------
+    factors : list
+        Decimation factors of the stored levels.
+    """
+    data = np.load(data_path, mmap_mode='r')
+    if data.ndim == 1:
+        data = data[np.newaxis, :]
+    output_dir = _pyramid_dir(data_path)
+    os.makedirs(output_dir, exist_ok=True)
+    chunk_size = max(chunk_size // min_factor, 1) * min_factor
+
+    # The finest level is reduced from the raw data, every next level from the previous one
+    source, factor, factors = None, min_factor, []
+    while True:
+        step = min_factor if source is None else 2
+        length = data.shape[1] if source is None else source[0].shape[1]
+        n = -(-length // step)
+        arrays = [np.lib.format.open_memmap(os.path.join(output_dir, f'level_{factor}_{name}.npy'), mode='w+',
+                                            dtype=np.float32, shape=(data.shape[0], n)) for name in ('min', 'max', 'mean')]
+
+        # Reduce chunk by chunk
+        for start in range(0, length, chunk_size):
+            stop = min(start + chunk_size, length)
+            if source is None:
+                raw = np.asarray(data[:, start:stop], dtype=np.float64)
+                chunk = (raw, raw, raw)
+            else:
+                chunk = tuple(np.asarray(x[:, start:stop], dtype=np.float64) for x in source)
+            for array, values in zip(arrays, _reduce_chunk(*chunk, step)):
+                array[:, start // step:start // step + values.shape[1]] = values
+
+        for array in arrays:
+            array.flush()
+        factors.append(factor)
+        logging.info(f"Pyramid level {factor}: {n} samples")
+
+        if n // 2 < min_length:
+            break
+        source, factor = arrays, factor * 2
+
+    return factors
+
+class Pyramid:
+    """
+    Query interface of a pyramid built with build_pyramid.
+
+    Parameters
+    ----------
+    data_path : str
+        Path to the .npy file the pyramid was built for (read memory-mapped for the finest zoom levels).
+    times : np.array
+        Time stamps of the samples (uniformly sampled).
+    """
+
+    def __init__(self, data_path, times):
+        self.data = np.load(data_path, mmap_mode='r')
+        if self.data.ndim == 1:
+            self.data = self.data[np.newaxis, :]
+        self.times = times
+        directory = _pyramid_dir(data_path)
+        files = os.listdir(directory) if os.path.isdir(directory) else []
+        self.factors = sorted({int(f.split('_')[1]) for f in files if f.startswith('level_') and f.endswith('_min.npy')})
+        self.levels = {f: tuple(np.load(os.path.join(directory, f'level_{f}_{name}.npy'), mmap_mode='r')
+                                for name in ('min', 'max', 'mean')) for f in self.factors}
+
+    def level_for(self, n_samples, n_pixels):
+        """
+        Coarsest decimation factor that still gives at least n_pixels buckets for n_samples (1 for raw data).
+        """
+        usable = [f for f in self.factors if n_samples // f >= n_pixels]
+        return max(usable) if usable else 1
+
+    def query(self, channels, t_range=None, n_pixels=2000):
+        """
+        Summaries of the channels in a time window at the resolution appropriate for n_pixels.
+
+        Parameters
+        ----------
+        channels : int or list
+            Channel or channels to return.
+        t_range : tuple
+            Start and end time of the window, whole recording if None.
+        n_pixels : int
+            Width of the plot in pixels.
+
+        Returns
+        -------
+        times : np.array
+            Start time of each bucket.
+        low, high, mean : np.array
+            Minimum, maximum and mean of each bucket, channels x buckets (equal for raw data).
+        factor : int
+            Decimation factor of the returned level.
+        """
+        channels = np.atleast_1d(channels)
+        start, stop = (0, len(self.times)) if t_range is None else np.searchsorted(self.times, t_range)
+        factor = self.level_for(stop - start, n_pixels)
+
+        if factor == 1:
+            values = np.asarray(self.data[channels, start:stop])
+            return np.asarray(self.times[start:stop]), values, values, values, factor
+
+        # Buckets covering the window
+        first, last = start // factor, -(-stop // factor)
+        low, high, mean = (np.asarray(x[channels, first:last]) for x in self.levels[factor])
+        times = np.asarray(self.times[first * factor:last * factor:factor])
+        return times, low, high, mean, factor
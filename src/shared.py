@@ -0,0 +1,346 @@
+import os
+import json
+import time
+import fcntl
+import atexit
+import hashlib
+import logging
+import tempfile
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+import numpy as np
+
+from .ipc import attach_block, map_block
+
+# Header of the manifest block (int64): state, number of client slots, length of the json description, client pids
+_SERVING, _CLOSING = 1, 0
+_HEADER = 3
+
+def _block_name(exp, index=None):
+    """
+    Name of a shared memory block of an experiment, short enough for macOS (31 characters).
+    """
+    key = hashlib.sha1(exp.encode()).hexdigest()[:12]
+    return f"tw_{key}" if index is None else f"tw_{key}_{index}"
+
+@contextmanager
+def _locked(exp):
+    """
+    Inter-process lock of the client slots of an experiment.
+    """
+    with open(os.path.join(tempfile.gettempdir(), f"{_block_name(exp)}.lock"), 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class SharedExperiment:
+    """
+    Arrays of an experiment in shared memory, created with share_experiment or attached with attach_experiment.
+
+    The arrays are numpy views of the shared blocks (read-only for clients), no data are copied when attaching. The
+    owner keeps the blocks alive until teardown; clients register their pid in a slot of the manifest block so the
+    owner can wait until they detach (slots of crashed clients are freed automatically).
+
+    Attributes
+    ----------
+    exp : str
+        Experiment code.
+    arrays : dict
+        File name without extension (e.g. 'Probe1_lfps_spont', 'times') -> array.
+    owner : bool
+        Whether this process created the blocks.
+    """
+
+    def __init__(self, exp, manifest, blocks, arrays, owner):
+        self.exp = exp
+        self.arrays = arrays
+        self.owner = owner
+        self._manifest = manifest
+        self._blocks = blocks
+        self._header = np.ndarray((_HEADER,), dtype=np.int64, buffer=manifest.buf)
+        self._slots = np.ndarray((int(self._header[1]),), dtype=np.int64, buffer=manifest.buf, offset=_HEADER * 8)
+        self.closed = False
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def __contains__(self, name):
+        return name in self.arrays
+
+    def keys(self):
+        return self.arrays.keys()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if self.owner:
+            self.teardown()
+        else:
+            self.close()
+        return False
+
+    def clients(self):
+        """
+        Pids of the attached client processes (dead clients are dropped).
+        """
+        with _locked(self.exp):
+            for i, pid in enumerate(self._slots):
+                if pid and not _alive(int(pid)):
+                    self._slots[i] = 0
+            return [int(pid) for pid in self._slots if pid]
+
+    def close(self):
+        """
+        Detach this process. Arrays obtained from the experiment stay valid as long as they are referenced.
+        """
+        if self.closed:
+            return
+        if not self.owner:
+            with _locked(self.exp):
+                self._slots[self._slots == os.getpid()] = 0
+        # The blocks of the arrays are unmapped once the arrays are not referenced anymore (see map_block)
+        self.arrays = {}
+        self._blocks = []
+        del self._header, self._slots
+        self._manifest.close()
+        self.closed = True
+
+    def teardown(self, timeout=60., poll=0.5):
+        """
+        Stop serving the experiment: refuse new clients, wait up to timeout seconds for the attached ones to detach and
+        free the shared memory (owner only).
+        """
+        if not self.owner:
+            raise RuntimeError("Only the process that shared the experiment can tear it down")
+        if self.closed:
+            return
+        with _locked(self.exp):
+            self._header[0] = _CLOSING
+        deadline = time.monotonic() + timeout
+        while self.clients() and time.monotonic() < deadline:
+            time.sleep(poll)
+        remaining = self.clients()
+        if remaining:
+            logging.warning(f"Tearing down {self.exp} with attached clients {remaining}")
+        blocks = self._blocks + [self._manifest]
+        self.close()
+        for block in blocks:
+            block.unlink()
+        _owned.pop(self.exp, None)
+        logging.info(f"Shared memory of {self.exp} released")
+
+def share_experiment(exp, input_dir, names=None, max_clients=64, chunk_size=2 ** 24):
+    """
+    Load the .npy files of an experiment once into shared memory.
+
+    Parameters
+    ----------
+    exp : str
+        Experiment code, the name clients attach with.
+    input_dir : str
+        Folder with the .npy files (e.g. data/processed/<exp>).
+    names : list
+        File names without extension to share, all numeric .npy files of the folder if None.
+    max_clients : int
+        Maximal number of simultaneously attached client processes.
+    chunk_size : int
+        Number of bytes copied at once (the files are read memory-mapped, never fully loaded twice).
+
+    Returns
+    -------
+    experiment : SharedExperiment
+        Owner handle, call teardown (or use it as a context manager) to release the memory.
+    """
+    if names is None:
+        names = sorted(os.path.splitext(f)[0] for f in os.listdir(input_dir) if f.endswith('.npy'))
+
+    blocks, arrays, description = [], {}, []
+    try:
+        for name in names:
+            try:
+                source = np.load(os.path.join(input_dir, f"{name}.npy"), mmap_mode='r')
+            except ValueError:
+                # Arrays of Python objects cannot be memory-mapped (nor shared)
+                logging.warning(f"{name}.npy holds Python objects and cannot be shared, skipped")
+                continue
+            block = shared_memory.SharedMemory(name=_block_name(exp, len(blocks)), create=True, size=max(source.nbytes, 1))
+            array = map_block(block, source.shape, source.dtype)
+            # Copy chunk by chunk along the flattened array
+            flat_source, flat_array = source.reshape(-1), array.reshape(-1)
+            step = max(chunk_size // max(source.itemsize, 1), 1)
+            for start in range(0, flat_source.size, step):
+                flat_array[start:start + step] = flat_source[start:start + step]
+            blocks.append(block)
+            arrays[name] = array
+            description.append({'name': name, 'block': block.name, 'shape': list(source.shape), 'dtype': source.dtype.str})
+            logging.info(f"Shared {name} ({source.nbytes / 2 ** 20:.1f} MB) of {exp}")
+
+        info = json.dumps({'exp': exp, 'arrays': description}).encode()
+        manifest = shared_memory.SharedMemory(name=_block_name(exp), create=True, size=(_HEADER + max_clients) * 8 + len(info))
+    except Exception:
+        for block in blocks:
+            block.unlink()
+        raise
+
+    header = np.ndarray((_HEADER + max_clients,), dtype=np.int64, buffer=manifest.buf)
+    header[:] = 0
+    header[1], header[2] = max_clients, len(info)
+    manifest.buf[(_HEADER + max_clients) * 8:(_HEADER + max_clients) * 8 + len(info)] = info
+    header[0] = _SERVING
+    del header
+
+    experiment = SharedExperiment(exp, manifest, blocks, arrays, owner=True)
+    _owned[exp] = experiment
+    return experiment
+
+def attach_experiment(exp):
+    """
+    Attach to an experiment shared by another process, without copying its arrays.
+
+    Parameters
+    ----------
+    exp : str
+        Experiment code.
+
+    Returns
+    -------
+    experiment : SharedExperiment
+        Client handle with read-only arrays, call close when done (done at exit otherwise).
+
+    Raises
+    ------
+    FileNotFoundError
+        If the experiment is not shared (or is being torn down).
+    """
+    manifest = attach_block(_block_name(exp))
+    header = np.ndarray((_HEADER,), dtype=np.int64, buffer=manifest.buf)
+    max_clients, length = int(header[1]), int(header[2])
+    slots = np.ndarray((max_clients,), dtype=np.int64, buffer=manifest.buf, offset=_HEADER * 8)
+
+    # Register this process in a free slot (or in the slot of a dead client)
+    with _locked(exp):
+        if header[0] != _SERVING:
+            del header, slots
+            manifest.close()
+            raise FileNotFoundError(f"Experiment {exp} is being torn down")
+        free = [i for i, pid in enumerate(slots) if pid == 0 or not _alive(int(pid))]
+        if not free:
+            del header, slots
+            manifest.close()
+            raise RuntimeError(f"Too many clients attached to {exp} ({max_clients})")
+        slot = free[0]
+        slots[slot] = os.getpid()
+    del header, slots
+
+    try:
+        info = json.loads(bytes(manifest.buf[(_HEADER + max_clients) * 8:(_HEADER + max_clients) * 8 + length]))
+        blocks, arrays = [], {}
+        for entry in info['arrays']:
+            block = attach_block(entry['block'])
+            array = map_block(block, tuple(entry['shape']), np.dtype(entry['dtype']))
+            array.flags.writeable = False
+            blocks.append(block)
+            arrays[entry['name']] = array
+    except Exception:
+        # E.g. a block unlinked by a concurrent teardown: free the slot so that the owner does not wait for this process
+        with _locked(exp):
+            slots = np.ndarray((max_clients,), dtype=np.int64, buffer=manifest.buf, offset=_HEADER * 8)
+            slots[slot] = 0
+            del slots
+        manifest.close()
+        raise
+
+    experiment = SharedExperiment(exp, manifest, blocks, arrays, owner=False)
+    _attached[exp] = experiment
+    return experiment
+
+# Experiments shared by and attached in this process
+_owned = {}
+_attached = {}
+
+def load_experiment(exp, input_dir, names):
+    """
+    Arrays of an experiment, attached zero-copy if the experiment is shared and loaded from input_dir otherwise (from the
+    .npy files, or from archives if only those exist). Names missing from a shared experiment are loaded from input_dir.
+
+    Parameters
+    ----------
+    exp : str
+        Experiment code.
+    input_dir : str
+        Folder with the .npy files, used if the experiment is not shared.
+    names : list
+        File names without extension.
+
+    Returns
+    -------
+    arrays : list
+        Arrays in the order of names.
+    """
+    experiment = _owned.get(exp) or _attached.get(exp)
+    if experiment is None:
+        try:
+            experiment = attach_experiment(exp)
+            logging.info(f"Attached to shared experiment {exp}")
+        except FileNotFoundError:
+            pass
+    # Names which are not shared are loaded from disk
+    from .archive import load_array
+    return [experiment[name] if experiment is not None and name in experiment else
+            load_array(os.path.join(input_dir, name)) for name in names]
+
+def serve_experiments(exps, input_dir, names=None, max_clients=64, timeout=60.):
+    """
+    Share experiments until the process is interrupted (Ctrl+C or SIGTERM), then tear them down.
+
+    Parameters
+    ----------
+    exps : list
+        Experiment codes.
+    input_dir : str
+        Folder with one subfolder of .npy files per experiment.
+    names : list
+        File names without extension to share, all numeric .npy files if None.
+    max_clients : int
+        Maximal number of simultaneously attached clients per experiment.
+    timeout : float
+        Seconds to wait for attached clients at teardown.
+    """
+    import signal
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, stop)
+
+    experiments = []
+    try:
+        for exp in exps:
+            experiments.append(share_experiment(exp, os.path.join(input_dir, exp), names, max_clients))
+        logging.info(f"Serving {', '.join(exps)}, press Ctrl+C to stop")
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for experiment in experiments:
+            experiment.teardown(timeout)
+
+@atexit.register
+def _close_all():
+    for experiment in list(_attached.values()):
+        experiment.close()
+    _attached.clear()
+    for experiment in list(_owned.values()):
+        experiment.teardown(timeout=0)
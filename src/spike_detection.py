@@ -1,17 +1,22 @@
 from .loaders import load_ncs_data
-from .utils import filter_signal
+from .profiling import profiled
 import numpy as np
 import quantities as pq
-import neo
-from elephant.spike_train_generation import peak_detection
 from tqdm import tqdm
-import elephant.spike_train_synchrony as sync
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from contextlib import nullcontext
+import os
 
 def read_spikes(path, sampling_rate=20000. * pq.Hz, threshold_cutoff=4.2):
     """
     Reads in data from a file and detects spikes in the data.
     """
-    raw_signal = load_ncs_data(path, sampling_rate=sampling_rate)
+    import neo
+    from elephant.spike_train_generation import peak_detection
+    from neurodsp.filt import filter_signal
+
+    raw_signal, _ = load_ncs_data(path, sampling_rate=sampling_rate)
    
     # Filter signal with highpass filter
     fs=sampling_rate.magnitude
@@ -35,59 +40,600 @@ def read_spikes(path, sampling_rate=20000. * pq.Hz, threshold_cutoff=4.2):
     return st
 
 
-def read_spikes_from_channels(path_list, save=False):
+def design_spike_filter(fs=20000., f_range=(300, 3000), order=3):
+    """
+    Design a band-pass Butterworth filter (second-order sections) for spike detection.
+
+    Parameters
+    ----------
+    fs : float
+        Sampling rate of the data in Hz.
+    f_range : tuple
+        Low and high cutoff frequencies of the band-pass filter in Hz.
+    order : int
+        Order of the Butterworth filter.
+
+    Returns
+    -------
+    sos : np.array
+        Second-order sections of the filter, usable with scipy.signal.sosfiltfilt.
+    """
+    from scipy import signal
+
+    return signal.butter(order, f_range, btype='bandpass', fs=fs, output='sos')
+
+def _detect_troughs(x, threshold):
+    """
+    Find the minimum of every excursion of x below threshold.
+
+    Parameters
+    ----------
+    x : np.array
+        Filtered signal of one channel.
+    threshold : float
+        Negative detection threshold.
+
+    Returns
+    -------
+    troughs : np.array
+        Sample indices (int64) of the trough of each excursion.
+    """
+    # Samples below threshold, and the start of each excursion among them
+    below = np.flatnonzero(x < threshold)
+    if len(below) == 0:
+        return np.empty(0, dtype=np.int64)
+    starts = np.ones(len(below), dtype=bool)
+    starts[1:] = np.diff(below) > 1
+    excursion = np.cumsum(starts)
+
+    # Sort by excursion then by value; the first sample of every excursion is its trough
+    order = np.lexsort((x[below], excursion))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = np.diff(excursion[order]) > 0
+    return below[order[first]].astype(np.int64)
+
+def _dilate(mask, width):
+    """
+    Widen every True run of a boolean (channels x time) mask by width samples on both sides.
+    """
+    # A sample is marked if the window around it contains at least one True value
+    counts = np.cumsum(np.pad(mask, ((0, 0), (width + 1, width)), mode='constant'), axis=1, dtype=np.int64)
+    return (counts[:, 2 * width + 1:] - counts[:, :-2 * width - 1]) > 0
+
+def _apply_refractory(spikes, refractory):
+    """
+    Drop spikes that follow the last kept spike by less than the refractory period (in samples), spikes are sorted.
+
+    Examples
+    --------
+    A burst keeps every spike that is at least one refractory period after the last kept one:
+
+    >>> _apply_refractory(np.array([0, 15, 30, 45, 60]), 20).tolist()
+    [0, 30, 60]
+    """
+    if len(spikes) < 2 or refractory <= 0:
+        return spikes
+    # Spikes at least one refractory period after the previous spike are always kept
+    short = np.diff(spikes) < refractory
+    if not short.any():
+        return spikes
+    keep = np.ones(len(spikes), dtype=bool)
+    keep[1:] = ~short
+
+    # Runs of sub-refractory intervals (bursts) start with a kept spike, the rest of the run depends on the spikes kept
+    # before: greedy pass jumping to the first spike outside the refractory period of the last kept spike
+    edges = np.diff(np.concatenate(([False], short, [False])).astype(np.int8))
+    for start, stop in zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1) + 1):
+        run = spikes[start:stop]
+        i = 0
+        while True:
+            i = np.searchsorted(run, run[i] + refractory, side='left')
+            if i >= len(run):
+                break
+            keep[start + i] = True
+    return spikes[keep]
+
+@profiled(items=lambda data, *args, **kwargs: np.size(data))
+def detect_spikes(data, fs=20000., threshold_cutoff=4.2, f_range=(300, 3000), refractory=0.001, chunk_duration=10., overlap=0.05, sos=None):
+    """
+    Detect spikes in raw channels x time data with a negative threshold crossing.
+
+    The data are processed in chunks (works with np.memmap arrays), each chunk is extended by an overlap on both sides
+    before band-pass filtering so that chunk borders are free of filter transients. The threshold is computed per chunk
+    and channel from the median absolute deviation (MAD) of the filtered signal. NaN samples are excluded from the
+    threshold estimate and no spike is reported inside NaN gaps (or within the overlap around them); the remaining
+    samples keep their original positions, so spike timing is not shifted.
+
+    Parameters
+    ----------
+    data : np.array
+        Raw time series, channels x time (or 1D for a single channel).
+    fs : float
+        Sampling rate of the data in Hz.
+    threshold_cutoff : float
+        Scalar to multiply the robust standard deviation (MAD / 0.6745) by to define the threshold.
+    f_range : tuple
+        Band-pass frequency range in Hz, ignored if sos is given.
+    refractory : float
+        Minimal interval between two spikes of one channel in seconds.
+    chunk_duration : float
+        Duration of one chunk in seconds.
+    overlap : float
+        Duration in seconds by which each chunk is extended on both sides before filtering.
+    sos : np.array
+        Precomputed filter (see design_spike_filter).
+
+    Returns
+    -------
+    spikes : list
+        List with one np.array of spike sample indices (int64) per channel.
+    """
+    from scipy import signal
+
+    if data.ndim == 1:
+        data = data[np.newaxis, :]
+    if sos is None:
+        sos = design_spike_filter(fs, f_range)
+
+    n_channels, n_samples = data.shape
+    chunk = max(int(chunk_duration * fs), 1)
+    pad = int(overlap * fs)
+    spikes = [[] for _ in range(n_channels)]
+
+    for start in range(0, n_samples, chunk):
+        stop = min(start + chunk, n_samples)
+        # Read chunk extended by the overlap on both sides
+        ext_start, ext_stop = max(start - pad, 0), min(stop + pad, n_samples)
+        x = np.array(data[:, ext_start:ext_stop], dtype=np.float64)
+
+        # Zero NaN gaps before filtering and mark the samples affected by them
+        nans = np.isnan(x)
+        has_nans = nans.any()
+        if has_nans:
+            x[nans] = 0
+            # Widen the NaN mask by the overlap, filter transients around gaps are discarded
+            invalid = _dilate(nans, pad)
+
+        # Band-pass filter the extended chunk
+        padlen = min(3 * (2 * len(sos) + 1), x.shape[1] - 1)
+        if padlen < 0:
+            continue
+        x = signal.sosfiltfilt(sos, x, axis=1, padlen=padlen)
+
+        core = slice(start - ext_start, stop - ext_start)
+        for ch in range(n_channels):
+            # Robust threshold from the valid samples of the chunk core
+            valid = x[ch, core] if not has_nans else x[ch, core][~invalid[ch, core]]
+            if len(valid) == 0:
+                continue
+            median = np.median(valid)
+            threshold = median - threshold_cutoff * np.median(np.abs(valid - median)) / 0.6745
+
+            troughs = _detect_troughs(x[ch], threshold)
+            # Keep only troughs inside the chunk core, outside of NaN gaps
+            troughs = troughs[(troughs >= core.start) & (troughs < core.stop)]
+            if has_nans:
+                troughs = troughs[~invalid[ch, troughs]]
+            spikes[ch].append(troughs + ext_start)
+
+    refractory_samples = int(refractory * fs)
+    return [_apply_refractory(np.concatenate(st) if st else np.empty(0, dtype=np.int64), refractory_samples) for st in spikes]
+
+def read_spike_indices(path, sos, sampling_rate=20000. * pq.Hz, threshold_cutoff=4.2):
+    """
+    Reads in data of one channel from a file and detects spikes with detect_spikes.
+
+    Parameters
+    ----------
+    path : str
+        Path to the ncs file of the channel.
+    sos : np.array
+        Band-pass filter designed once for all channels (see design_spike_filter).
+    sampling_rate : pq.Quantity
+        Sampling rate of the data.
+    threshold_cutoff : float
+        Scalar to multiply the robust standard deviation by to define the threshold.
+
+    Returns
+    -------
+    spikes : np.array
+        Spike sample indices (int64).
+    t_start : pq.Quantity
+        Start time of the recording.
+    t_stop : pq.Quantity
+        Stop time of the recording.
+    """
+    raw_signal, _ = load_ncs_data(path, sampling_rate=sampling_rate)
+    fs = float(sampling_rate.rescale(pq.Hz).magnitude)
+    # Only the compact index array leaves the worker, the raw signal is released here
+    spikes = detect_spikes(np.squeeze(raw_signal.magnitude), fs=fs, threshold_cutoff=threshold_cutoff, sos=sos)[0]
+    return spikes, raw_signal.t_start.rescale(pq.s), raw_signal.t_stop.rescale(pq.s)
+
+def read_spikes_from_channels(path_list, save=False, n_jobs=1, sampling_rate=20000. * pq.Hz, threshold_cutoff=4.2):
     """
     Reads in data from multiple files and detects spikes in the data.
+
+    Every channel is processed with read_spikes. With n_jobs > 1 the channels are processed in a pool of n_jobs worker
+    processes, so at most n_jobs channels are held in memory; the detected spikes do not depend on n_jobs.
     """
-    spiketrains = []  # list to store detected spike trains
-    # Loop through each channel's data
-    for path in tqdm(path_list):
-        # Call read_spikes function to detect spikes in this channel's data
-        st = read_spikes(path)
-        # Append detected spike train for this channel to list
-        spiketrains.append(st)
-    
+    args = (path_list, repeat(sampling_rate), repeat(threshold_cutoff))
+    with (ProcessPoolExecutor(max_workers=n_jobs) if n_jobs > 1 else nullcontext()) as pool:
+        # Same detection in this process or in the workers
+        results = pool.map(read_spikes, *args) if pool is not None else map(read_spikes, *args)
+        spiketrains = list(tqdm(results, total=len(path_list)))
+
     # Filter out highly synchronized spikes
     spiketrains = filter_synchronized_spikes(spiketrains)
     return spiketrains
 
 
-def filter_synchronized_spikes(spiketrains):
+def remove_synchrofacts(spikes, fs=20000., bin_size=None, threshold=1.5, mode='delete'):
+    """
+    Removes synchronous spikes (synchrofacts) from spike sample indices of multiple channels.
+
+    Spikes of all channels are merged and binned, the complexity of a bin is the number of channels spiking in it.
+    Spikes in bins with complexity >= threshold are deleted (or, with mode='extract', kept). This matches
+    elephant's Synchrotool.delete_synchrofacts with spread=0 and binary=True.
+
+    Parameters
+    ----------
+    spikes : list
+        List of np.array of spike sample indices, one per channel.
+    fs : float
+        Sampling rate of the spike indices in Hz.
+    bin_size : float
+        Coincidence width in seconds, one sample (1 / fs) if None.
+    threshold : float
+        Spikes with complexity >= threshold are deleted, must be > 1.
+    mode : str
+        'delete' removes synchronous spikes, 'extract' keeps only synchronous spikes.
+
+    Returns
+    -------
+    spikes : list
+        List of np.array of the remaining spike sample indices, one per channel.
+    masks : list
+        List of boolean np.array, True for the remaining spikes of each channel.
+    """
+    if mode not in ('delete', 'extract'):
+        raise ValueError(f"Invalid mode '{mode}'. Valid modes are: 'delete', 'extract'")
+    if threshold <= 1:
+        raise ValueError('A deletion threshold <= 1 would result in the deletion of all spikes.')
+
+    spikes = [np.asarray(st, dtype=np.int64) for st in spikes]
+    counts = np.array([len(st) for st in spikes])
+    if counts.sum() == 0:
+        return spikes, [np.ones(len(st), dtype=bool) for st in spikes]
+
+    # Merge all channels, remembering the channel of each spike
+    merged = np.concatenate(spikes)
+    channels = np.repeat(np.arange(len(spikes)), counts)
+
+    # Bin the spikes, bin_size is given in seconds
+    bin_samples = 1. if bin_size is None else bin_size * fs
+    bins = np.floor(merged / bin_samples + 1e-8).astype(np.int64)
+
+    # Sort by bin and channel, then count distinct channels per bin with run-length flags
+    order = np.lexsort((channels, bins))
+    sorted_bins, sorted_channels = bins[order], channels[order]
+    new_bin = np.ones(len(order), dtype=bool)
+    new_bin[1:] = sorted_bins[1:] != sorted_bins[:-1]
+    new_channel = new_bin.copy()
+    new_channel[1:] |= sorted_channels[1:] != sorted_channels[:-1]
+    bin_ids = np.cumsum(new_bin) - 1
+    complexity_per_bin = np.bincount(bin_ids, weights=new_channel)
+
+    # Complexity of each spike in the original (merged) order
+    complexity = np.empty(len(order))
+    complexity[order] = complexity_per_bin[bin_ids]
+
+    keep = complexity < threshold
+    if mode == 'extract':
+        keep = ~keep
+
+    masks = np.split(keep, np.cumsum(counts)[:-1])
+    return [st[m] for st, m in zip(spikes, masks)], masks
+
+def filter_synchronized_spikes(spiketrains, sampling_rate=20000. * pq.Hz, bin_size=None, threshold=1.5):
     """
     Filters out highly synchronized spikes.
     """
-    # Create a Synchrotool object with the input spike train
-    synchrotool = sync.Synchrotool(spiketrains, sampling_rate=20000. * pq.Hz)
+    fs = float(sampling_rate.rescale(pq.Hz).magnitude)
+    bin_size = None if bin_size is None else float(bin_size.rescale(pq.s).magnitude)
+
+    # Convert spike times to sample indices relative to the start of the recording
+    spikes = [np.rint((st.times - st.t_start).rescale(pq.s).magnitude * fs).astype(np.int64) for st in spiketrains]
 
     # Filter out highly synchronized spikes
-    filtered_spike_train = synchrotool.delete_synchrofacts(threshold=1.5, in_place=True, mode='delete')
+    _, masks = remove_synchrofacts(spikes, fs=fs, bin_size=bin_size, threshold=threshold)
 
     # Return filtered spike train
-    return filtered_spike_train
+    return [st[mask] for st, mask in zip(spiketrains, masks)]
+
+def times_to_indices(spike_times, times):
+    """
+    Map spike times to the indices of the nearest samples.
+
+    Parameters
+    ----------
+    spike_times : np.array
+        Spike times, in the same units as times.
+    times : np.array
+        Sorted time stamps of the signal.
+
+    Returns
+    -------
+    indices : np.array
+        Sample index (int64) of the nearest time stamp for each spike time.
+    """
+    spike_times = np.asarray(spike_times, dtype=np.float64)
+    times = np.asarray(times, dtype=np.float64)
+    # Right neighbour of each spike time, then step back where the left neighbour is closer
+    indices = np.clip(np.searchsorted(times, spike_times), 1, len(times) - 1)
+    indices -= (spike_times - times[indices - 1]) <= (times[indices] - spike_times)
+    return indices.astype(np.int64)
 
-def compute_waveform(lfp, times, dtctd, fs=20000, f_range=(300, 3000)):
+def extract_waveforms(data, spike_indices, window=(30, 30), boundary='nan'):
+    """
+    Extract waveform snippets around spike indices from one or multiple channels at once.
+
+    Parameters
+    ----------
+    data : np.array
+        Signal of one channel (1D) or channels x time (2D), e.g. neighbouring probe contacts.
+    spike_indices : np.array
+        Sample indices of the spikes.
+    window : tuple
+        Number of samples taken before and after the spike index.
+    boundary : str
+        How to treat spikes whose window exceeds the signal: 'nan' fills the missing samples with NaN,
+        'drop' removes these spikes from the output.
+
+    Returns
+    -------
+    waveforms : np.array
+        Snippets of shape (n_spikes, window) for 1D data or (n_spikes, n_channels, window) for 2D data.
+    valid : np.array
+        Boolean mask of the spikes whose window lies completely within the signal.
+    """
+    if boundary not in ('nan', 'drop'):
+        raise ValueError(f"Unknown boundary mode: {boundary}")
+
+    spike_indices = np.asarray(spike_indices, dtype=np.int64)
+    n_samples = data.shape[-1]
+    before, after = window
+
+    # Offset matrix, one row of sample indices per spike
+    offsets = np.arange(-before, after, dtype=np.int64)
+    indices = spike_indices[:, np.newaxis] + offsets[np.newaxis, :]
+    valid = (spike_indices - before >= 0) & (spike_indices + after <= n_samples)
+
+    if boundary == 'drop':
+        indices = indices[valid]
+    out_of_range = (indices < 0) | (indices >= n_samples)
+    indices = np.clip(indices, 0, n_samples - 1)
+
+    # Gather all snippets at once
+    if data.ndim == 1:
+        waveforms = np.asarray(data[indices], dtype=np.float64)
+    else:
+        waveforms = np.asarray(data[:, indices], dtype=np.float64).transpose(1, 0, 2)
+        out_of_range = out_of_range[:, np.newaxis, :]
+    if out_of_range.any():
+        waveforms = np.where(out_of_range, np.nan, waveforms)
+
+    return waveforms, valid
+
+def compute_waveform(lfp, times, dtctd, fs=20000, f_range=(300, 3000), window=(30, 30), boundary='nan'):
     """
     Compute the waveforms of high frequency oscillations in the lfp signal around the spike times.
     
     Parameters:
-    lfp (ndarray): The lfp signal.
+    lfp (ndarray): The lfp signal, one channel or channels x time (e.g. neighbouring probe contacts).
     times (ndarray): Array of times corresponding to the lfp signal.
     dtctd (ndarray): Array of detected spike times.
     fs (int): The sampling frequency of the lfp signal (default: 20000).
     f_range (tuple): The range of frequencies to pass through the filter (default: (300, 3000)).
+    window (tuple): Number of samples before and after the spike (default: (30, 30)).
+    boundary (str): 'nan' pads waveforms at the signal edges with NaN, 'drop' removes them (default: 'nan').
     
     Returns:
-    waveforms (list): A list of waveforms.
+    waveforms (ndarray): Waveforms of shape (n_spikes, window) or (n_spikes, n_channels, window).
     """
+    from neurodsp.filt import filter_signal
+
     # Filter the lfp frequencies from 300 to 3000 Hz
-    lfp_filtered = filter_signal(np.squeeze(lfp), fs, 'highpass', f_range, return_filter=False)
-    waveforms = []
+    lfp = np.squeeze(lfp)
+    if lfp.ndim == 1:
+        lfp_filtered = filter_signal(lfp, fs, 'highpass', f_range, return_filter=False)
+    else:
+        lfp_filtered = np.array([filter_signal(l, fs, 'highpass', f_range, return_filter=False) for l in lfp])
+
+    # Map the detected spike times to sample indices
+    indices = times_to_indices(dtctd, times)
     # Extract waveforms around the detected spike times
-    for i in dtctd:
-        # Get the index of the spike time
-        idx = np.where(times == i)[0][0]
-        # Get the waveform
-        waveform = lfp_filtered[idx-30:idx+30]
-        # Append the waveform to the list
-        waveforms.append(waveform)
-    return waveforms
\ No newline at end of file
+    waveforms, _ = extract_waveforms(lfp_filtered, indices, window=window, boundary=boundary)
+    return waveforms
+
+class SpikeTrains:
+    """
+    Compact storage of spike trains of multiple channels in CSR layout.
+
+    Spike sample indices of all channels are kept in one flat int64 array, the spikes of channel i are
+    indices[offsets[i]:offsets[i + 1]] (sorted). Per-spike amplitudes and waveforms are optional and share the layout.
+
+    Parameters
+    ----------
+    indices : np.array
+        Flat array of spike sample indices (int64).
+    offsets : np.array
+        Start of each channel in indices, length n_channels + 1.
+    fs : float
+        Sampling rate of the spike indices in Hz.
+    t_start : float
+        Time of sample index 0 in seconds.
+    t_stop : float
+        End time of the recording in seconds.
+    amplitudes : np.array
+        Optional amplitude of each spike.
+    waveforms : np.array
+        Optional waveform of each spike, shape (n_spikes, ...).
+    """
+
+    def __init__(self, indices, offsets, fs=20000., t_start=0., t_stop=None, amplitudes=None, waveforms=None):
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.fs = float(fs)
+        self.t_start = float(t_start)
+        if t_stop is None:
+            t_stop = self.t_start + (self.indices.max() + 1 if len(self.indices) else 0) / self.fs
+        self.t_stop = float(t_stop)
+        self.amplitudes = amplitudes
+        self.waveforms = waveforms
+
+    @classmethod
+    def from_list(cls, spikes, fs=20000., t_start=0., t_stop=None, amplitudes=None, waveforms=None):
+        """
+        Build the container from a list of spike index arrays, one per channel (e.g. output of detect_spikes).
+        Amplitudes and waveforms, if given, are lists with one array per channel as well.
+        """
+        spikes = [np.asarray(st, dtype=np.int64) for st in spikes]
+        # Spikes of every channel are stored sorted, amplitudes and waveforms follow the same order
+        orders = [np.argsort(st, kind='stable') for st in spikes]
+        offsets = np.zeros(len(spikes) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(st) for st in spikes])
+        indices = np.concatenate([st[o] for st, o in zip(spikes, orders)]) if spikes else np.empty(0, dtype=np.int64)
+        if amplitudes is not None:
+            amplitudes = np.concatenate([np.asarray(a)[o] for a, o in zip(amplitudes, orders)])
+        if waveforms is not None:
+            waveforms = np.concatenate([np.asarray(w)[o] for w, o in zip(waveforms, orders)])
+        return cls(indices, offsets, fs=fs, t_start=t_start, t_stop=t_stop, amplitudes=amplitudes, waveforms=waveforms)
+
+    @classmethod
+    def from_neo(cls, spiketrains, fs=20000.):
+        """
+        Build the container from a list of neo.SpikeTrain objects sharing t_start and t_stop.
+        """
+        t_start = float(spiketrains[0].t_start.rescale(pq.s).magnitude)
+        t_stop = float(spiketrains[0].t_stop.rescale(pq.s).magnitude)
+        spikes = [np.rint((st.times.rescale(pq.s).magnitude - t_start) * fs).astype(np.int64) for st in spiketrains]
+        return cls.from_list(spikes, fs=fs, t_start=t_start, t_stop=t_stop)
+
+    def to_neo(self):
+        """
+        Convert the container to a list of neo.SpikeTrain objects.
+        """
+        import neo
+
+        return [neo.SpikeTrain(self.t_start + self[ch] / self.fs, t_start=self.t_start * pq.s, t_stop=self.t_stop * pq.s, units='s')
+                for ch in range(len(self))]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, channel):
+        return self.indices[self.offsets[channel]:self.offsets[channel + 1]]
+
+    @property
+    def channels(self):
+        """
+        Channel of each spike in indices.
+        """
+        return np.repeat(np.arange(len(self)), np.diff(self.offsets))
+
+    def times(self, channel):
+        """
+        Spike times of one channel in seconds.
+        """
+        return self.t_start + self[channel] / self.fs
+
+    def time_slice(self, t_start, t_stop):
+        """
+        Spikes with t_start <= time < t_stop of all channels, as a new container (indices keep their sample positions).
+        """
+        start, stop = np.ceil((np.array([t_start, t_stop]) - self.t_start) * self.fs).astype(np.int64)
+
+        # Make the indices globally sorted by offsetting every channel, then search all channels at once
+        span = max(int(self.indices.max()) + 1 if len(self.indices) else 0, stop, 0) + 1
+        keys = self.channels * span + self.indices
+        bounds = np.arange(len(self)) * span
+        lo = np.searchsorted(keys, bounds + max(start, 0))
+        hi = np.searchsorted(keys, bounds + max(stop, 0))
+
+        # Gather the selected ranges
+        counts = hi - lo
+        offsets = np.zeros(len(self) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(counts)
+        selected = np.repeat(lo - offsets[:-1], counts) + np.arange(offsets[-1])
+
+        amplitudes = None if self.amplitudes is None else self.amplitudes[selected]
+        waveforms = None if self.waveforms is None else self.waveforms[selected]
+        return SpikeTrains(self.indices[selected], offsets, fs=self.fs, t_start=self.t_start, t_stop=self.t_stop,
+                           amplitudes=amplitudes, waveforms=waveforms)
+
+    def bin(self, bin_size, t_start=None, t_stop=None, rate=False):
+        """
+        Bin all channels into a channels x bins matrix of spike counts.
+
+        Parameters
+        ----------
+        bin_size : float
+            Bin size in seconds.
+        t_start : float
+            Start of the first bin in seconds, the start of the recording if None.
+        t_stop : float
+            End of the binned range in seconds, the end of the recording if None.
+        rate : bool
+            Whether to return rates in Hz instead of counts.
+
+        Returns
+        -------
+        binned : np.array
+            Spike counts (or rates) of shape (n_channels, n_bins).
+        edges : np.array
+            Bin edges in seconds.
+        """
+        t_start = self.t_start if t_start is None else t_start
+        t_stop = self.t_stop if t_stop is None else t_stop
+        n_bins = max(int(np.ceil((t_stop - t_start) / bin_size - 1e-8)), 0)
+        edges = t_start + np.arange(n_bins + 1) * bin_size
+
+        # Bin index of every spike, spikes outside the range are discarded
+        bins = np.floor((self.t_start + self.indices / self.fs - t_start) / bin_size + 1e-8).astype(np.int64)
+        inside = (bins >= 0) & (bins < n_bins)
+        flat = self.channels[inside] * n_bins + bins[inside]
+        binned = np.bincount(flat, minlength=len(self) * n_bins).reshape(len(self), n_bins)
+
+        if rate:
+            binned = binned / bin_size
+        return binned, edges
+
+    def save(self, path):
+        """
+        Save the container into a directory of .npy files.
+        """
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'indices.npy'), self.indices)
+        np.save(os.path.join(path, 'offsets.npy'), self.offsets)
+        np.save(os.path.join(path, 'meta.npy'), np.array([self.fs, self.t_start, self.t_stop]))
+        for name, values in [('amplitudes', self.amplitudes), ('waveforms', self.waveforms)]:
+            file = os.path.join(path, f'{name}.npy')
+            if values is not None:
+                np.save(file, values)
+            elif os.path.exists(file):
+                # Left over from an earlier save into the same directory, load would pick it up
+                os.remove(file)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """
+        Load a container saved with save; arrays are memory-mapped (no copy) unless mmap_mode is None.
+        """
+        fs, t_start, t_stop = np.load(os.path.join(path, 'meta.npy'))
+        optional = {}
+        for name in ['amplitudes', 'waveforms']:
+            file = os.path.join(path, f'{name}.npy')
+            optional[name] = np.load(file, mmap_mode=mmap_mode) if os.path.exists(file) else None
+        return cls(np.load(os.path.join(path, 'indices.npy'), mmap_mode=mmap_mode),
+                   np.load(os.path.join(path, 'offsets.npy'), mmap_mode=mmap_mode),
+                   fs=fs, t_start=t_start, t_stop=t_stop, **optional)
@@ -0,0 +1,838 @@
+import os
+import time
+import queue
+import struct
+import socket
+import logging
+import tempfile
+import threading
+import socketserver
+from collections import defaultdict
+import numpy as np
+
+from .ipc import send_message, receive_message
+
+# Socket the acquisition (or replay) server streams on
+DEFAULT_SOCKET = os.environ.get('THESIS_STREAM_SOCKET', os.path.join(tempfile.gettempdir(), 'thesis_stream.sock'))
+
+# Header of a chunk on the wire: sequence number, index of its first sample, acquisition time, channels, samples.
+# The samples follow as float32, channels x samples.
+_HEADER = struct.Struct('<QQdII')
+_END = _HEADER.pack(0, 0, 0., 0, 0)
+
+# Frequency bands of BandPowerStage
+BANDS = {'delta': (0.5, 4), 'theta': (4, 8), 'alpha': (8, 13), 'beta': (13, 30), 'gamma': (30, 100)}
+
+class Chunk:
+    """
+    Samples of all channels acquired together.
+
+    Attributes
+    ----------
+    seq : int
+        Sequence number given by the acquisition, gaps are dropped chunks.
+    start : int
+        Index of the first sample since the start of the acquisition.
+    acquired : float
+        Wall-clock time (time.time()) at which the last sample was acquired, the reference of the latency.
+    data : np.array
+        Channels x samples, replaced by the stages that transform the signal.
+    gap : int
+        Number of chunks dropped right before this one.
+    results : dict
+        Outputs of the stages (e.g. 'upstates', 'band_power').
+    """
+
+    def __init__(self, seq, start, acquired, data):
+        self.seq = seq
+        self.start = start
+        self.acquired = acquired
+        self.data = data
+        self.gap = 0
+        self.results = {}
+
+    def __len__(self):
+        return self.data.shape[1]
+
+class ReplaySource:
+    """
+    Chunks of a recording in memory (or np.memmap, or Archive), to replay it as if it was acquired.
+
+    Parameters
+    ----------
+    data : np.array
+        Channels x time.
+    fs : float
+        Sampling rate.
+    chunk_size : int
+        Samples per chunk.
+    t0 : float
+        Time of the first sample.
+    loop : bool
+        Start again from the beginning at the end of the recording.
+    """
+
+    def __init__(self, data, fs, chunk_size=50, t0=0., loop=False):
+        self.data = data
+        self.fs = float(fs)
+        self.n_channels = data.shape[0]
+        self.chunk_size = int(chunk_size)
+        self.t0 = float(t0)
+        self.loop = loop
+
+    def __iter__(self):
+        n_samples = self.data.shape[1]
+        while True:
+            for start in range(0, n_samples, self.chunk_size):
+                yield np.asarray(self.data[:, start:start + self.chunk_size])
+            if not self.loop:
+                return
+
+class SyntheticSource:
+    """
+    Synthetic ECoG generated chunk by chunk: slow oscillation with up/down states, colored noise and 60/120 Hz line noise
+    (the signal of src.synthetic.generate_recording without travelling waves).
+
+    Parameters
+    ----------
+    fs : float
+        Sampling rate.
+    n_channels : int
+        Number of channels.
+    chunk_size : int
+        Samples per chunk.
+    duration : float
+        Duration in seconds, endless if None.
+    up_mean, down_mean : float
+        Mean up and down state durations in seconds.
+    slow_amplitude, noise_amplitude : float
+        Amplitude of the slow oscillation and of the background noise (V).
+    line_noise : tuple
+        Amplitudes of the 60 Hz and 120 Hz line noise.
+    seed : int
+        Seed of the random generator.
+
+    Attributes
+    ----------
+    upstates : list
+        True upstate intervals generated so far.
+    """
+
+    def __init__(self, fs=1000., n_channels=64, chunk_size=50, duration=None, up_mean=0.5, down_mean=1.0,
+                 slow_amplitude=1e-4, noise_amplitude=5e-5, line_noise=(3e-5, 1e-5), seed=None):
+        self.fs = float(fs)
+        self.n_channels = n_channels
+        self.chunk_size = int(chunk_size)
+        self.t0 = 0.
+        self.duration = duration
+        self.up_mean, self.down_mean = up_mean, down_mean
+        self.slow_amplitude, self.noise_amplitude = slow_amplitude, noise_amplitude
+        self.line_noise = line_noise
+        self.seed = seed
+        self.upstates = []
+
+    def __iter__(self, segment=60.):
+        from .synthetic import generate_states, state_envelope, _ColoredNoise
+
+        rng = np.random.default_rng(self.seed)
+        noise = _ColoredNoise(self.n_channels, 0.95, rng)
+        n_samples = np.inf if self.duration is None else int(self.duration * self.fs)
+        start, segment_start = 0, 0.
+        while start < n_samples:
+            # States are drawn segment by segment, every segment starts with a downstate
+            upstates = generate_states(segment, self.up_mean, self.down_mean, rng=rng) + segment_start
+            self.upstates.extend(map(tuple, upstates))
+            segment_stop = min(int(round((segment_start + segment) * self.fs)), n_samples)
+            for chunk_start in range(start, segment_stop, self.chunk_size):
+                chunk_stop = min(chunk_start + self.chunk_size, segment_stop)
+                t = np.arange(chunk_start, chunk_stop) / self.fs
+                hum = self.line_noise[0] * np.sin(2 * np.pi * 60 * t) + self.line_noise[1] * np.sin(2 * np.pi * 120 * t)
+                yield (self.slow_amplitude * state_envelope(t, upstates) + hum
+                       + self.noise_amplitude * noise(chunk_stop - chunk_start))
+            start, segment_start = segment_stop, segment_start + segment
+
+class _Sender(socketserver.BaseRequestHandler):
+    """
+    Send the acquired chunks to one client, dropping them if the client does not keep up.
+    """
+
+    def handle(self):
+        server = self.server
+        pending = queue.Queue(server.max_pending)
+        send_message(self.request, {'fs': server.source.fs, 'n_channels': server.source.n_channels, 't0': server.source.t0,
+                             'chunk_size': server.source.chunk_size})
+        with server.lock:
+            if server.finished.is_set():
+                pending.put(_END)
+            server.clients[pending] = 0
+        server.connected.set()
+        try:
+            while True:
+                message = pending.get()
+                self.request.sendall(message)
+                if message is _END:
+                    break
+        except (BrokenPipeError, ConnectionResetError):
+            logging.info("Client disconnected")
+        finally:
+            with server.lock:
+                dropped = server.clients.pop(pending)
+            if dropped:
+                logging.warning(f"{dropped} chunk(s) dropped for a slow client")
+
+class AcquisitionServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Local stand-in of the acquisition system: streams the chunks of a source over a Unix socket at the rate they would be
+    acquired.
+
+    Acquisition never waits for the clients: every client has a buffer of max_pending chunks and chunks that do not fit
+    are dropped (the client sees the gap in the sequence numbers).
+
+    Parameters
+    ----------
+    source : ReplaySource or SyntheticSource
+        Iterable of channels x samples arrays with attributes fs, n_channels, chunk_size and t0.
+    socket_path : str
+        Path of the Unix socket.
+    speed : float
+        Replay speed relative to real time.
+    max_pending : int
+        Chunks buffered per client.
+    wait : bool
+        Start the acquisition when the first client connects (otherwise at start).
+    """
+    daemon_threads = True
+
+    def __init__(self, source, socket_path=DEFAULT_SOCKET, speed=1., max_pending=64, wait=True):
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        self.source = source
+        self.socket_path = socket_path
+        self.speed = speed
+        self.max_pending = max_pending
+        self.wait = wait
+        self.clients = {}
+        self.lock = threading.Lock()
+        self.connected = threading.Event()
+        self.finished = threading.Event()
+        self.stopped = threading.Event()
+        self.sent = 0
+        super().__init__(socket_path, _Sender)
+
+    def acquire(self):
+        """
+        Pace the chunks of the source and hand them to the connected clients, until the source ends or stop is called.
+        """
+        if self.wait:
+            while not self.connected.wait(0.1):
+                if self.stopped.is_set():
+                    return
+        logging.info(f"Acquisition started ({self.source.n_channels} channels at {self.source.fs:g} Hz, "
+                     f"{self.speed:g}x real time)")
+        start, n_samples = time.time(), 0
+        try:
+            for seq, block in enumerate(self.source):
+                # A chunk is available once its last sample is acquired
+                n_samples += block.shape[1]
+                if self.stopped.wait(max(start + n_samples / (self.source.fs * self.speed) - time.time(), 0)):
+                    return
+                message = (_HEADER.pack(seq, n_samples - block.shape[1], time.time(), *block.shape)
+                           + np.ascontiguousarray(block, dtype=np.float32).tobytes())
+                with self.lock:
+                    for pending in self.clients:
+                        try:
+                            pending.put_nowait(message)
+                        except queue.Full:
+                            self.clients[pending] += 1
+                self.sent += 1
+        finally:
+            with self.lock:
+                self.finished.set()
+                for pending in self.clients:
+                    # Make room for the end marker
+                    while True:
+                        try:
+                            pending.put_nowait(_END)
+                            break
+                        except queue.Full:
+                            try:
+                                pending.get_nowait()
+                                self.clients[pending] += 1
+                            except queue.Empty:
+                                pass
+        logging.info(f"Acquisition finished after {self.sent} chunks ({n_samples / self.source.fs:.1f} s)")
+
+    def start(self):
+        """
+        Serve and acquire in background threads.
+        """
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        self._acquisition = threading.Thread(target=self.acquire, daemon=True)
+        self._acquisition.start()
+        return self
+
+    def join(self, timeout=None, poll=0.1):
+        """
+        Wait until the source is exhausted and the clients received all chunks (or timeout seconds).
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while deadline is None or time.monotonic() < deadline:
+            if self.finished.is_set():
+                with self.lock:
+                    if not self.clients:
+                        return True
+            time.sleep(poll)
+        return False
+
+    def stop(self):
+        """
+        Stop the acquisition and the server, remove the socket.
+        """
+        self.stopped.set()
+        self.shutdown()
+        self.server_close()
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+def serve_source(source, socket_path=DEFAULT_SOCKET, speed=1., max_pending=64, wait=True):
+    """
+    Stream a source until it is exhausted or the process is interrupted (Ctrl+C or SIGTERM).
+
+    Parameters
+    ----------
+    source : ReplaySource or SyntheticSource
+        Chunks to stream.
+    socket_path : str
+        Path of the Unix socket.
+    speed : float
+        Replay speed relative to real time.
+    max_pending : int
+        Chunks buffered per client before chunks are dropped.
+    wait : bool
+        Start the acquisition when the first client connects.
+    """
+    import signal
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, stop)
+
+    server = AcquisitionServer(source, socket_path, speed, max_pending, wait).start()
+    logging.info(f"Streaming on {socket_path}" + (", waiting for a client" if wait else "") + ", press Ctrl+C to stop")
+    try:
+        server.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+def _receive_into(sock, buffer):
+    """
+    Fill buffer from the socket, False if the connection was closed.
+    """
+    view = memoryview(buffer)
+    while len(view):
+        n = sock.recv_into(view)
+        if not n:
+            return False
+        view = view[n:]
+    return True
+
+class SocketSource:
+    """
+    Chunks received from an AcquisitionServer (processing/streaming/replay_server.py or a real acquisition bridge).
+
+    Parameters
+    ----------
+    socket_path : str
+        Path of the Unix socket.
+    timeout : float
+        Seconds to wait for the server to be up.
+
+    Attributes
+    ----------
+    fs, n_channels, chunk_size, t0
+        Stream description sent by the server.
+    """
+
+    def __init__(self, socket_path=DEFAULT_SOCKET, timeout=10.):
+        deadline = time.monotonic() + timeout
+        while True:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                self.sock.connect(socket_path)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                self.sock.close()
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+        info = receive_message(self.sock)
+        if info is None:
+            raise ConnectionError(f"No stream on {socket_path}")
+        self.fs, self.n_channels, self.chunk_size, self.t0 = info['fs'], info['n_channels'], info['chunk_size'], info['t0']
+
+    def __iter__(self):
+        header = bytearray(_HEADER.size)
+        while _receive_into(self.sock, header):
+            seq, start, acquired, n_channels, n_samples = _HEADER.unpack(header)
+            if n_samples == 0:
+                return
+            data = np.empty((n_channels, n_samples), dtype=np.float32)
+            if not _receive_into(self.sock, data):
+                return
+            yield Chunk(seq, start, acquired, data)
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+class NotchStage:
+    """
+    Causal line noise removal: the 60 Hz and 120 Hz notch filters of src.utils.filter_line_noise applied forward only,
+    with the filter state carried from chunk to chunk (filtfilt needs the future samples).
+
+    Parameters
+    ----------
+    Q : float
+        Quality factor of the notch filters (550 as in process_data).
+    freqs : tuple
+        Frequencies to remove.
+    """
+    name = 'notch'
+
+    def __init__(self, Q=550., freqs=(60., 120.)):
+        self.Q = Q
+        self.freqs = freqs
+
+    def setup(self, fs, n_channels):
+        from scipy import signal
+
+        self.filters = [signal.iirnotch(freq, self.Q, fs) for freq in self.freqs]
+        self.zi = None
+
+    def process(self, chunk):
+        from scipy import signal
+
+        data = chunk.data.astype(np.float64)
+        if self.zi is None:
+            # Start from the steady state of the first samples to avoid a transient
+            self.zi = [signal.lfilter_zi(b, a)[np.newaxis, :] * data[:, :1] for b, a in self.filters]
+        for i, (b, a) in enumerate(self.filters):
+            data, self.zi[i] = signal.lfilter(b, a, data, axis=1, zi=self.zi[i])
+        chunk.data = data
+        return chunk
+
+class LowpassStage:
+    """
+    Causal low-pass filter (Butterworth, second-order sections) with the filter state carried from chunk to chunk, the
+    online counterpart of the low-pass filter applied before upstate detection in find_upstates.py.
+
+    Parameters
+    ----------
+    cutoff : float
+        Cutoff frequency in Hz.
+    order : int
+        Order of the filter.
+    """
+    name = 'lowpass'
+
+    def __init__(self, cutoff=5., order=4):
+        self.cutoff = cutoff
+        self.order = order
+
+    def setup(self, fs, n_channels):
+        from scipy import signal
+
+        self.sos = signal.butter(self.order, self.cutoff, 'lowpass', fs=fs, output='sos')
+        self.zi = None
+
+    def process(self, chunk):
+        from scipy import signal
+
+        data = chunk.data.astype(np.float64)
+        if self.zi is None:
+            # Start from the steady state of the first samples to avoid a transient
+            self.zi = signal.sosfilt_zi(self.sos)[:, np.newaxis, :] * data[:, 0][np.newaxis, :, np.newaxis]
+        chunk.data, self.zi = signal.sosfilt(self.sos, data, axis=1, zi=self.zi)
+        return chunk
+
+class UpstateStage:
+    """
+    Online version of src.utils.define_upstate_regions: a channel is active above mean + threshold_scalar * std of the
+    samples seen so far, upstates are the runs of samples with at least one active channel.
+
+    Results per chunk: 'onsets' (times at which upstates started), 'upstates' (start and end times of the upstates that
+    ended, as in define_upstate_regions) and 'active' (whether the last sample is in an upstate).
+
+    Parameters
+    ----------
+    threshold_scalar : float
+        Scalar to multiply the standard deviation by to define the threshold.
+    warmup : float
+        Seconds of data used to estimate the thresholds before detecting.
+    window : float
+        Time constant in seconds of exponentially forgetting statistics (thresholds follow slow drifts), all samples
+        are weighted equally if None.
+    t0 : float
+        Time of the first sample of the stream.
+    """
+    name = 'upstates'
+
+    def __init__(self, threshold_scalar=2, warmup=10., window=None, t0=0.):
+        self.threshold_scalar = threshold_scalar
+        self.warmup = warmup
+        self.window = window
+        self.t0 = t0
+
+    def setup(self, fs, n_channels):
+        self.fs = fs
+        self.count = 0.
+        self.sum = np.zeros(n_channels)
+        self.sum_sq = np.zeros(n_channels)
+        self.seen = 0
+        self.expected = None
+        self.last_zero = None
+        self.active = False
+
+    @property
+    def thresholds(self):
+        mean = self.sum / self.count
+        return mean + np.sqrt(np.maximum(self.sum_sq / self.count - mean ** 2, 0)) * self.threshold_scalar
+
+    def process(self, chunk):
+        data = chunk.data
+        if self.window is not None:
+            decay = np.exp(-len(chunk) / (self.window * self.fs))
+            self.count, self.sum, self.sum_sq = decay * self.count, decay * self.sum, decay * self.sum_sq
+        self.count += len(chunk)
+        self.sum += data.sum(axis=1, dtype=np.float64)
+        self.sum_sq += np.square(data, dtype=np.float64).sum(axis=1)
+        self.seen += len(chunk)
+        chunk.results.update(onsets=[], upstates=[], active=False)
+        if self.seen < self.warmup * self.fs:
+            return chunk
+
+        if chunk.start != self.expected:
+            # First chunk or chunks were dropped, an upstate cannot span the gap
+            self.last_zero, self.active = None, False
+        self.expected = chunk.start + len(chunk)
+
+        active = (data > self.thresholds[:, np.newaxis]).any(axis=0)
+        to_time = lambda i: self.t0 + i / self.fs
+        # Upstates end at the first sample without activity, between two such samples more than one sample apart
+        zeros = chunk.start + np.flatnonzero(~active)
+        if self.last_zero is not None:
+            zeros = np.concatenate([[self.last_zero], zeros])
+        ends = np.flatnonzero(np.diff(zeros) > 1)
+        chunk.results['upstates'] = [(to_time(zeros[i]), to_time(zeros[i + 1])) for i in ends]
+        if len(zeros):
+            self.last_zero = zeros[-1]
+        onsets = np.flatnonzero(active & ~np.concatenate([[self.active], active[:-1]]))
+        chunk.results['onsets'] = [to_time(chunk.start + i) for i in onsets]
+        self.active = chunk.results['active'] = bool(active[-1])
+        return chunk
+
+class BandPowerStage:
+    """
+    Band power over the last window seconds of every channel (Hann windowed periodogram), updated with every chunk.
+
+    Results per chunk: 'band_power', band name -> power per channel (V^2), once window seconds were received.
+
+    Parameters
+    ----------
+    bands : dict
+        Band name -> (low, high) frequencies in Hz.
+    window : float
+        Length of the analysed window in seconds.
+    """
+    name = 'band_power'
+
+    def __init__(self, bands=BANDS, window=1.):
+        self.bands = bands
+        self.window = window
+
+    def setup(self, fs, n_channels):
+        n = int(self.window * fs)
+        self.buffer = np.zeros((n_channels, n))
+        self.filled = 0
+        self.taper = np.hanning(n)
+        freqs = np.fft.rfftfreq(n, 1 / fs)
+        self.masks = {name: (freqs >= low) & (freqs < high) for name, (low, high) in self.bands.items()}
+        # Power spectral density scaling (one-sided), times the frequency resolution
+        self.scale = 2 / (fs * np.sum(self.taper ** 2)) * (fs / n)
+
+    def process(self, chunk):
+        n = self.buffer.shape[1]
+        data = chunk.data[:, -n:]
+        self.buffer = np.roll(self.buffer, -data.shape[1], axis=1)
+        self.buffer[:, -data.shape[1]:] = data
+        self.filled += data.shape[1]
+        if self.filled >= n:
+            power = np.abs(np.fft.rfft(self.buffer * self.taper, axis=1)) ** 2 * self.scale
+            chunk.results['band_power'] = {name: power[:, mask].sum(axis=1) for name, mask in self.masks.items()}
+        return chunk
+
+class ResultSink:
+    """
+    Keep the results of the stages (upstates, onsets and band power) and save them.
+    """
+
+    def __init__(self):
+        self.upstates = []
+        self.onsets = []
+        self.band_power = defaultdict(list)
+        self.band_power_times = []
+
+    def __call__(self, chunk):
+        self.upstates.extend(chunk.results.get('upstates', ()))
+        self.onsets.extend(chunk.results.get('onsets', ()))
+        if 'band_power' in chunk.results:
+            self.band_power_times.append(chunk.start + len(chunk))
+            for name, power in chunk.results['band_power'].items():
+                self.band_power[name].append(power)
+
+    def save(self, path, fs, t0=0., stats=None):
+        """
+        Save the results to a .npz file: upstates (n x 2), onsets, band_power_times, bands, band_power
+        (times x bands x channels) and the latencies of stats.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        bands = list(self.band_power)
+        np.savez(path, upstates=np.array(self.upstates).reshape(-1, 2), onsets=np.array(self.onsets),
+                 band_power_times=t0 + np.array(self.band_power_times) / fs, bands=np.array(bands),
+                 band_power=np.stack([self.band_power[name] for name in bands], axis=1) if bands else np.empty((0, 0, 0)),
+                 latencies=np.array(stats.latencies if stats is not None else []))
+
+class LogSink:
+    """
+    Log the upstates as they are detected.
+    """
+
+    def __call__(self, chunk):
+        for onset in chunk.results.get('onsets', ()):
+            logging.info(f"Upstate onset at {onset:.3f} s")
+        for start, end in chunk.results.get('upstates', ()):
+            logging.info(f"Upstate {start:.3f} - {end:.3f} s ({(end - start) * 1000:.0f} ms)")
+
+class StreamStats:
+    """
+    Latency and dropped chunk statistics of a streaming pipeline.
+
+    Attributes
+    ----------
+    chunks : int
+        Chunks that went through the pipeline.
+    dropped_acquisition : int
+        Chunks dropped before reaching the pipeline (gaps in the sequence numbers, e.g. the server buffer overflowed).
+    dropped_queue : int
+        Chunks dropped by the pipeline because its input queue was full (overflow='drop').
+    latencies : list
+        Seconds from the acquisition of the last sample of every chunk to the end of the sinks.
+    stage_times : dict
+        Stage name -> processing seconds per chunk.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.chunks = 0
+        self.samples = 0
+        self.dropped_acquisition = 0
+        self.dropped_queue = 0
+        self.latencies = []
+        self.stage_times = defaultdict(list)
+
+    def summary(self, fs=None):
+        """
+        Dictionary of the statistics, latencies in ms. With fs, load is the processing time relative to the duration of
+        the chunks (above 1 the pipeline cannot keep up).
+        """
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000
+            total = self.chunks + self.dropped_acquisition + self.dropped_queue
+            summary = {'chunks': self.chunks, 'dropped_acquisition': self.dropped_acquisition,
+                       'dropped_queue': self.dropped_queue, 'drop_rate': (total - self.chunks) / total if total else 0.}
+            if len(latencies):
+                summary.update({f'latency_{name}': float(value) for name, value in
+                                zip(['p50', 'p95', 'p99', 'max'], np.percentile(latencies, [50, 95, 99, 100]))})
+                summary['latency_mean'] = float(latencies.mean())
+            summary['stage_ms'] = {name: 1000 * float(np.mean(times)) for name, times in self.stage_times.items()}
+            if fs is not None and self.samples:
+                summary['load'] = sum(sum(times) for times in self.stage_times.values()) / (self.samples / fs)
+        return summary
+
+    def report(self, fs=None):
+        """
+        Summary as text.
+        """
+        s = self.summary(fs)
+        lines = [f"{s['chunks']} chunks, {s['dropped_acquisition']} dropped at acquisition, {s['dropped_queue']} dropped "
+                 f"in the pipeline ({100 * s['drop_rate']:.2f} %)"]
+        if 'latency_p50' in s:
+            lines.append(f"latency (ms): mean {s['latency_mean']:.1f}, p50 {s['latency_p50']:.1f}, p95 "
+                         f"{s['latency_p95']:.1f}, p99 {s['latency_p99']:.1f}, max {s['latency_max']:.1f}")
+        lines += [f"{name}: {ms:.2f} ms per chunk" for name, ms in s['stage_ms'].items()]
+        if 'load' in s:
+            lines.append(f"load: {100 * s['load']:.1f} % of real time")
+        return '\n'.join(lines)
+
+class StreamingPipeline:
+    """
+    Run chunks from a source through causal stages and into sinks, every stage in its own thread.
+
+    Consecutive threads are connected by queues of queue_size chunks. When a queue is full the upstream thread waits
+    (backpressure): with overflow='block' the wait reaches the source, which stops reading, so the server buffer fills
+    and the acquisition drops chunks; with overflow='drop' the oldest queued chunk is dropped instead, which bounds the
+    latency.
+
+    Parameters
+    ----------
+    source : SocketSource
+        Iterable of Chunk with attributes fs and n_channels (and close to interrupt it).
+    stages : list
+        Objects with setup(fs, n_channels) and process(chunk) -> chunk, e.g. NotchStage, BandPowerStage, LowpassStage,
+        UpstateStage (in this order, the low-pass filtered data are only used for the upstates).
+    sinks : list
+        Callables receiving every processed chunk, e.g. ResultSink, LogSink.
+    queue_size : int
+        Chunks buffered between threads.
+    overflow : str
+        'block' or 'drop', what happens when the input queue is full.
+    """
+
+    def __init__(self, source, stages=(), sinks=(), queue_size=8, overflow='block'):
+        if overflow not in ('block', 'drop'):
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        self.source = source
+        self.stages = list(stages)
+        self.sinks = list(sinks)
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.stats = StreamStats()
+        self.stopped = threading.Event()
+        self.error = None
+
+    def _read(self, output):
+        expected = None
+        try:
+            for chunk in self.source:
+                if self.stopped.is_set():
+                    break
+                if expected is not None and chunk.seq != expected:
+                    chunk.gap = chunk.seq - expected
+                    with self.stats.lock:
+                        self.stats.dropped_acquisition += chunk.gap
+                expected = chunk.seq + 1
+                if self.overflow == 'block':
+                    output.put(chunk)
+                    continue
+                try:
+                    output.put_nowait(chunk)
+                except queue.Full:
+                    # Only this thread puts, so there is room after taking the oldest chunk
+                    try:
+                        output.get_nowait()
+                        with self.stats.lock:
+                            self.stats.dropped_queue += 1
+                    except queue.Empty:
+                        pass
+                    output.put_nowait(chunk)
+        except OSError as e:
+            # The source is closed by stop
+            if not self.stopped.is_set():
+                self._fail(e)
+        finally:
+            output.put(None)
+
+    def _run_stage(self, stage, input, output):
+        while True:
+            chunk = input.get()
+            if chunk is None:
+                output.put(None)
+                return
+            if self.error is not None:
+                continue
+            try:
+                start = time.perf_counter()
+                chunk = stage.process(chunk)
+                with self.stats.lock:
+                    self.stats.stage_times[stage.name].append(time.perf_counter() - start)
+            except Exception as e:
+                self._fail(e)
+                continue
+            output.put(chunk)
+
+    def _sink(self, input):
+        while True:
+            chunk = input.get()
+            if chunk is None:
+                return
+            if self.error is not None:
+                continue
+            try:
+                for sink in self.sinks:
+                    sink(chunk)
+            except Exception as e:
+                self._fail(e)
+                continue
+            with self.stats.lock:
+                self.stats.latencies.append(time.time() - chunk.acquired)
+                self.stats.chunks += 1
+                self.stats.samples += len(chunk)
+
+    def _fail(self, error):
+        logging.exception("Streaming pipeline failed")
+        if self.error is None:
+            self.error = error
+        self.stop()
+
+    def stop(self):
+        """
+        Stop reading the source, the queued chunks are still processed.
+        """
+        self.stopped.set()
+        if hasattr(self.source, 'close'):
+            self.source.close()
+
+    def run(self, duration=None):
+        """
+        Process chunks until the source ends, duration seconds have passed or the process is interrupted (Ctrl+C).
+
+        Returns
+        -------
+        stats : StreamStats
+            Latency and dropped chunk statistics.
+        """
+        for stage in self.stages:
+            stage.setup(self.source.fs, self.source.n_channels)
+        queues = [queue.Queue(self.queue_size) for _ in range(len(self.stages) + 1)]
+        threads = [threading.Thread(target=self._read, args=(queues[0],), daemon=True)]
+        threads += [threading.Thread(target=self._run_stage, args=(stage, queues[i], queues[i + 1]), daemon=True)
+                    for i, stage in enumerate(self.stages)]
+        threads.append(threading.Thread(target=self._sink, args=(queues[-1],), daemon=True))
+        for thread in threads:
+            thread.start()
+
+        deadline = None if duration is None else time.monotonic() + duration
+        try:
+            # Join with a timeout so that Ctrl+C interrupts the main thread
+            while threads[-1].is_alive():
+                threads[-1].join(0.1)
+                if deadline is not None and time.monotonic() > deadline and not self.stopped.is_set():
+                    self.stop()
+        except KeyboardInterrupt:
+            self.stop()
+            threads[-1].join()
+        finally:
+            self.stop()
+        if self.error is not None:
+            raise self.error
+        return self.stats
@@ -0,0 +1,222 @@
+import os
+import logging
+import numpy as np
+from .travelling_waves import CHANNEL_MAP
+from .spike_detection import SpikeTrains
+
+def generate_states(duration, up_mean=0.5, down_mean=1.0, min_duration=0.1, rng=None):
+    """
+    Draw alternating down/up state intervals with gamma distributed durations.
+
+    Parameters
+    ----------
+    duration : float
+        Duration of the recording in seconds.
+    up_mean : float
+        Mean upstate duration in seconds.
+    down_mean : float
+        Mean downstate duration in seconds.
+    min_duration : float
+        Minimal duration of a state in seconds.
+    rng : np.random.Generator
+        Random generator.
+
+    Returns
+    -------
+    upstates : np.array
+        Start and end times of the upstates, shape (n_upstates, 2).
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    # Draw enough states at once, each up/down pair lasts up_mean + down_mean on average
+    n = int(2 * duration / (up_mean + down_mean)) + 10
+    downs = np.maximum(rng.gamma(4, down_mean / 4, n), min_duration)
+    ups = np.maximum(rng.gamma(4, up_mean / 4, n), min_duration)
+    starts = np.cumsum(downs + np.concatenate([[0], ups[:-1]]))
+    upstates = np.stack([starts, starts + ups], axis=1)
+    return upstates[upstates[:, 1] < duration]
+
+def state_envelope(times, upstates, ramp=0.01):
+    """
+    Smooth upstate indicator (0 in downstates, 1 in upstates) with sigmoid ramps of width ramp seconds.
+    """
+    if len(upstates) == 0:
+        return np.zeros(len(times))
+    # Nearest upstate starting before each sample
+    k = np.clip(np.searchsorted(upstates[:, 0], times) - 1, 0, len(upstates) - 1)
+    start, end = upstates[k, 0], upstates[k, 1]
+    return 1 / (1 + np.exp(-(times - start) / ramp)) / (1 + np.exp(-(end - times) / ramp))
+
+class _ColoredNoise:
+    """
+    Low-pass (AR(1)) filtered white noise, continuous over consecutive chunks.
+    """
+
+    def __init__(self, n_channels, pole, rng):
+        self.b, self.a = [1 - pole], [1, -pole]
+        self.zi = np.zeros((n_channels, 1))
+        self.n_channels = n_channels
+        self.rng = rng
+
+    def __call__(self, n_samples):
+        from scipy import signal
+
+        noise, self.zi = signal.lfilter(self.b, self.a, self.rng.normal(0, 1, (self.n_channels, n_samples)), axis=1, zi=self.zi)
+        return noise
+
+def _grid_positions(channel_map, n_channels):
+    """
+    Row and column of every channel on the grid, and a mask of the channels on the grid (the others get position 0, 0).
+    """
+    positions = np.zeros((n_channels, 2))
+    on_grid = np.zeros(n_channels, dtype=bool)
+    for (r, c), ch in np.ndenumerate(channel_map):
+        if 1 <= ch <= n_channels:
+            positions[ch - 1] = r, c
+            on_grid[ch - 1] = True
+    return positions, on_grid
+
+def generate_recording(output_dir, duration=600., fs=1000., spike_fs=20000., n_ecog=64, n_probe=16,
+                       up_mean=0.5, down_mean=1.0, slow_amplitude=1e-4, noise_amplitude=5e-5,
+                       line_noise=(3e-5, 1e-5), wave_frequency=10., wave_amplitude=3e-5, wave_number=0.5,
+                       spikes=True, spike_rates=(1., 20.), spike_amplitude=1e-4, chunk_duration=60.,
+                       dtype=np.float64, seed=None):
+    """
+    Generate a synthetic ECoG/probe recording in the layout of data/processed/<experiment_code>.
+
+    The recording contains slow oscillations with known up/down states, 60/120 Hz line noise, alpha travelling waves
+    planted on the ECoG grid during upstates (random direction per upstate), and spikes on the probe contacts at
+    spike_fs with higher rates in upstates. It is written chunk by chunk into memory-mapped .npy files:
+
+    - Probe1_lfps_spont.npy: ECoG, n_ecog x time at fs (placed on CHANNEL_MAP, no wave off the grid)
+    - Probe2_lfps_spont.npy, Probe3_lfps_spont.npy: probes, n_probe x time at fs
+    - times.npy: time stamps at fs
+    - Probe2_spikes_raw.npy, Probe3_spikes_raw.npy: probes, n_probe x time at spike_fs (if spikes)
+    - ground truth: upstates_true.npy, wave_directions_true.npy and Probe2_spikes_true / Probe3_spikes_true
+      (SpikeTrains directories)
+
+    Parameters
+    ----------
+    output_dir : str
+        Output directory.
+    duration : float
+        Duration in seconds.
+    fs : float
+        Sampling rate of the LFP/ECoG data in Hz.
+    spike_fs : float
+        Sampling rate of the raw probe data with spikes in Hz.
+    n_ecog, n_probe : int
+        Number of ECoG channels and contacts per probe.
+    up_mean, down_mean : float
+        Mean up and down state durations in seconds.
+    slow_amplitude, noise_amplitude : float
+        Amplitude of the slow oscillation and of the background noise (V).
+    line_noise : tuple
+        Amplitudes of the 60 Hz and 120 Hz line noise.
+    wave_frequency, wave_amplitude, wave_number : float
+        Frequency (Hz), amplitude and spatial frequency (radians per electrode spacing) of the travelling waves.
+    spikes : bool
+        Whether to generate the raw probe data with spikes.
+    spike_rates : tuple
+        Firing rate per contact in down and up states (Hz).
+    spike_amplitude : float
+        Amplitude of the spike waveform.
+    chunk_duration : float
+        Duration of one generated chunk in seconds.
+    dtype : np.dtype
+        Data type of the written arrays.
+    seed : int
+        Seed of the random generator.
+
+    Returns
+    -------
+    upstates : np.array
+        True upstate intervals.
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(output_dir, exist_ok=True)
+    n_samples = int(duration * fs)
+    chunk = int(chunk_duration * fs)
+
+    # Ground truth of states and wave directions
+    upstates = generate_states(duration, up_mean, down_mean, rng=rng)
+    directions = rng.uniform(-np.pi, np.pi, len(upstates))
+    np.save(os.path.join(output_dir, 'upstates_true.npy'), upstates)
+    np.save(os.path.join(output_dir, 'wave_directions_true.npy'), directions)
+
+    def open_output(name, shape):
+        return np.lib.format.open_memmap(os.path.join(output_dir, name), mode='w+', dtype=dtype, shape=shape)
+
+    times = open_output('times.npy', (n_samples,))
+    ecog = open_output('Probe1_lfps_spont.npy', (n_ecog, n_samples))
+    probes = [open_output(f'Probe{i}_lfps_spont.npy', (n_probe, n_samples)) for i in (2, 3)]
+    positions, on_grid = _grid_positions(CHANNEL_MAP, n_ecog)
+    # The slow oscillation reverses its polarity with depth along the probes
+    depth_gain = np.linspace(1, -0.5, n_probe)[:, np.newaxis]
+
+    ecog_noise = _ColoredNoise(n_ecog, 0.95, rng)
+    probe_noise = [_ColoredNoise(n_probe, 0.95, rng) for _ in probes]
+
+    for start in range(0, n_samples, chunk):
+        stop = min(start + chunk, n_samples)
+        t = np.arange(start, stop) / fs
+        envelope = state_envelope(t, upstates)
+        slow = slow_amplitude * envelope
+        hum = line_noise[0] * np.sin(2 * np.pi * 60 * t) + line_noise[1] * np.sin(2 * np.pi * 120 * t)
+
+        # Travelling wave of the current upstate, phase shifted along its direction on the grid
+        k = np.clip(np.searchsorted(upstates[:, 0], t) - 1, 0, max(len(upstates) - 1, 0))
+        direction = directions[k] if len(upstates) else np.zeros(len(t))
+        shift = wave_number * (positions[:, 1:2] * np.cos(direction) + positions[:, 0:1] * np.sin(direction))
+        # Channels which are not on the grid carry no wave
+        wave = wave_amplitude * on_grid[:, np.newaxis] * envelope * np.cos(2 * np.pi * wave_frequency * t - shift)
+
+        times[start:stop] = t
+        ecog[:, start:stop] = slow + wave + hum + noise_amplitude * ecog_noise(stop - start)
+        for probe, noise in zip(probes, probe_noise):
+            probe[:, start:stop] = depth_gain * slow + hum + noise_amplitude * noise(stop - start)
+        logging.info(f"Generated {stop / fs:.0f} s of {duration:.0f} s")
+
+    for array in [times, ecog] + probes:
+        array.flush()
+
+    if spikes:
+        for i in (2, 3):
+            _generate_spikes(os.path.join(output_dir, f'Probe{i}_spikes_raw.npy'), os.path.join(output_dir, f'Probe{i}_spikes_true'),
+                             upstates, duration, spike_fs, n_probe, spike_rates, spike_amplitude, noise_amplitude,
+                             chunk_duration, dtype, rng)
+    return upstates
+
+def _generate_spikes(raw_path, true_path, upstates, duration, fs, n_channels, rates, amplitude, noise_amplitude,
+                     chunk_duration, dtype, rng):
+    """
+    Write raw probe data with spikes at fs (chunked) and the true spike indices.
+    """
+    n_samples = int(duration * fs)
+    chunk = int(chunk_duration * fs)
+
+    # Biphasic spike waveform, 1.5 ms long
+    w = np.arange(int(0.0015 * fs)) / fs
+    template = -amplitude * np.exp(-((w - 0.0004) / 0.00015) ** 2) + 0.3 * amplitude * np.exp(-((w - 0.0008) / 0.0003) ** 2)
+
+    # Poisson spikes with state dependent rate: thinning of a process at the upstate rate
+    spikes = []
+    for _ in range(n_channels):
+        n = rng.poisson(rates[1] * duration)
+        candidate = np.sort(rng.uniform(0, duration, n))
+        keep = rng.uniform(0, rates[1], n) < np.where(state_envelope(candidate, upstates) > 0.5, rates[1], rates[0])
+        spikes.append(np.unique((candidate[keep] * fs).astype(np.int64)))
+    spikes = [st[st < n_samples - len(template)] for st in spikes]
+    SpikeTrains.from_list(spikes, fs=fs, t_stop=duration).save(true_path)
+
+    raw = np.lib.format.open_memmap(raw_path, mode='w+', dtype=dtype, shape=(n_channels, n_samples))
+    for start in range(0, n_samples, chunk):
+        stop = min(start + chunk, n_samples)
+        x = noise_amplitude * 0.2 * rng.normal(0, 1, (n_channels, stop - start))
+        for ch, st in enumerate(spikes):
+            # Add the template of every spike overlapping the chunk
+            st = st[(st > start - len(template)) & (st < stop)] - start
+            idx = st[:, np.newaxis] + np.arange(len(template))
+            valid = (idx >= 0) & (idx < stop - start)
+            np.add.at(x[ch], idx[valid], np.broadcast_to(template, idx.shape)[valid])
+        raw[:, start:stop] = x
+    raw.flush()
@@ -0,0 +1,518 @@
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import lru_cache
+
+# Layout of the ECoG channels (1-based) on the electrode grid, 65 marks an empty position (channels 48 and 64 are not
+# on the grid)
+CHANNEL_MAP = np.array([[49, 50, 51, 52, 59, 58, 57, 56, 55, 54, 53],
+                        [60, 61, 62, 63, 32, 43, 44, 45, 46, 47, 65],
+                        [42, 41, 40, 39, 38, 33, 34, 35, 36, 37, 65],
+                        [26, 25, 24, 23, 22, 17, 18, 19, 20, 21, 65],
+                        [12, 13, 14, 15, 16, 27, 28, 29, 30, 31, 65],
+                        [1, 2, 3, 4, 11, 10, 9, 8, 7, 6, 5]])
+
+def _check_channel_map(channel_map, n_channels=64):
+    """
+    Raise a ValueError if a channel appears more than once on the grid.
+    """
+    channels, counts = np.unique(np.asarray(channel_map), return_counts=True)
+    duplicates = channels[(counts > 1) & (channels >= 1) & (channels <= n_channels)]
+    if len(duplicates):
+        raise ValueError(f"Channels {duplicates.tolist()} appear more than once in the channel map")
+
+_check_channel_map(CHANNEL_MAP)
+
+def grid_index(channel_map=CHANNEL_MAP, n_channels=64, bad_channels=None):
+    """
+    Compute the gather index mapping data channels onto the electrode grid.
+
+    Parameters
+    ----------
+    channel_map : np.array
+        Grid of 1-based channel numbers, values outside 1..n_channels are empty positions.
+    n_channels : int
+        Number of recorded channels.
+    bad_channels : list
+        Optional 0-based channels to mask as well.
+
+    Returns
+    -------
+    index : np.array
+        0-based channel index for each grid position (0 at masked positions).
+    mask : np.array
+        Boolean grid, True where an electrode is present.
+    """
+    channel_map = np.asarray(channel_map)
+    _check_channel_map(channel_map, n_channels)
+    mask = (channel_map >= 1) & (channel_map <= n_channels)
+    if bad_channels is not None:
+        mask &= ~np.isin(channel_map - 1, bad_channels)
+    index = np.where(mask, channel_map - 1, 0)
+    return index, mask
+
+@lru_cache(maxsize=32)
+def _interpolation_matrix(map_bytes, map_shape, n_channels, bad_channels, power, radius):
+    """
+    Build the interpolation matrix for a layout given in hashable form (cached per layout and bad-channel set).
+    """
+    from scipy import sparse
+
+    channel_map = np.frombuffer(map_bytes, dtype=np.int64).reshape(map_shape)
+    index, mask = grid_index(channel_map, n_channels, list(bad_channels))
+    rows, cols = np.indices(map_shape)
+    positions = np.stack([rows.ravel(), cols.ravel()], axis=1).astype(np.float64)
+    good = np.flatnonzero(mask.ravel())
+    missing = np.flatnonzero(~mask.ravel())
+
+    # Good electrodes copy their own channel
+    row_ids = [good]
+    col_ids = [index.ravel()[good]]
+    weights = [np.ones(len(good))]
+
+    if len(missing):
+        # Inverse distance weights of good electrodes within the radius (nearest electrode if none is close enough)
+        distances = np.linalg.norm(positions[missing][:, np.newaxis, :] - positions[good][np.newaxis, :, :], axis=2)
+        near = distances <= radius
+        near[np.arange(len(missing)), np.argmin(distances, axis=1)] = True
+        w = np.where(near, 1 / distances ** power, 0)
+        w /= w.sum(axis=1, keepdims=True)
+        target, source = np.nonzero(w)
+        row_ids.append(missing[target])
+        col_ids.append(index.ravel()[good][source])
+        weights.append(w[target, source])
+
+    matrix = sparse.csr_matrix((np.concatenate(weights), (np.concatenate(row_ids), np.concatenate(col_ids))),
+                               shape=(len(positions), n_channels))
+    return matrix
+
+def interpolation_matrix(channel_map=CHANNEL_MAP, n_channels=64, bad_channels=None, power=2, radius=1.5):
+    """
+    Sparse matrix filling bad channels and empty grid positions by inverse-distance interpolation.
+
+    Multiplying channels x time data by the matrix gives the data of every grid position (rows * columns x time,
+    row-major order): good electrodes are copied, bad and empty positions are weighted averages of the good electrodes
+    within radius (in electrode spacings). Matrices are cached per layout and bad-channel set.
+
+    Parameters
+    ----------
+    channel_map : np.array
+        Grid of 1-based channel numbers.
+    n_channels : int
+        Number of recorded channels.
+    bad_channels : list
+        0-based channels to interpolate.
+    power : float
+        Power of the inverse-distance weights.
+    radius : float
+        Distance within which good electrodes contribute.
+
+    Returns
+    -------
+    matrix : scipy.sparse.csr_matrix
+        Interpolation matrix of shape (rows * columns, n_channels).
+    """
+    channel_map = np.ascontiguousarray(channel_map, dtype=np.int64)
+    bad_channels = tuple(sorted(set(int(ch) for ch in bad_channels))) if bad_channels is not None else ()
+    return _interpolation_matrix(channel_map.tobytes(), channel_map.shape, n_channels, bad_channels, power, radius)
+
+def interpolate_channels(data, channel_map=CHANNEL_MAP, bad_channels=None, power=2, radius=1.5, chunk_size=100000, out=None):
+    """
+    Fill bad channels and empty grid positions of a whole recording, one sparse matrix product per chunk.
+
+    Parameters
+    ----------
+    data : np.array
+        Time series, channels x time (in memory or np.memmap).
+    channel_map, bad_channels, power, radius :
+        See interpolation_matrix.
+    chunk_size : int
+        Number of samples processed at once.
+    out : np.array
+        Optional output array (e.g. np.memmap) of shape (rows * columns, time).
+
+    Returns
+    -------
+    out : np.array
+        Data of every grid position, (rows * columns) x time in row-major grid order (float32 unless out is given);
+        reshape to (rows, columns, time) to get the grid. The result can be passed to detect_travelling_waves with
+        channel_map=np.arange(1, rows * columns + 1).reshape(rows, columns).
+    """
+    matrix = interpolation_matrix(channel_map, data.shape[0], bad_channels, power, radius)
+    if out is None:
+        out = np.empty((matrix.shape[0], data.shape[1]), dtype=np.float32)
+
+    for start in range(0, data.shape[1], chunk_size):
+        stop = min(start + chunk_size, data.shape[1])
+        out[:, start:stop] = matrix @ np.asarray(data[:, start:stop], dtype=np.float64)
+    return out
+
+def laplacian_matrix(channel_map=CHANNEL_MAP, n_channels=64):
+    """
+    Sparse matrix of the grid-local (Laplacian) reference: each channel minus the mean of its grid neighbours.
+
+    Parameters
+    ----------
+    channel_map : np.array
+        Grid of 1-based channel numbers.
+    n_channels : int
+        Number of recorded channels.
+
+    Returns
+    -------
+    matrix : scipy.sparse.csr_matrix
+        Matrix of shape (n_channels, n_channels); channels without grid neighbours are left unreferenced.
+    """
+    from scipy import sparse
+
+    index, mask = grid_index(channel_map, n_channels)
+    rows, cols = mask.shape
+    neighbours = [set() for _ in range(n_channels)]
+    # Collect the 4-neighbourhood of every electrode on the grid
+    for r, c in zip(*np.nonzero(mask)):
+        for dr, dc in ((-1, 0), (1, 0), (0, -1), (0, 1)):
+            if 0 <= r + dr < rows and 0 <= c + dc < cols and mask[r + dr, c + dc] and index[r + dr, c + dc] != index[r, c]:
+                neighbours[index[r, c]].add(index[r + dr, c + dc])
+
+    matrix = sparse.lil_matrix((n_channels, n_channels))
+    for ch, nb in enumerate(neighbours):
+        matrix[ch, ch] = 1
+        for other in nb:
+            matrix[ch, other] = -1 / len(nb)
+    return matrix.tocsr()
+
+class GridView:
+    """
+    Lazy view of channels x time data on the electrode grid.
+
+    Nothing is copied on construction; indexing with a time frame (int), a slice or an array of frames
+    materialises only those frames as float32 grids (rows x columns [x frames]). Empty positions of the channel map
+    and bad channels are masked (np.ma.MaskedArray), so they are left blank by imshow.
+
+    Parameters
+    ----------
+    data : np.array
+        Time series, channels x time (in memory or np.memmap).
+    channel_map : np.array
+        Grid of 1-based channel numbers.
+    bad_channels : list
+        Optional 0-based channels to mask.
+    """
+
+    def __init__(self, data, channel_map=CHANNEL_MAP, bad_channels=None):
+        self.data = data
+        self.index, self.mask = grid_index(channel_map, data.shape[0], bad_channels)
+
+    @property
+    def shape(self):
+        return self.index.shape + (self.data.shape[1],)
+
+    def __len__(self):
+        return self.data.shape[1]
+
+    def __getitem__(self, frames):
+        # Read only the requested frames of all channels, then gather them onto the grid
+        values = np.asarray(self.data[:, frames], dtype=np.float32)[self.index]
+        mask = ~self.mask if values.ndim == 2 else np.broadcast_to(~self.mask[:, :, np.newaxis], values.shape)
+        return np.ma.masked_array(values, mask=mask)
+
+def compute_phase(data, fs=1000., f_range=(7, 13), order=3):
+    """
+    Compute instantaneous phase of each channel in a frequency band (band-pass filter and Hilbert transform).
+
+    Parameters
+    ----------
+    data : np.array
+        Time series, channels x time.
+    fs : float
+        Sampling rate of the data in Hz.
+    f_range : tuple
+        Band-pass frequency range in Hz (alpha band by default).
+    order : int
+        Order of the Butterworth band-pass filter.
+
+    Returns
+    -------
+    analytic : np.array
+        Complex analytic signal, channels x time; np.angle gives the phase.
+    """
+    from scipy import signal
+
+    sos = signal.butter(order, f_range, btype='bandpass', fs=fs, output='sos')
+    filtered = signal.sosfiltfilt(sos, np.nan_to_num(np.asarray(data, dtype=np.float64)), axis=-1)
+    return signal.hilbert(filtered, axis=-1)
+
+def _circular_diff(z, axis):
+    """
+    Phase difference between neighbours along axis of a complex (unit) array, wrapped to (-pi, pi].
+    """
+    a = np.take(z, np.arange(1, z.shape[axis]), axis=axis)
+    b = np.take(z, np.arange(z.shape[axis] - 1), axis=axis)
+    return np.angle(a * np.conj(b))
+
+def phase_gradient(phase_grid, mask):
+    """
+    Estimate spatial phase gradients on the electrode grid.
+
+    The gradient at each electrode is the mean of the wrapped forward and backward phase differences to its
+    neighbours, masked electrodes do not contribute and get NaN.
+
+    Parameters
+    ----------
+    phase_grid : np.array
+        Phase (in radians), rows x columns x time.
+    mask : np.array
+        Boolean grid, True where an electrode is present.
+
+    Returns
+    -------
+    grad_x : np.array
+        Phase gradient along grid columns (radians per electrode spacing), rows x columns x time.
+    grad_y : np.array
+        Phase gradient along grid rows, rows x columns x time.
+    """
+    z = np.exp(1j * phase_grid)
+    gradients = []
+    for axis in (1, 0):
+        # Differences between neighbours, NaN where one of them is missing
+        diff = _circular_diff(z, axis)
+        both = np.take(mask, np.arange(1, mask.shape[axis]), axis=axis) & np.take(mask, np.arange(mask.shape[axis] - 1), axis=axis)
+        diff[~both] = np.nan
+
+        # Forward and backward differences of each electrode, averaged where available
+        pad = [(0, 0)] * 3
+        pad[axis] = (0, 1)
+        forward = np.pad(diff, pad, constant_values=np.nan)
+        pad[axis] = (1, 0)
+        backward = np.pad(diff, pad, constant_values=np.nan)
+        count = (~np.isnan(forward)).astype(np.int8) + (~np.isnan(backward))
+        with np.errstate(invalid='ignore'):
+            gradient = (np.nan_to_num(forward) + np.nan_to_num(backward)) / count
+        gradient[~mask] = np.nan
+        gradients.append(gradient)
+    return gradients[0], gradients[1]
+
+def wave_metrics(analytic_grid, mask, fs=1000., spacing=1.):
+    """
+    Derive per-sample travelling-wave metrics from the analytic signal on the electrode grid.
+
+    Parameters
+    ----------
+    analytic_grid : np.array
+        Complex analytic signal, rows x columns x time.
+    mask : np.array
+        Boolean grid, True where an electrode is present.
+    fs : float
+        Sampling rate in Hz.
+    spacing : float
+        Distance between neighbouring electrodes, the unit of the speed is spacing per second.
+
+    Returns
+    -------
+    metrics : dict
+        'direction' (radians, direction of wave propagation in grid coordinates, x along columns and y along rows
+        downwards), 'speed' and 'pgd' (phase gradient directionality,
+        length of the mean gradient divided by the mean gradient length, 1 for a perfect plane wave), one value per sample.
+    """
+    grad_x, grad_y = phase_gradient(np.angle(analytic_grid), mask)
+
+    # Mean gradient vector and mean gradient length over the grid
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_x = np.nanmean(grad_x, axis=(0, 1))
+        mean_y = np.nanmean(grad_y, axis=(0, 1))
+        mean_norm = np.nanmean(np.hypot(grad_x, grad_y), axis=(0, 1))
+        norm = np.hypot(mean_x, mean_y)
+        pgd = norm / mean_norm
+
+        # Instantaneous frequency (rad/s) averaged over the electrodes
+        z = analytic_grid[mask]
+        inst_freq = np.angle(z[:, 1:] * np.conj(z[:, :-1])) * fs
+        inst_freq = np.abs(np.mean(np.concatenate([inst_freq, inst_freq[:, -1:]], axis=1), axis=0))
+
+        # Waves travel down the phase gradient
+        direction = np.arctan2(-mean_y, -mean_x)
+        speed = inst_freq / norm * spacing
+
+    return {'direction': direction, 'speed': speed, 'pgd': pgd}
+
+def detect_travelling_waves(data, fs=1000., f_range=(7, 13), channel_map=CHANNEL_MAP, bad_channels=None, spacing=1.,
+                            chunk_duration=10., overlap=1., n_jobs=4):
+    """
+    Compute travelling-wave metrics for a whole ECoG recording.
+
+    The recording is processed in chunks (works with np.memmap arrays), each extended by an overlap on both sides to
+    avoid filter edge effects, and the chunks are processed in a thread pool.
+
+    Parameters
+    ----------
+    data : np.array
+        ECoG time series, channels x time.
+    fs : float
+        Sampling rate of the data in Hz.
+    f_range : tuple
+        Frequency band of the waves in Hz.
+    channel_map : np.array
+        Grid of 1-based channel numbers.
+    bad_channels : list
+        Optional 0-based channels excluded from the grid.
+    spacing : float
+        Distance between neighbouring electrodes.
+    chunk_duration : float
+        Duration of one chunk in seconds.
+    overlap : float
+        Duration in seconds by which each chunk is extended on both sides.
+    n_jobs : int
+        Number of threads.
+
+    Returns
+    -------
+    metrics : dict
+        'direction', 'speed' and 'pgd', np.array with one value per sample (see wave_metrics).
+    """
+    n_channels, n_samples = data.shape
+    index, mask = grid_index(channel_map, n_channels, bad_channels)
+    chunk = max(int(chunk_duration * fs), 1)
+    pad = int(overlap * fs)
+
+    def process(start):
+        stop = min(start + chunk, n_samples)
+        ext_start, ext_stop = max(start - pad, 0), min(stop + pad, n_samples)
+        # Analytic signal of the extended chunk, mapped onto the grid and cut back to the chunk
+        analytic = compute_phase(data[:, ext_start:ext_stop], fs, f_range)
+        analytic_grid = analytic[index][:, :, start - ext_start:stop - ext_start]
+        return wave_metrics(analytic_grid, mask, fs, spacing)
+
+    with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+        results = list(pool.map(process, range(0, n_samples, chunk)))
+
+    return {key: np.concatenate([r[key] for r in results]) for key in ('direction', 'speed', 'pgd')}
+
+# Fields of the wave event catalogue
+WAVE_EVENT_DTYPE = np.dtype([('upstate', np.int64), ('onset', np.float64), ('duration', np.float64),
+                             ('direction', np.float64), ('speed', np.float64), ('coherence', np.float64)])
+
+def segment_waves(metrics, times, pgd_threshold=0.5, min_duration=0.02, upstate=-1):
+    """
+    Segment discrete travelling-wave events from the phase gradient directionality time series.
+
+    An event is a run of samples with PGD above the threshold lasting at least min_duration.
+
+    Parameters
+    ----------
+    metrics : dict
+        'direction', 'speed' and 'pgd' per sample (see wave_metrics).
+    times : np.array
+        Time stamps of the samples.
+    pgd_threshold : float
+        Minimal PGD of samples belonging to a wave.
+    min_duration : float
+        Minimal duration of a wave in seconds.
+    upstate : int
+        Index of the upstate the samples belong to, stored with the events.
+
+    Returns
+    -------
+    events : np.array
+        Structured array with WAVE_EVENT_DTYPE: onset, duration, circular mean direction, median speed and
+        spatial coherence (mean PGD) of each event.
+    """
+    pgd = np.nan_to_num(metrics['pgd'])
+    # Starts and ends of the runs above threshold
+    above = np.concatenate([[False], pgd > pgd_threshold, [False]])
+    edges = np.flatnonzero(np.diff(above.astype(np.int8)))
+    starts, stops = edges[::2], edges[1::2]
+
+    # Keep runs which are long enough, a run lasts until the sample after its last one
+    step = times[-1] - times[-2] if len(times) > 1 else 0.
+    ends = np.append(times, times[-1] + step) if len(times) else times
+    durations = ends[stops] - ends[starts]
+    long_enough = durations >= min_duration
+    starts, stops, durations = starts[long_enough], stops[long_enough], durations[long_enough]
+
+    events = np.zeros(len(starts), dtype=WAVE_EVENT_DTYPE)
+    events['upstate'] = upstate
+    events['onset'] = times[starts]
+    events['duration'] = durations
+    if len(starts) == 0:
+        return events
+
+    # Per-event summaries with reduceat over the concatenated runs
+    lengths = stops - starts
+    bounds = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    offsets = np.arange(lengths.sum()) - np.repeat(bounds, lengths)
+    run_idx = np.repeat(starts, lengths) + offsets
+    unit = np.exp(1j * metrics['direction'][run_idx])
+    events['direction'] = np.angle(np.add.reduceat(unit, bounds))
+    events['coherence'] = np.add.reduceat(pgd[run_idx], bounds) / lengths
+    # Median speed over the runs padded with NaN to the longest one
+    speed = np.full((len(starts), lengths.max()), np.nan)
+    speed[np.repeat(np.arange(len(starts)), lengths), offsets] = metrics['speed'][run_idx]
+    events['speed'] = np.nanmedian(speed, axis=1)
+    return events
+
+# Recording shared by the worker processes of build_wave_catalogue
+_worker_data = {}
+
+def _init_catalogue_worker(data_path, times_path):
+    """
+    Open the recording memory-mapped once per worker process.
+    """
+    _worker_data['data'] = np.load(data_path, mmap_mode='r', allow_pickle=False)
+    _worker_data['times'] = np.load(times_path, mmap_mode='r', allow_pickle=False)
+
+def _catalogue_upstate(args):
+    """
+    Compute wave metrics for one upstate and segment them into events (runs in a worker process).
+    """
+    i, (t_start, t_stop), params = args
+    data, times = _worker_data['data'], _worker_data['times']
+    fs = params['fs']
+    pad = int(params['overlap'] * fs)
+
+    # Upstate extended by the overlap to avoid filter edge effects
+    start, stop = np.searchsorted(times, (t_start, t_stop))
+    if stop - start < 2:
+        return np.zeros(0, dtype=WAVE_EVENT_DTYPE)
+    ext_start, ext_stop = max(start - pad, 0), min(stop + pad, len(times))
+
+    index, mask = grid_index(params['channel_map'], data.shape[0], params['bad_channels'])
+    analytic = compute_phase(data[:, ext_start:ext_stop], fs, params['f_range'])
+    analytic_grid = analytic[index][:, :, start - ext_start:stop - ext_start]
+    metrics = wave_metrics(analytic_grid, mask, fs, params['spacing'])
+    return segment_waves(metrics, np.asarray(times[start:stop]), params['pgd_threshold'], params['min_duration'], upstate=i)
+
+def build_wave_catalogue(data_path, times_path, upstates, fs=1000., f_range=(7, 13), channel_map=CHANNEL_MAP,
+                         bad_channels=None, spacing=1., pgd_threshold=0.5, min_duration=0.02, overlap=1., n_jobs=4):
+    """
+    Build a catalogue of travelling-wave events within upstates, processing the upstates in a process pool.
+
+    Parameters
+    ----------
+    data_path : str
+        Path to the ECoG .npy file (channels x time), opened memory-mapped by every worker.
+    times_path : str
+        Path to the times .npy file.
+    upstates : np.array
+        Start and end times of the upstates (e.g. event_times.npy).
+    fs, f_range, channel_map, bad_channels, spacing :
+        See detect_travelling_waves.
+    pgd_threshold, min_duration :
+        See segment_waves.
+    overlap : float
+        Duration in seconds by which each upstate is extended on both sides for filtering.
+    n_jobs : int
+        Number of worker processes.
+
+    Returns
+    -------
+    events : np.array
+        Structured array with WAVE_EVENT_DTYPE, events of all upstates ordered by onset.
+    """
+    params = {'fs': fs, 'f_range': f_range, 'channel_map': channel_map, 'bad_channels': bad_channels, 'spacing': spacing,
+              'pgd_threshold': pgd_threshold, 'min_duration': min_duration, 'overlap': overlap}
+    tasks = [(i, tuple(interval), params) for i, interval in enumerate(upstates)]
+
+    with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_catalogue_worker, initargs=(data_path, times_path)) as pool:
+        events = list(pool.map(_catalogue_upstate, tasks, chunksize=max(len(tasks) // (4 * n_jobs), 1)))
+
+    events = np.concatenate(events) if events else np.zeros(0, dtype=WAVE_EVENT_DTYPE)
+    return events[np.argsort(events['onset'], kind='stable')]
@@ -1,21 +1,16 @@
-import neo
-import quantities as pq
-from scipy import signal
-from neurodsp.filt import filter_signal
-from elephant.spike_train_generation import peak_detection
-import elephant.spike_train_synchrony as sync
 import numpy as np
 from tqdm import tqdm
 import logging
-from scipy.signal import correlate, correlation_lags
-from scipy.stats import pearsonr
 from collections import defaultdict
-from tqdm import tqdm
+from .profiling import profiled
 
+@profiled(items=lambda data, *args, **kwargs: np.size(data))
 def filter_line_noise(data, fs, Q):
     """
     Removes specific frequencies (60 Hz and 120 Hz) from a signal using a notch filter.
     """
+    from scipy import signal
+
     freqs = [60.0, 120.0]  # frequencies to be removed from signal
     
     # Loop through each frequency to remove
@@ -28,6 +23,112 @@ def filter_line_noise(data, fs, Q):
     
     return data
 
+def rereference(data, method='average', channel_map=None, chunk_size=100000, out=None):
+    """
+    Re-reference multichannel data chunk by chunk.
+
+    Parameters
+    ----------
+    data : np.array
+        Time series, channels x time (in memory or np.memmap).
+    method : str
+        'average' (common average), 'median' (common median) or 'laplacian' (each channel minus the mean of its
+        neighbours on the electrode grid).
+    channel_map : np.array
+        Grid of 1-based channel numbers for the Laplacian reference, the ECoG CHANNEL_MAP if None.
+    chunk_size : int
+        Number of samples processed at once.
+    out : np.array
+        Output array of the same shape (e.g. a float32 np.memmap, or data itself for in-place operation);
+        a float32 array is allocated if None.
+
+    Returns
+    -------
+    out : np.array
+        Re-referenced data.
+    """
+    if method not in ('average', 'median', 'laplacian'):
+        raise ValueError(f"Unknown reference method: {method}")
+    if out is None:
+        out = np.empty(data.shape, dtype=np.float32)
+    if method == 'laplacian':
+        from .travelling_waves import laplacian_matrix, CHANNEL_MAP
+        matrix = laplacian_matrix(CHANNEL_MAP if channel_map is None else channel_map, data.shape[0])
+
+    for start in range(0, data.shape[1], chunk_size):
+        stop = min(start + chunk_size, data.shape[1])
+        chunk = np.asarray(data[:, start:stop], dtype=np.float64)
+        if method == 'average':
+            out[:, start:stop] = chunk - chunk.mean(axis=0)
+        elif method == 'median':
+            out[:, start:stop] = chunk - np.median(chunk, axis=0)
+        else:
+            out[:, start:stop] = matrix @ chunk
+    return out
+
+def normalize(data, method='zscore', two_pass=False, chunk_size=100000, out=None):
+    """
+    Normalize multichannel data chunk by chunk.
+
+    Parameters
+    ----------
+    data : np.array
+        Time series, channels x time (in memory or np.memmap).
+    method : str
+        'zscore' (per channel) or 'minmax' (global, to 0-1).
+    two_pass : bool
+        For 'zscore', compute the standard deviation in a second pass around the mean (more accurate than the
+        one-pass sum of squares).
+    chunk_size : int
+        Number of samples processed at once.
+    out : np.array
+        Output array of the same shape (e.g. a float32 np.memmap, or data itself for in-place operation);
+        a float32 array is allocated if None.
+
+    Returns
+    -------
+    out : np.array
+        Normalized data.
+    """
+    if method not in ('zscore', 'minmax'):
+        raise ValueError(f"Unknown normalization method: {method}")
+    n_channels, n_samples = data.shape
+    chunks = [(start, min(start + chunk_size, n_samples)) for start in range(0, n_samples, chunk_size)]
+
+    # Statistics pass(es), NaNs (e.g. masked artifacts) are ignored by both methods and stay NaN in the output
+    if method == 'minmax':
+        low = min(np.nanmin(data[:, a:b]) for a, b in chunks)
+        high = max(np.nanmax(data[:, a:b]) for a, b in chunks)
+        offset, scale = low, np.full((n_channels, 1), high - low)
+    else:
+        total = np.zeros((n_channels, 1))
+        squares = np.zeros((n_channels, 1))
+        counts = np.zeros((n_channels, 1))
+        for a, b in chunks:
+            chunk = np.asarray(data[:, a:b], dtype=np.float64)
+            total += np.nansum(chunk, axis=1, keepdims=True)
+            counts += np.sum(~np.isnan(chunk), axis=1, keepdims=True)
+            if not two_pass:
+                squares += np.nansum(chunk ** 2, axis=1, keepdims=True)
+        counts = np.maximum(counts, 1)
+        offset = total / counts
+        if two_pass:
+            for a, b in chunks:
+                squares += np.nansum((np.asarray(data[:, a:b], dtype=np.float64) - offset) ** 2, axis=1, keepdims=True)
+            scale = np.sqrt(squares / counts)
+        else:
+            scale = np.sqrt(np.maximum(squares / counts - offset ** 2, 0))
+    # Constant channels (or data) are only shifted
+    scale = np.where(scale > 0, scale, 1.)
+
+    # Write pass
+    if out is None:
+        out = np.empty(data.shape, dtype=np.float32)
+    for a, b in chunks:
+        out[:, a:b] = (np.asarray(data[:, a:b], dtype=np.float64) - offset) / scale
+    return out
+
+@profiled(items=lambda data, *args, **kwargs: np.size(data))
 def define_upstate_regions(data, times, threshold_scalar=2):
     """
     Define upstate regions throughout all channels based on threshold.
@@ -79,6 +180,7 @@ def define_upstate_regions(data, times, threshold_scalar=2):
 
     return event_times, threshold_values[0]
 
+@profiled(items=lambda probe_data, *args, **kwargs: np.size(probe_data))
 def lagged_correlation(probe_data, ecog_data):
     """
     Computes lagged correlation between probe data and ecog data.
@@ -97,6 +199,8 @@ def lagged_correlation(probe_data, ecog_data):
     corr : float
         Maximum correlation.
     """
+    from scipy.signal import correlate, correlation_lags
+    from scipy.stats import pearsonr
 
     # Calculate Pearson correlation coefficient between probe data and ecog data average
     pcc = pearsonr(probe_data, ecog_data)
@@ -115,6 +219,7 @@ def lagged_correlation(probe_data, ecog_data):
 
     return pcc[0], lag, max_pcc
 
+@profiled(items=lambda data, times, intervals: len(intervals))
 def make_splits(data, times, intervals):
         splits = defaultdict(list)
         # Split data into upstate/downstate intervals
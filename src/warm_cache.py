@@ -0,0 +1,494 @@
+import os
+import time
+import logging
+import tempfile
+import threading
+import socketserver
+from collections import OrderedDict
+from multiprocessing import shared_memory
+import numpy as np
+
+from .ipc import attach_block, map_block, send_message, receive_message
+
+# Socket the daemon listens on (Unix socket paths are limited to ~100 characters, so not in the project folder)
+DEFAULT_SOCKET = os.environ.get('THESIS_CACHE_SOCKET', os.path.join(tempfile.gettempdir(), 'thesis_warm_cache.sock'))
+
+# Transforms applied to recordings, in the order given in a request
+TRANSFORMS = ('rereference', 'normalize', 'line_noise', 'lowpass', 'highpass', 'bandpass', 'bandstop')
+
+def _canonical(transforms):
+    """
+    Transforms as a hashable tuple, e.g. [('rereference', 'average'), ('bandpass', (7, 13))].
+    """
+    canonical = []
+    for name, *args in transforms:
+        if name not in TRANSFORMS:
+            raise ValueError(f"Unknown transform {name}, expected one of {TRANSFORMS}")
+        canonical.append((name,) + tuple(tuple(a) if isinstance(a, (list, tuple)) else a for a in args))
+    return tuple(canonical)
+
+class _Entry:
+    """
+    Cached arrays of one result, each in its own shared memory block.
+    """
+
+    def __init__(self, arrays):
+        self.blocks = {}
+        self.arrays = {}
+        for name, array in arrays.items():
+            array = np.asarray(array)
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            self.arrays[name] = map_block(block, array.shape, array.dtype)
+            self.arrays[name][...] = array
+            self.blocks[name] = block
+        self.nbytes = sum(a.nbytes for a in self.arrays.values())
+
+    def describe(self, name, view=None):
+        """
+        Description of an array (or of a view of it) a client can map without copying.
+        """
+        base = self.arrays[name]
+        view = base if view is None else view
+        offset = view.__array_interface__['data'][0] - base.__array_interface__['data'][0]
+        return {'block': self.blocks[name].name, 'shape': list(view.shape), 'dtype': view.dtype.str,
+                'strides': list(view.strides), 'offset': offset}
+
+    def release(self):
+        """
+        Unlink the blocks. Processes that mapped them (including requests being answered from this entry) keep their
+        mappings as long as they reference the arrays.
+        """
+        for block in self.blocks.values():
+            block.unlink()
+
+class WarmCache:
+    """
+    Recordings, transformed recordings, interval sets and analysis results kept in shared memory, least recently used
+    entries are dropped when the memory budget is exceeded.
+
+    Parameters
+    ----------
+    data_dir : str
+        Folder with one subfolder of processed .npy files per experiment (data/processed).
+    budget : int
+        Memory budget in bytes.
+    fs : float
+        Sampling rate of the recordings.
+    """
+
+    def __init__(self, data_dir, budget=8 * 2 ** 30, fs=1000):
+        self.data_dir = data_dir
+        self.budget = budget
+        self.fs = fs
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def get(self, key, compute):
+        """
+        Cached entry of key, computed with compute() (a dict of arrays) on a miss. Concurrent requests for the same key
+        wait for a single computation.
+        """
+        with self._lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return self.entries[key]
+                self.misses += 1
+            try:
+                start = time.perf_counter()
+                entry = _Entry(compute())
+                logging.info(f"Computed {key} ({entry.nbytes / 2 ** 20:.1f} MB) in {time.perf_counter() - start:.2f} s")
+                with self._lock:
+                    self.entries[key] = entry
+                    self.nbytes += entry.nbytes
+                    self._evict(keep=key)
+                return entry
+            finally:
+                # Also when compute fails (e.g. missing file), the next request tries again
+                with self._lock:
+                    self._key_locks.pop(key, None)
+
+    def _evict(self, keep=None):
+        # Drop least recently used entries until the budget is met (the newest entry is kept even if it is larger)
+        for key in list(self.entries):
+            if self.nbytes <= self.budget:
+                break
+            if key == keep:
+                continue
+            entry = self.entries.pop(key)
+            self.nbytes -= entry.nbytes
+            entry.release()
+            logging.info(f"Evicted {key}")
+
+    def clear(self, exp=None):
+        """
+        Drop all entries (of one experiment if exp is given).
+        """
+        with self._lock:
+            for key in [k for k in self.entries if exp is None or k[1] == exp]:
+                entry = self.entries.pop(key)
+                self.nbytes -= entry.nbytes
+                entry.release()
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self.entries), 'nbytes': self.nbytes, 'budget': self.budget, 'hits': self.hits,
+                    'misses': self.misses, 'keys': [list(map(str, k)) for k in self.entries]}
+
+    # Cached values
+
+    def recording(self, exp, name, transforms=()):
+        """
+        Recording (file name without .npy) with the transforms applied in order, every prefix of the transforms is
+        cached too so e.g. a new filter of a rereferenced recording does not rereference again.
+        """
+        transforms = _canonical(transforms)
+        if not transforms:
+            def load():
+                return {'data': np.load(os.path.join(self.data_dir, exp, f"{name}.npy"))}
+            return self.get(('recording', exp, name, ()), load)
+
+        def compute():
+            data = self.recording(exp, name, transforms[:-1]).arrays['data']
+            return {'data': self._transform(data, *transforms[-1])}
+        return self.get(('recording', exp, name, transforms), compute)
+
+    def _transform(self, data, name, *args):
+        from .utils import rereference, normalize, filter_line_noise
+
+        if name == 'rereference':
+            return rereference(data, *args)
+        if name == 'normalize':
+            return normalize(data, *args)
+        if name == 'line_noise':
+            return filter_line_noise(data, self.fs, *(args or (550,)))
+        from neurodsp.filt import filter_signal
+        channels = data if data.ndim > 1 else data[None]
+        filtered = np.array([filter_signal(channel, self.fs, name, args[0], remove_edges=False) for channel in channels])
+        return filtered if data.ndim > 1 else filtered[0]
+
+    def intervals(self, exp, state='upstate', events='event_times'):
+        """
+        Upstates (the event times) or downstates (the gaps between consecutive upstates) in seconds, intervals x 2.
+        """
+        def compute():
+            upstates = np.asarray(np.load(os.path.join(self.data_dir, exp, f"{events}.npy"), allow_pickle=True),
+                                  dtype=float).reshape(-1, 2)
+            if state == 'upstate':
+                return {'data': upstates}
+            if state == 'downstate':
+                return {'data': np.stack([upstates[:-1, 1], upstates[1:, 0]], axis=1)}
+            raise ValueError(f"Unknown state {state}, expected 'upstate' or 'downstate'")
+        return self.get(('intervals', exp, state, events), compute)
+
+    def _segments(self, exp, data, state, events, min_length):
+        # Slices of the samples of the intervals of a state (the whole recording if state is None)
+        if state is None:
+            return [slice(0, data.shape[-1])]
+        times = self.recording(exp, 'times').arrays['data']
+        bounds = np.searchsorted(times, self.intervals(exp, state, events).arrays['data'])
+        return [slice(i, j) for i, j in bounds if j - i >= min_length]
+
+    def spectrum(self, exp, name, transforms=(), state=None, events='event_times', nperseg=500, f_range=(0, 100),
+                 min_length=500):
+        """
+        Welch power spectra of every channel (as in spectral_analysis_by_intervals.py), averaged over the intervals
+        of a state that are at least min_length samples long.
+
+        Returns an entry with freqs, powers (channels x freqs) and interval_powers (intervals x channels x freqs).
+        """
+        transforms = _canonical(transforms)
+        f_range = tuple(f_range)
+
+        def compute():
+            from neurodsp.spectral import compute_spectrum_welch
+
+            data = self.recording(exp, name, transforms).arrays['data']
+            data = data if data.ndim > 1 else data[None]
+            spectra = []
+            for segment in self._segments(exp, data, state, events, min_length):
+                freqs, powers = compute_spectrum_welch(data[:, segment], fs=self.fs, nperseg=nperseg, noverlap=0,
+                                                       f_range=f_range)
+                spectra.append(powers)
+            if not spectra:
+                raise ValueError(f"No {state} interval of {exp} is at least {min_length} samples long")
+            return {'freqs': freqs, 'powers': np.mean(spectra, axis=0), 'interval_powers': np.array(spectra)}
+        return self.get(('spectrum', exp, name, transforms, state, events, nperseg, f_range, min_length), compute)
+
+    def correlation(self, exp, name, other=None, transforms=(), state=None, events='event_times', min_length=1):
+        """
+        Pearson correlation between the channels of a recording (channels x channels) or between the channels of two
+        recordings (channels x other channels), computed on the samples of the intervals of a state.
+        """
+        transforms = _canonical(transforms)
+
+        def compute():
+            def samples(recording):
+                data = self.recording(exp, recording, transforms).arrays['data']
+                data = data if data.ndim > 1 else data[None]
+                segments = self._segments(exp, data, state, events, min_length)
+                x = np.concatenate([data[:, segment] for segment in segments], axis=1).astype(np.float64)
+                x -= x.mean(axis=1, keepdims=True)
+                x /= np.linalg.norm(x, axis=1, keepdims=True)
+                return x
+            x = samples(name)
+            y = x if other is None else samples(other)
+            return {'data': x @ y.T}
+        return self.get(('correlation', exp, name, other, transforms, state, events, min_length), compute)
+
+class _Handler(socketserver.StreamRequestHandler):
+    """
+    Serve the requests of one client connection until it is closed.
+    """
+
+    def handle(self):
+        cache = self.server.cache
+        while True:
+            request = receive_message(self.connection)
+            if request is None:
+                break
+            try:
+                response = {'ok': True, 'arrays': self.server.dispatch(cache, request)}
+            except Exception as e:
+                logging.exception(f"Request {request} failed")
+                response = {'ok': False, 'error': f"{type(e).__name__}: {e}"}
+            send_message(self.connection, response)
+
+class CacheServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Unix socket server answering the requests of CacheClient from a WarmCache, every connection in its own thread.
+
+    Parameters
+    ----------
+    cache : WarmCache
+        Cache the requests are served from.
+    socket_path : str
+        Path of the Unix socket.
+    """
+    daemon_threads = True
+
+    def __init__(self, cache, socket_path=DEFAULT_SOCKET):
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        self.cache = cache
+        self.socket_path = socket_path
+        super().__init__(socket_path, _Handler)
+
+    def dispatch(self, cache, request):
+        """
+        Answer a request, returns a dict of array descriptions (or other json values).
+        """
+        op = request.pop('op')
+        if op == 'slice':
+            entry = cache.recording(request['exp'], request['name'], request.get('transforms', ()))
+            data = entry.arrays['data']
+            samples = slice(*request['samples'])
+            channels = request.get('channels')
+            if data.ndim == 1:
+                return {'data': entry.describe('data', data[samples])}
+            if isinstance(channels, list):
+                # Arbitrary channels cannot be a view, the copy is cached like any other result
+                key = ('slice', request['exp'], request['name'], _canonical(request.get('transforms', ())),
+                       tuple(channels), tuple(request['samples']))
+                entry = cache.get(key, lambda: {'data': data[channels, samples]})
+                return {'data': entry.describe('data')}
+            if isinstance(channels, dict):
+                channels = slice(*channels['slice'])
+            elif channels is None:
+                channels = slice(None)
+            return {'data': entry.describe('data', data[channels, samples])}
+        if op == 'recording':
+            entry = cache.recording(request['exp'], request['name'], request.get('transforms', ()))
+        elif op == 'intervals':
+            entry = cache.intervals(request['exp'], request.get('state', 'upstate'), request.get('events', 'event_times'))
+        elif op == 'spectrum':
+            entry = cache.spectrum(**request)
+        elif op == 'correlation':
+            entry = cache.correlation(**request)
+        elif op == 'times':
+            entry = cache.recording(request['exp'], 'times')
+            return {'data': entry.describe('data')}
+        elif op == 'stats':
+            return {'stats': cache.stats()}
+        elif op == 'clear':
+            cache.clear(request.get('exp'))
+            return {}
+        else:
+            raise ValueError(f"Unknown request {op}")
+        return {name: entry.describe(name) for name in entry.arrays}
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self.cache.clear()
+
+def serve(data_dir, socket_path=DEFAULT_SOCKET, budget=8 * 2 ** 30, fs=1000, preload=()):
+    """
+    Run the warm-cache daemon until it is interrupted (Ctrl+C or SIGTERM).
+
+    Parameters
+    ----------
+    data_dir : str
+        Folder with one subfolder of processed .npy files per experiment.
+    socket_path : str
+        Path of the Unix socket.
+    budget : int
+        Memory budget in bytes.
+    fs : float
+        Sampling rate of the recordings.
+    preload : list
+        (experiment, file name) pairs loaded at start.
+    """
+    import signal
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, stop)
+
+    cache = WarmCache(data_dir, budget, fs)
+    for exp, name in preload:
+        cache.recording(exp, name)
+    server = CacheServer(cache, socket_path)
+    logging.info(f"Serving {data_dir} on {socket_path} (budget {budget / 2 ** 30:.1f} GB), press Ctrl+C to stop")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        logging.info("Warm cache released")
+
+class CacheClient:
+    """
+    Client of the warm-cache daemon (processing/warm-cache/cache_daemon.py).
+
+    The returned arrays are read-only views of the shared memory of the daemon, nothing is copied. They stay valid
+    after the daemon evicts the entry, as long as they are referenced.
+
+    Transforms are lists of (name, arguments...) applied in order, e.g. [('rereference', 'average'),
+    ('bandpass', (7, 13))]. Available transforms: rereference (method), normalize (method), line_noise (Q, 550 by
+    default as in process_data), lowpass, highpass, bandpass and bandstop (frequency range).
+
+    Parameters
+    ----------
+    socket_path : str
+        Path of the Unix socket of the daemon.
+
+    Raises
+    ------
+    ConnectionError
+        If no daemon is listening on socket_path.
+    """
+
+    def __init__(self, socket_path=DEFAULT_SOCKET):
+        import socket
+
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.socket.connect(socket_path)
+        except (FileNotFoundError, ConnectionRefusedError) as e:
+            self.socket.close()
+            raise ConnectionError(f"No warm-cache daemon on {socket_path}") from e
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def close(self):
+        self.socket.close()
+
+    def _map(self, description):
+        # The block is unmapped when the array is not referenced anymore
+        array = map_block(attach_block(description['block']), tuple(description['shape']),
+                           np.dtype(description['dtype']), description['offset'], tuple(description['strides']))
+        array.flags.writeable = False
+        return array
+
+    def request(self, op, retries=3, **kwargs):
+        """
+        Send a request, returns a dict of arrays.
+        """
+        for attempt in range(retries):
+            send_message(self.socket, dict(kwargs, op=op))
+            response = receive_message(self.socket)
+            if response is None:
+                raise ConnectionError("The warm-cache daemon closed the connection")
+            if not response['ok']:
+                raise RuntimeError(response['error'])
+            descriptions = response['arrays']
+            try:
+                return {name: self._map(d) if isinstance(d, dict) and 'block' in d else d
+                        for name, d in descriptions.items()}
+            except FileNotFoundError:
+                # Evicted between the answer and the mapping, the daemon recomputes it
+                if attempt == retries - 1:
+                    raise
+
+    def recording(self, exp, name, transforms=()):
+        """
+        Recording (e.g. 'Probe1_lfps_spont') with the transforms applied.
+        """
+        return self.request('recording', exp=exp, name=name, transforms=transforms)['data']
+
+    def times(self, exp):
+        return self.request('times', exp=exp)['data']
+
+    def slice(self, exp, name, transforms=(), channels=None, samples=None, t_range=None):
+        """
+        Part of a recording. channels is an index, a slice or a list of channels, samples a slice of samples or
+        t_range a (start, stop) time range in seconds. Only lists of channels are copied by the daemon.
+        """
+        if t_range is not None:
+            samples = slice(*np.searchsorted(self.times(exp), t_range))
+        samples = samples or slice(None)
+        if isinstance(channels, slice):
+            channels = {'slice': [channels.start, channels.stop, channels.step]}
+        elif channels is not None and not isinstance(channels, int):
+            channels = [int(c) for c in channels]
+        return self.request('slice', exp=exp, name=name, transforms=transforms, channels=channels,
+                            samples=[samples.start and int(samples.start), samples.stop and int(samples.stop),
+                                     samples.step])['data']
+
+    def intervals(self, exp, state='upstate', events='event_times'):
+        """
+        Upstate or downstate intervals (intervals x 2, seconds).
+        """
+        return self.request('intervals', exp=exp, state=state, events=events)['data']
+
+    def spectrum(self, exp, name, transforms=(), state=None, events='event_times', nperseg=500, f_range=(0, 100),
+                 min_length=500):
+        """
+        Welch spectra of the channels averaged over the intervals of a state, returns freqs, powers (channels x freqs)
+        and interval_powers (intervals x channels x freqs).
+        """
+        result = self.request('spectrum', exp=exp, name=name, transforms=transforms, state=state, events=events,
+                              nperseg=nperseg, f_range=f_range, min_length=min_length)
+        return result['freqs'], result['powers'], result['interval_powers']
+
+    def correlation(self, exp, name, other=None, transforms=(), state=None, events='event_times'):
+        """
+        Pearson correlation between channels (of name, or of name and other) on the samples of a state.
+        """
+        return self.request('correlation', exp=exp, name=name, other=other, transforms=transforms, state=state,
+                            events=events)['data']
+
+    def stats(self):
+        return self.request('stats')['stats']
+
+    def clear(self, exp=None):
+        self.request('clear', exp=exp)